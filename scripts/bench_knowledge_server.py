@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""Benchmark knowledge_server.py tools against refs/ and a scaled-up copy of it.
+
+Each corpus is benchmarked in its own child process, in a scratch directory,
+so index caches start cold and peak memory is per corpus. Tools are called
+directly, unwrapped from the MCP, thread-pool and result-cache layers, so the
+numbers measure the work itself. Results are printed (or written) as JSON.
+"""
+
+import argparse
+import importlib
+import inspect
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent.parent
+SERVER_SCRIPT = Path(__file__).parent / "knowledge_server.py"
+REFS_DIR = ROOT_DIR / "refs"
+
+SUBSTRING_QUERIES = [
+    "newImage",
+    "fillPath",
+    "proc draw",
+    "vec2(",
+    "Image",
+    "readImage(",
+]
+REGEX_QUERIES = [r"proc\s+\w+\*", r"fill.*Path", r"^type\s", r"new\w+Image\("]
+TOPIC_QUERIES = ["image", "path", "font", "matrix"]
+SEMANTIC_QUERIES = ["draw a rounded rectangle", "load an image from a file"]
+SECTIONS_PER_LIBRARY = 5
+EXAMPLE_PAGES = 3
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    rank = max(int(-(-pct * len(sorted_values) // 100)), 1)
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies):
+    ordered = sorted(latencies)
+    total = sum(ordered)
+    return {
+        "calls": len(ordered),
+        "p50_ms": round(percentile(ordered, 50) * 1000, 3),
+        "p95_ms": round(percentile(ordered, 95) * 1000, 3),
+        "p99_ms": round(percentile(ordered, 99) * 1000, 3),
+        "mean_ms": round(total / len(ordered) * 1000, 3) if ordered else 0.0,
+        "throughput_per_s": round(len(ordered) / total, 1) if total else 0.0,
+    }
+
+
+def peak_rss_bytes():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def load_server():
+    """
+    A fresh import of knowledge_server, under its real name: the index's
+    process pool pickles its worker function by module name, and any other
+    name fails to import in the workers, silently measuring the serial path.
+    """
+    if str(SERVER_SCRIPT.parent) not in sys.path:
+        sys.path.insert(0, str(SERVER_SCRIPT.parent))
+    import knowledge_server
+
+    return importlib.reload(knowledge_server)
+
+
+def time_index_load(server):
+    start = time.perf_counter()
+    server.LIBRARY_INDEX.start()
+    libraries = list(server.LIBRARY_INDEX.values())
+    ready = time.perf_counter() - start
+    server.LIBRARY_INDEX._thread.join()
+    return libraries, {
+        "libraries_ready_s": round(ready, 4),
+        "background_done_s": round(time.perf_counter() - start, 4),
+    }
+
+
+def run_calls(func, calls, iterations):
+    latencies = []
+    for _ in range(iterations):
+        for kwargs in calls:
+            start = time.perf_counter()
+            func(**kwargs)
+            latencies.append(time.perf_counter() - start)
+    return summarize(latencies)
+
+
+def compress_corpus(server):
+    """Replace every full-context file under ./refs with its compressed form."""
+    for lib_dir in sorted(Path("refs").iterdir()):
+        plain = lib_dir / f"{lib_dir.name}{server.FULL_CONTEXT_SUFFIX}"
+        if plain.is_file():
+            target = lib_dir / f"{lib_dir.name}{server.COMPRESSED_CONTEXT_SUFFIX}"
+            server.write_compressed_context(str(plain), str(target))
+            plain.unlink()
+
+
+def bench_corpus(work_dir, iterations, compressed=False):
+    """Benchmark the corpus in work_dir/refs. Runs in the child process."""
+    os.chdir(work_dir)
+    os.environ["NIM_DOCS_RESULT_CACHE_DIR"] = ""
+    result = {}
+
+    cold = load_server()
+    if compressed:
+        compress_corpus(cold)
+    libraries, result["index_cold"] = time_index_load(cold)
+    result["corpus"] = {
+        "libraries": len(libraries),
+        "lines": sum(lib.line_count for lib in libraries),
+        "bytes": sum(
+            os.path.getsize(cold.full_context_path(lib.path, lib.name))
+            for lib in libraries
+        ),
+    }
+
+    server = load_server()
+    libraries, result["index_warm"] = time_index_load(server)
+
+    def tool(name):
+        return inspect.unwrap(getattr(server, name))
+
+    search = tool("search_nim_docs")
+    queries = {}
+    for search_type, terms in (
+        ("substring", SUBSTRING_QUERIES),
+        ("regex", REGEX_QUERIES),
+        ("topic", TOPIC_QUERIES),
+    ):
+        calls = [{"query": q, "search_type": search_type} for q in terms]
+        queries[search_type] = run_calls(search, calls, iterations)
+    queries["batch"] = run_calls(
+        tool("batch_search_nim_docs"), [{"queries": SUBSTRING_QUERIES}], iterations
+    )
+    if server.numpy is not None:
+        calls = [{"query": q} for q in SEMANTIC_QUERIES]
+        queries["semantic"] = run_calls(
+            tool("semantic_search_nim_docs"), calls, iterations
+        )
+    result["queries"] = queries
+
+    section_calls = []
+    example_calls = []
+    for lib in libraries:
+        section_calls.append({"library_name": lib.name, "section_title": ""})
+        for section in lib.sections[:SECTIONS_PER_LIBRARY]:
+            section_calls.append(
+                {"library_name": lib.name, "section_title": section.title}
+            )
+        for page in range(EXAMPLE_PAGES):
+            example_calls.append({"library_name": lib.name, "offset": page * 10})
+    result["sections"] = run_calls(
+        tool("get_nim_doc_section"), section_calls, iterations
+    )
+    result["examples"] = run_calls(
+        tool("extract_nim_code_examples"), example_calls, iterations
+    )
+
+    cached_search = getattr(server, "search_nim_docs").__wrapped__
+    cached_search(query=SUBSTRING_QUERIES[0])
+    result["cached_query"] = run_calls(
+        cached_search, [{"query": SUBSTRING_QUERIES[0]}], iterations * 10
+    )
+
+    result["peak_rss_bytes"] = peak_rss_bytes()
+    return result
+
+
+def make_synthetic_refs(target, scale):
+    """Write refs/ scaled up: every library repeated, file paths made unique."""
+    for lib_dir in sorted(REFS_DIR.iterdir()):
+        context = lib_dir / f"{lib_dir.name}_full_context.txt"
+        if not context.is_file():
+            continue
+        content = context.read_text(encoding="utf-8")
+        (target / lib_dir.name).mkdir(parents=True)
+        with open(target / lib_dir.name / context.name, "w", encoding="utf-8") as f:
+            for copy in range(scale):
+                f.write(
+                    content.replace("FILE: ", f"FILE: copy{copy}/").rstrip("\n")
+                    + "\n"
+                )
+
+
+def run_child(work_dir, iterations, compressed):
+    output = subprocess.run(
+        [
+            sys.executable,
+            __file__,
+            "--child",
+            str(work_dir),
+            "--iterations",
+            str(iterations),
+        ]
+        + (["--compressed"] if compressed else []),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT_DIR,
+            check=True,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--scale",
+        type=int,
+        action="append",
+        help="synthetic corpus size as a multiple of refs/ (repeatable; default 10)",
+    )
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--output", help="write the JSON report here")
+    parser.add_argument(
+        "--compressed",
+        action="store_true",
+        help="benchmark block-compressed copies of the corpora",
+    )
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(
+            json.dumps(bench_corpus(args.child, args.iterations, args.compressed))
+        )
+        return
+
+    if not REFS_DIR.exists():
+        print(f"Refs directory not found: {REFS_DIR}")
+        return
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.time(),
+        "iterations": args.iterations,
+        "compressed": args.compressed,
+        "corpora": {},
+    }
+    with tempfile.TemporaryDirectory(prefix="nim-docs-bench-") as scratch:
+        refs_dir = Path(scratch) / "refs" / "refs"
+        shutil.copytree(REFS_DIR, refs_dir)
+        report["corpora"]["refs"] = run_child(
+            refs_dir.parent, args.iterations, args.compressed
+        )
+
+        for scale in args.scale or [10]:
+            work_dir = Path(scratch) / f"x{scale}"
+            make_synthetic_refs(work_dir / "refs", scale)
+            report["corpora"][f"synthetic_x{scale}"] = run_child(
+                work_dir, args.iterations, args.compressed
+            )
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+        print(f"Wrote {args.output}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Compile tests/ binaries in parallel, reusing builds whose sources are unchanged."""
+
+import argparse
+import hashlib
+import os
+import re
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from clean_test_binaries import TESTS_DIR, find_test_binaries
+
+ROOT_DIR = TESTS_DIR.parent.resolve()
+SRC_DIR = ROOT_DIR / "src"
+CACHE_DIR = ROOT_DIR / ".nim_test_cache"
+MAX_CACHE_ENTRIES = 64
+NIM_FLAGS = ["--hints:off", "--warnings:off"]
+
+IMPORT_PATTERN = re.compile(
+    r"^(?:import|include|from)\b(.*(?:\n[ \t]+\S.*)*)", re.MULTILINE
+)
+IMPORT_GROUP_PATTERN = re.compile(r"([\w./]*)\[([^\]]*)\]")
+
+
+def imported_modules(source: str) -> list:
+    """Module paths named by the import, include and from statements."""
+    modules = []
+    for match in IMPORT_PATTERN.finditer(source):
+        clause = re.sub(r"#.*", "", match.group(1)).replace("\n", " ")
+        if match.group(0).startswith("from"):
+            clause = clause.split(" import ", 1)[0]
+        clause = clause.split(" except ", 1)[0]
+        clause = IMPORT_GROUP_PATTERN.sub(
+            lambda g: ", ".join(g.group(1) + m.strip() for m in g.group(2).split(",")),
+            clause,
+        )
+        for module in clause.split(","):
+            module = module.split(" as ", 1)[0].strip().strip('"')
+            if module:
+                modules.append(module)
+    return modules
+
+
+def resolve_module(module: str, importer: Path):
+    """The project file a module path refers to, or None for std and nimble."""
+    if module.startswith("std/"):
+        return None
+    for base in (importer.parent, SRC_DIR):
+        candidate = (base / f"{module}.nim").resolve()
+        if candidate.is_file() and candidate.is_relative_to(ROOT_DIR):
+            return candidate
+    return None
+
+
+def source_closure(test_file: Path) -> list:
+    """The test file and every project module it imports, transitively."""
+    seen = {test_file.resolve()}
+    pending = [test_file.resolve()]
+    while pending:
+        current = pending.pop()
+        source = current.read_text(encoding="utf-8", errors="replace")
+        for module in imported_modules(source):
+            found = resolve_module(module, current)
+            if found is not None and found not in seen:
+                seen.add(found)
+                pending.append(found)
+    return sorted(seen)
+
+
+def build_key(test_file: Path, compiler: str) -> str:
+    """Hash of the compiler, flags, config and every source the test compiles."""
+    digest = hashlib.sha256()
+    digest.update(compiler.encode("utf-8"))
+    digest.update(" ".join(NIM_FLAGS).encode("utf-8"))
+    configs = [ROOT_DIR / "config.nims", TESTS_DIR / "config.nims"]
+    for path in [p for p in configs if p.is_file()] + source_closure(test_file):
+        digest.update(str(path.resolve().relative_to(ROOT_DIR)).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(path.read_bytes())
+        digest.update(b"\0")
+    return digest.hexdigest()[:20]
+
+
+def compile_test(test_file: Path, cached: Path) -> tuple:
+    """Compile one test into the cache. Returns (ok, seconds, compiler output)."""
+    started = time.monotonic()
+    nimcache = CACHE_DIR / "nimcache" / test_file.stem
+    partial = cached.with_name(cached.name + ".partial")
+    result = subprocess.run(
+        ["nim", "c", *NIM_FLAGS, f"--nimcache:{nimcache}", f"--out:{partial}"]
+        + [str(test_file)],
+        cwd=ROOT_DIR,
+        capture_output=True,
+        text=True,
+    )
+    ok = result.returncode == 0 and partial.is_file()
+    if ok:
+        os.replace(partial, cached)
+    return ok, time.monotonic() - started, result.stdout + result.stderr
+
+
+def install_binary(cached: Path, target: Path) -> None:
+    """Put a cached binary at tests/<name>, as `nim c` would have."""
+    if target.exists():
+        target.unlink()
+    try:
+        os.link(cached, target)
+    except OSError:
+        shutil.copy2(cached, target)
+
+
+def evict_cache(keep: set, max_entries: int) -> int:
+    """Delete the least recently used cached binaries beyond max_entries."""
+    entries = [p for p in CACHE_DIR.glob("*-*") if p.is_file() and p not in keep]
+    entries.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    evicted = 0
+    for entry in entries[max(max_entries - len(keep), 0) :]:
+        entry.unlink()
+        evicted += 1
+    return evicted
+
+
+def select_tests(args) -> list:
+    if args.tests:
+        return [Path(t).resolve() for t in args.tests]
+    tests = sorted(TESTS_DIR.glob("*_test.nim"))
+    if args.golden:
+        tests += sorted(TESTS_DIR.glob("test_golden_*.nim"))
+    return tests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "tests", nargs="*", help="test files (default: tests/*_test.nim)"
+    )
+    parser.add_argument("--golden", action="store_true", help="also build golden tests")
+    parser.add_argument("--run", action="store_true", help="run the tests once built")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--max-entries", type=int, default=MAX_CACHE_ENTRIES)
+    args = parser.parse_args()
+
+    if not TESTS_DIR.exists():
+        print(f"Tests directory not found: {TESTS_DIR}")
+        return
+
+    try:
+        compiler = subprocess.run(
+            ["nim", "--version"], capture_output=True, text=True, check=True
+        ).stdout.splitlines()[0]
+    except (OSError, subprocess.CalledProcessError, IndexError):
+        print("Could not run `nim --version`; is Nim on PATH?")
+        sys.exit(1)
+
+    CACHE_DIR.mkdir(exist_ok=True)
+    tests = select_tests(args)
+    planned = {t: CACHE_DIR / f"{t.stem}-{build_key(t, compiler)}" for t in tests}
+
+    for binary in find_test_binaries():
+        if not binary.with_name(f"{binary.name}.nim").exists():
+            binary.unlink()  # Its test was deleted or renamed.
+            print(f"Deleted: {binary.name}")
+
+    stale = [t for t, cached in planned.items() if not cached.is_file()]
+    for test, cached in planned.items():
+        if cached.is_file():
+            os.utime(cached)
+            print(f"Cached: {test.stem}")
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+        builds = pool.map(lambda t: compile_test(t, planned[t]), stale)
+        for test, (ok, seconds, output) in zip(stale, builds):
+            if ok:
+                print(f"Compiled: {test.stem} ({seconds:.1f}s)")
+            else:
+                failed.append(test)
+                print(f"FAIL (compile): {test.stem}\n{output}")
+
+    for test, cached in planned.items():
+        if cached.is_file():
+            install_binary(cached, TESTS_DIR / test.stem)
+        elif (TESTS_DIR / test.stem).exists():
+            (TESTS_DIR / test.stem).unlink()  # Never leave an outdated build.
+
+    evicted = evict_cache(set(planned.values()), args.max_entries)
+    print(
+        f"\n{len(tests) - len(stale)} cached, {len(stale) - len(failed)} compiled, "
+        f"{len(failed)} failed, {evicted} evicted"
+    )
+
+    if args.run:
+        for test in tests:
+            if test in failed:
+                continue
+            result = subprocess.run([str(TESTS_DIR / test.stem)], cwd=ROOT_DIR)
+            print(f"  {'PASS' if result.returncode == 0 else 'FAIL'}: {test.stem}")
+            if result.returncode != 0:
+                failed.append(test)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
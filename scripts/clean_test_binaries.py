@@ -7,17 +7,23 @@ from pathlib import Path
 TESTS_DIR = Path(__file__).parent.parent / "tests"
 
 
+def find_test_binaries():
+    """Executables without an extension in tests/, i.e. compiled tests."""
+    for entry in TESTS_DIR.iterdir():
+        if entry.is_file() and not entry.suffix and os.access(entry, os.X_OK):
+            yield entry
+
+
 def main():
     if not TESTS_DIR.exists():
         print(f"Tests directory not found: {TESTS_DIR}")
         return
 
     deleted = 0
-    for entry in TESTS_DIR.iterdir():
-        if entry.is_file() and not entry.suffix and os.access(entry, os.X_OK):
-            entry.unlink()
-            print(f"Deleted: {entry.name}")
-            deleted += 1
+    for entry in list(find_test_binaries()):
+        entry.unlink()
+        print(f"Deleted: {entry.name}")
+        deleted += 1
 
     print(f"\nDeleted {deleted} test binary(ies)")
 
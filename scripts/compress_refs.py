@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Convert refs/ full-context dumps to the block-compressed form, or back.
+
+knowledge_server.py reads <lib>_full_context.txtz in place of a missing
+<lib>_full_context.txt, decompressing only the blocks a tool call touches.
+The plain file is removed once its compressed copy has been verified, since
+it would otherwise take precedence.
+"""
+
+import argparse
+import os
+from pathlib import Path
+
+from knowledge_server import (
+    COMPRESSED_CONTEXT_SUFFIX,
+    FULL_CONTEXT_SUFFIX,
+    CompressedDocument,
+    write_compressed_context,
+)
+
+REFS_DIR = Path(__file__).parent.parent / "refs"
+
+
+def compress(lib_dir: Path, codec: str, keep: bool) -> None:
+    plain = lib_dir / f"{lib_dir.name}{FULL_CONTEXT_SUFFIX}"
+    if not plain.is_file():
+        print(f"Skipped: {lib_dir.name} (no {plain.name})")
+        return
+    target = lib_dir / f"{lib_dir.name}{COMPRESSED_CONTEXT_SUFFIX}"
+    frames, text_bytes, compressed_bytes = write_compressed_context(
+        str(plain), str(target), codec
+    )
+
+    document = CompressedDocument(str(target))
+    try:
+        verified = document.read_all() == plain.read_bytes()
+    finally:
+        document.close()
+    if not verified:
+        target.unlink()
+        print(f"FAIL: {lib_dir.name} did not round-trip; left uncompressed")
+        return
+
+    # Keep the plain file's mtime, so the index cache stays valid.
+    stat = plain.stat()
+    os.utime(target, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    if not keep:
+        plain.unlink()
+    print(
+        f"Compressed: {lib_dir.name} {text_bytes} -> {compressed_bytes} bytes "
+        f"in {frames} frames ({document.codec})"
+    )
+
+
+def extract(lib_dir: Path) -> None:
+    source = lib_dir / f"{lib_dir.name}{COMPRESSED_CONTEXT_SUFFIX}"
+    if not source.is_file():
+        print(f"Skipped: {lib_dir.name} (no {source.name})")
+        return
+    document = CompressedDocument(str(source))
+    try:
+        data = document.read_all()
+    finally:
+        document.close()
+    plain = lib_dir / f"{lib_dir.name}{FULL_CONTEXT_SUFFIX}"
+    plain.write_bytes(data)
+    stat = source.stat()
+    os.utime(plain, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    source.unlink()
+    print(f"Extracted: {lib_dir.name} ({len(data)} bytes)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("libraries", nargs="*", help="library names (default: all)")
+    parser.add_argument(
+        "--codec",
+        choices=["zlib", "zstd"],
+        help="default: zstd if the zstandard module is installed, else zlib",
+    )
+    parser.add_argument(
+        "--keep", action="store_true", help="keep the plain text files too"
+    )
+    parser.add_argument(
+        "--extract", action="store_true", help="restore the plain text files"
+    )
+    args = parser.parse_args()
+
+    if not REFS_DIR.exists():
+        print(f"Refs directory not found: {REFS_DIR}")
+        return
+
+    lib_dirs = sorted(p for p in REFS_DIR.iterdir() if p.is_dir())
+    if args.libraries:
+        wanted = {name.lower() for name in args.libraries}
+        lib_dirs = [p for p in lib_dirs if p.name.lower() in wanted]
+
+    for lib_dir in lib_dirs:
+        if args.extract:
+            extract(lib_dir)
+        else:
+            compress(lib_dir, args.codec or "", args.keep)
+
+
+if __name__ == "__main__":
+    main()
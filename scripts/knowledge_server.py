@@ -1,16 +1,276 @@
 import os
 import re
+import asyncio
 import json
+import math
+import marshal
+import threading
+import multiprocessing
+import time
+import bisect
+import hashlib
+import inspect
+import functools
+import heapq
+import select
+import contextvars
+import ctypes
+import io
+import pickle
+import struct
+import subprocess
+import sys
+import zlib
+import random
+import cProfile
+from array import array
+from itertools import accumulate
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing.connection import Connection
 import fnmatch
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Callable, Iterator
 from dataclasses import dataclass, field
 from enum import Enum
 from mcp.server.fastmcp import FastMCP
 
+try:
+    import re._parser as regex_parser  # Python 3.11+
+except ImportError:
+    import sre_parse as regex_parser
+
+try:
+    import regex as regex_engine  # optional: adds per-call match timeouts
+except ImportError:
+    regex_engine = None
+
+try:
+    import resource  # optional: peak memory in get_knowledge_server_stats
+except ImportError:
+    resource = None
+
+try:
+    import numpy  # optional: needed by semantic_search_nim_docs
+except ImportError:
+    numpy = None
+
+try:
+    import zstandard  # optional: zstd frames in compressed full-context files
+except ImportError:
+    zstandard = None
+
 mcp = FastMCP("NimKnowledgeBase")
 
 DOCS_PATH = "./refs"
-INDEX_CACHE_FILE = "./.nim_docs_index.json"
+INDEX_CACHE_FILE = "./.nim_docs_index.bin"
+MANIFEST_FILE = "./.nim_docs_manifest.json"
+FULL_CONTEXT_SUFFIX = "_full_context.txt"
+COMPRESSED_CONTEXT_SUFFIX = "_full_context.txtz"
+COMPRESSED_MAGIC = b"NIMCTXZ1"
+COMPRESSED_HEADER = struct.Struct("<8s4sI")  # magic, codec, frame count
+COMPRESSED_FRAME_BYTES = 16 * 1024
+COMPRESSED_CACHED_FRAMES = 64
+INDEX_VERSION = 9
+INDEX_CACHE_FORMAT = f"nim-docs-{INDEX_VERSION}-marshal-{marshal.version}"
+INDEX_CHUNK_LINES = 5000
+PARALLEL_INDEX_MIN_LINES = 100000
+TRIGRAM_PAGE_LINES = 32
+RESULT_CACHE_DIR = os.environ.get("NIM_DOCS_RESULT_CACHE_DIR", "./.nim_docs_results")
+RESULT_CACHE_SIZE = 256
+RESULT_CACHE_DISK_ENTRIES = 2048
+TRACE_FILE = os.environ.get("NIM_DOCS_TRACE_FILE", "")
+PROFILE_TOOLS = frozenset(
+    name.strip()
+    for name in os.environ.get("NIM_DOCS_PROFILE_TOOLS", "").split(",")
+    if name.strip()
+)
+PROFILE_RATE = float(os.environ.get("NIM_DOCS_PROFILE_RATE", "1.0"))
+PROFILE_DIR = os.environ.get("NIM_DOCS_PROFILE_DIR", "./.nim_docs_profiles")
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+LATENCY_SAMPLES = 1024
+TOOL_WORKERS = int(os.environ.get("NIM_DOCS_TOOL_WORKERS", "4"))
+WATCH_INTERVAL = float(os.environ.get("NIM_DOCS_WATCH_INTERVAL", "2.0"))
+WATCH_SETTLE = 0.5
+SEMANTIC_INDEX_FILE = "./.nim_docs_semantic.npz"
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9_]+")
+HEADER_PATTERN = re.compile(r"^(#{1,6})\s+(.+)$")
+GITINGEST_SEPARATOR = "=" * 48
+MARKDOWN_EXTENSIONS = (".md", ".markdown", ".rst")
+NIM_EXTENSIONS = (".nim", ".nims")
+
+NIM_ROUTINE_PATTERN = re.compile(
+    r"^(\s*)(proc|func|method|iterator|converter|template|macro)\s+"
+    r"(`[^`]+`|[A-Za-z_][A-Za-z0-9_]*)\s*(\*?)"
+)
+NIM_SECTION_PATTERN = re.compile(r"^(\s*)(type|const)\b\s*(.*)$")
+NIM_DEFINITION_PATTERN = re.compile(
+    r"^(\s*)([A-Za-z_][A-Za-z0-9_]*)\s*(\*?)\s*(\[[^\]]*\])?\s*"
+    r"(\{\.[^}]*\.\})?\s*(?::\s*[^=]+)?=\s*(.*)$"
+)
+NIM_FIELD_PATTERN = re.compile(
+    r"^\s+((?:[A-Za-z_][A-Za-z0-9_]*\*?\s*,\s*)*[A-Za-z_][A-Za-z0-9_]*\*?)"
+    r"\s*(?:\{\.[^}]*\.\})?\s*:\s*([^#=]+)"
+)
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+TEXT_SCORE_SCALE = 10.0
+SNIPPET_BEFORE = 3
+SNIPPET_AFTER = 10
+PACK_MAX_HITS = 50
+PACK_REGEX_LINES = 20
+PACK_MIN_CHARS = 120
+
+REGEX_CACHE_SIZE = 128
+REGEX_TIME_BUDGET = 0.5
+REGEX_CHUNK_LINES = 512
+REGEX_MAX_LINES = 10
+REGEX_POLL_INTERVAL = 0.02
+REGEX_WORKER_SCRIPT = os.path.join(os.path.dirname(__file__), "regex_worker.py")
+
+BATCH_MAX_QUERIES = 50
+
+SEMANTIC_WORD_PATTERN = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|[0-9]+")
+SEMANTIC_PREFIX_CHARS = 4
+SEMANTIC_UNIT_LINES = 40
+SEMANTIC_STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from get how i in is it me my of "
+    "on or should that the this to use using what when where which with you".split()
+)
+
+
+@dataclass
+class Header:
+    """One markdown header, and the section that runs from it to end_line."""
+
+    __slots__ = ("title", "level", "line", "end_line", "file", "parent")
+    title: str
+    level: int
+    line: int
+    end_line: int
+    file: int
+    parent: int
+
+    @property
+    def start_line(self) -> int:
+        return self.line
+
+    @property
+    def line_count(self) -> int:
+        return self.end_line - self.line
+
+    def header_dict(self) -> Dict[str, Any]:
+        return {
+            "title": self.title,
+            "level": self.level,
+            "line": self.line,
+            "file": self.file,
+            "parent": self.parent,
+        }
+
+    def section_dict(self) -> Dict[str, Any]:
+        return {
+            "title": self.title,
+            "level": self.level,
+            "start_line": self.line,
+            "end_line": self.end_line,
+            "file": self.file,
+            "line_count": self.line_count,
+        }
+
+
+class HeaderTable:
+    """
+    The headers of a library as parallel array columns, with each distinct
+    title stored once in a string table. Every header also starts a section,
+    so the same table serves as LibraryIndex.headers and .sections; rows are
+    materialised as Header objects only when read.
+    """
+
+    __slots__ = (
+        "titles",
+        "title_ids",
+        "levels",
+        "lines",
+        "end_lines",
+        "files",
+        "parents",
+        "_title_lookup",
+    )
+    COLUMNS = (
+        ("title_ids", "I"),
+        ("levels", "B"),
+        ("lines", "I"),
+        ("end_lines", "I"),
+        ("files", "i"),
+        ("parents", "i"),
+    )
+
+    def __init__(self):
+        self.titles: List[str] = []
+        for name, typecode in self.COLUMNS:
+            setattr(self, name, array(typecode))
+        self._title_lookup: Optional[Dict[str, int]] = None
+
+    def append(
+        self, title: str, level: int, line: int, end_line: int, file: int, parent: int
+    ) -> None:
+        if self._title_lookup is None:
+            self._title_lookup = {t: i for i, t in enumerate(self.titles)}
+        title_id = self._title_lookup.get(title)
+        if title_id is None:
+            title_id = self._title_lookup[title] = len(self.titles)
+            self.titles.append(title)
+        self.title_ids.append(title_id)
+        self.levels.append(level)
+        self.lines.append(line)
+        self.end_lines.append(end_line)
+        self.files.append(file)
+        self.parents.append(parent)
+
+    def __len__(self) -> int:
+        return len(self.title_ids)
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+        return Header(
+            self.titles[self.title_ids[key]],
+            self.levels[key],
+            self.lines[key],
+            self.end_lines[key],
+            self.files[key],
+            self.parents[key],
+        )
+
+    def __iter__(self) -> Iterator[Header]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def find_titles(self, query_lower: str) -> List[int]:
+        """Rows whose title contains query_lower, ignoring case, in order."""
+        matching = {
+            i for i, title in enumerate(self.titles) if query_lower in title.lower()
+        }
+        if not matching:
+            return []
+        return [row for row, t in enumerate(self.title_ids) if t in matching]
+
+    def to_dict(self) -> Dict[str, Any]:
+        data: Dict[str, Any] = {"titles": self.titles}
+        for name, _ in self.COLUMNS:
+            data[name] = getattr(self, name).tobytes()
+        return data
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "HeaderTable":
+        table = cls()
+        table.titles = data["titles"]
+        for name, _ in cls.COLUMNS:
+            getattr(table, name).frombytes(data[name])
+        return table
 
 
 @dataclass
@@ -18,10 +278,113 @@ class LibraryIndex:
     name: str
     path: str
     description: str
-    sections: List[Dict[str, Any]] = field(default_factory=list)
-    headers: List[Dict[str, Any]] = field(default_factory=list)
+    headers: HeaderTable = field(default_factory=HeaderTable)
     topics: List[str] = field(default_factory=list)
     file_mtime: float = 0.0
+    version: int = 0
+    code_blocks: List[Dict[str, Any]] = field(default_factory=list)
+    files: List[Dict[str, Any]] = field(default_factory=list)
+    avg_line_terms: float = 0.0
+    line_count: int = 0
+    token_starts: List[int] = field(default_factory=list, repr=False)
+    postings: Dict[str, List[int]] = field(default_factory=dict, repr=False)
+    symbols: List[Dict[str, Any]] = field(default_factory=list)
+    trigram_pages: Dict[str, int] = field(default_factory=dict, repr=False)
+    page_starts: List[int] = field(default_factory=list, repr=False)
+    file_lookup: Dict[str, int] = field(default_factory=dict, repr=False)
+    file_starts: List[int] = field(default_factory=list, repr=False)
+    symbol_lookup: Dict[str, List[int]] = field(default_factory=dict, repr=False)
+    symbol_keys: List[str] = field(default_factory=list, repr=False)
+    header_lines: List[int] = field(default_factory=list, repr=False)
+    fence_starts: List[int] = field(default_factory=list, repr=False)
+
+    def __post_init__(self):
+        if isinstance(self.headers, dict):
+            self.headers = HeaderTable.from_dict(self.headers)
+        self.refresh_lookups()
+
+    @property
+    def sections(self) -> HeaderTable:
+        """Section i runs from header i to the next header of its level or above."""
+        return self.headers
+
+    def refresh_lookups(self) -> None:
+        self.file_lookup = {entry["path"]: i for i, entry in enumerate(self.files)}
+        self.file_starts = [entry["start_line"] for entry in self.files]
+        self.symbol_lookup = {}
+        for i, symbol in enumerate(self.symbols):
+            key = normalize_nim_identifier(symbol["name"])
+            self.symbol_lookup.setdefault(key, []).append(i)
+        self.symbol_keys = sorted(self.symbol_lookup)
+        self.header_lines = self.headers.lines.tolist()
+        self.fence_starts = [b["start_line"] for b in self.code_blocks]
+
+    def to_dict(self) -> Dict[str, Any]:
+        data = {n: v for n, v in self.__dict__.items() if n not in TRANSIENT_FIELDS}
+        data["headers"] = self.headers.to_dict()
+        return data
+
+    def summary(self) -> Dict[str, Any]:
+        """The small subset of the index that list_nim_libraries reports."""
+        return {
+            "name": self.name,
+            "description": self.description,
+            "topics": self.topics,
+            "section_count": len(self.sections),
+            "header_count": len(self.headers),
+            "file_mtime": self.file_mtime,
+        }
+
+    def find_symbols(self, name: str, prefix: bool = False) -> List[int]:
+        """Symbol indices whose name equals (or starts with) a Nim identifier."""
+        key = normalize_nim_identifier(name)
+        if not prefix:
+            return list(self.symbol_lookup.get(key, []))
+        found: List[int] = []
+        i = bisect.bisect_left(self.symbol_keys, key)
+        while i < len(self.symbol_keys) and self.symbol_keys[i].startswith(key):
+            found.extend(self.symbol_lookup[self.symbol_keys[i]])
+            i += 1
+        return found
+
+    def find_files(self, file_path: str) -> List[Dict[str, Any]]:
+        """
+        Look up FILE blocks by exact path, falling back to every block whose
+        path ends with it; more than one entry means the suffix is ambiguous.
+        """
+        path = file_path.strip()
+        if path.startswith("./"):
+            path = path[2:]
+        file_idx = self.file_lookup.get(path)
+        if file_idx is not None:
+            return [self.files[file_idx]]
+        return [entry for entry in self.files if entry["path"].endswith("/" + path)]
+
+    def file_at_line(self, line: int) -> Optional[Dict[str, Any]]:
+        """Return the FILE block containing a line, if any."""
+        f = bisect.bisect_right(self.file_starts, line) - 1
+        if f >= 0 and line < self.files[f]["end_line"]:
+            return self.files[f]
+        return None
+
+
+TRANSIENT_FIELDS = (
+    "file_lookup",
+    "file_starts",
+    "symbol_lookup",
+    "symbol_keys",
+    "header_lines",
+    "fence_starts",
+)
+
+
+def normalize_nim_identifier(name: str) -> str:
+    """
+    Nim identifiers ignore case and underscores after their first character,
+    which is case-sensitive, so compare them that way.
+    """
+    name = name.strip().strip("`")
+    return name[:1] + name[1:].replace("_", "").lower()
 
 
 class SearchType(Enum):
@@ -30,137 +393,747 @@ class SearchType(Enum):
     TOPIC = "topic"
 
 
-def load_library_index() -> Dict[str, LibraryIndex]:
-    if not os.path.exists(INDEX_CACHE_FILE):
-        return build_library_index()
+def load_library_index(
+    on_ready: Optional[Callable[[str, LibraryIndex], None]] = None,
+) -> Dict[str, LibraryIndex]:
+    """
+    Load every library from the index cache, rebuilding the stale ones.
 
-    try:
-        with open(INDEX_CACHE_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            cached_index = {k: LibraryIndex(**v) for k, v in data.items()}
-    except Exception:
-        return build_library_index()
+    on_ready, if given, is called with each library as soon as it is usable:
+    cached libraries first, then each rebuilt library in turn.
+    """
+    if not os.path.exists(DOCS_PATH):
+        return {}
+
+    started = time.perf_counter()
+    cache = load_index_cache()
+    METRICS.record_index(
+        "cache_load",
+        time.perf_counter() - started,
+        libraries=len(cache.get("libraries", {})),
+    )
+    cached_libraries: Dict[str, Dict[str, Any]] = cache.get("libraries", {})
+    block_cache: Dict[str, Dict[str, Any]] = cache.get("blocks", {})
 
     libraries: Dict[str, LibraryIndex] = {}
     libs_to_rebuild: List[str] = []
 
-    for lib_key, lib in cached_index.items():
-        full_context_file = os.path.join(lib.path, f"{lib.name}_full_context.txt")
+    for item in list_library_dirs():
+        full_context_file = full_context_path(os.path.join(DOCS_PATH, item), item)
         if not os.path.exists(full_context_file):
-            libs_to_rebuild.append(lib_key)
             continue
 
+        entry = cached_libraries.get(item.lower())
         current_mtime = os.path.getmtime(full_context_file)
-        if abs(current_mtime - lib.file_mtime) > 0.001:
-            libs_to_rebuild.append(lib_key)
+        if entry is None or abs(current_mtime - entry["file_mtime"]) > 0.001:
+            libs_to_rebuild.append(item)
         else:
+            libraries[item.lower()] = LibraryIndex(**entry)
+            if on_ready is not None:
+                on_ready(item.lower(), libraries[item.lower()])
+
+    for item in libs_to_rebuild:
+        started = time.perf_counter()
+        rebuilt = build_libraries([item], block_cache)
+        METRICS.record_index("build", time.perf_counter() - started, library=item)
+        for lib_key, lib in rebuilt.items():
             libraries[lib_key] = lib
+            if on_ready is not None:
+                on_ready(lib_key, lib)
+
+    if libs_to_rebuild or set(libraries) != set(cached_libraries):
+        for lib_key in set(block_cache) - set(libraries):
+            del block_cache[lib_key]
+        save_index_cache(libraries, block_cache)
+
+    return libraries
+
+
+def full_context_path(lib_dir: str, item: str) -> str:
+    """
+    A library's full-context file: the plain text dump when there is one, else
+    its compressed form, else the plain path, which then does not exist.
+    """
+    plain = os.path.join(lib_dir, f"{item}{FULL_CONTEXT_SUFFIX}")
+    if os.path.exists(plain):
+        return plain
+    compressed = os.path.join(lib_dir, f"{item}{COMPRESSED_CONTEXT_SUFFIX}")
+    return compressed if os.path.exists(compressed) else plain
+
+
+def read_full_context(filepath: str) -> str:
+    """A full-context file's text, plain or compressed, with newlines as \\n."""
+    if not filepath.endswith(COMPRESSED_CONTEXT_SUFFIX):
+        with open(filepath, "r", encoding="utf-8") as f:
+            return f.read()
+    document = CompressedDocument(filepath)
+    try:
+        text = document.read_all().decode("utf-8")
+    finally:
+        document.close()
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+def list_library_dirs() -> List[str]:
+    return sorted(
+        item
+        for item in os.listdir(DOCS_PATH)
+        if os.path.isdir(os.path.join(DOCS_PATH, item))
+    )
+
 
-    if libs_to_rebuild:
-        rebuilt = build_libraries(libs_to_rebuild)
-        libraries.update(rebuilt)
+def load_index_cache() -> Dict[str, Any]:
+    """Read the binary index cache, or return {} if it is missing or stale."""
+    if not os.path.exists(INDEX_CACHE_FILE):
+        return {}
+
+    try:
+        with open(INDEX_CACHE_FILE, "rb") as f:
+            data = marshal.loads(f.read())
+        if data.get("format") != INDEX_CACHE_FORMAT:
+            return {}
+        return data
+    except Exception:
+        return {}
+
+
+def save_index_cache(
+    libraries: Dict[str, LibraryIndex], block_cache: Dict[str, Dict[str, Any]]
+) -> None:
+    """Write the index cache with marshal, replacing the old file atomically."""
+    data = {
+        "format": INDEX_CACHE_FORMAT,
+        "libraries": {k: lib.to_dict() for k, lib in libraries.items()},
+        "blocks": block_cache,
+    }
+    manifest = {
+        "format": INDEX_CACHE_FORMAT,
+        "libraries": {k: lib.summary() for k, lib in libraries.items()},
+    }
+    write_atomically(INDEX_CACHE_FILE, marshal.dumps(data))
+    write_atomically(MANIFEST_FILE, json.dumps(manifest).encode("utf-8"))
+
+
+def load_manifest() -> Dict[str, Dict[str, Any]]:
+    """Read the per-library summaries written next to the index cache."""
+    try:
+        with open(MANIFEST_FILE, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format") != INDEX_CACHE_FORMAT:
+            return {}
+        return manifest["libraries"]
+    except Exception:
+        return {}
+
+
+def write_atomically(path: str, payload: bytes) -> None:
+    tmp_file = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_file, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_file, path)
+    except Exception:
         try:
-            with open(INDEX_CACHE_FILE, "w", encoding="utf-8") as f:
-                json.dump({k: v.__dict__ for k, v in libraries.items()}, f, indent=2)
-        except Exception:
+            os.remove(tmp_file)
+        except OSError:
             pass
 
-    return libraries
 
+def build_libraries(
+    lib_names: List[str], block_cache: Optional[Dict[str, Dict[str, Any]]] = None
+) -> Dict[str, LibraryIndex]:
+    """
+    Index the named libraries. Each full-context file is split into its FILE
+    blocks; blocks whose content hash is already in block_cache are reused,
+    the rest are indexed (in a process pool when there is enough work), and
+    the per-block results are merged into one LibraryIndex per library.
+
+    block_cache is updated in place to hold exactly the current blocks.
+    """
+    if block_cache is None:
+        block_cache = {}
 
-def build_libraries(lib_names: List[str]) -> Dict[str, LibraryIndex]:
     libraries: Dict[str, LibraryIndex] = {}
+    plans: List[tuple] = []
+    pending: List[tuple] = []
 
     for item in lib_names:
         lib_path = os.path.join(DOCS_PATH, item)
         if not os.path.isdir(lib_path):
             continue
 
-        full_context_file = os.path.join(lib_path, f"{item}_full_context.txt")
+        full_context_file = full_context_path(lib_path, item)
         if not os.path.exists(full_context_file):
             continue
 
+        try:
+            file_mtime = os.path.getmtime(full_context_file)
+            content = read_full_context(full_context_file)
+        except Exception as e:
+            print(f"Error indexing {item}: {e}", file=sys.stderr)
+            continue
+
+        lines = content.split("\n")
+        has_file_markers = any(
+            parse_file_marker(lines, i)
+            for i, line in enumerate(lines)
+            if line.startswith((GITINGEST_SEPARATOR, "--- START OF FILE:"))
+        )
+        old_blocks = block_cache.get(item.lower(), {})
+        spans = split_file_blocks(lines) if has_file_markers else [(0, len(lines))]
+
+        block_keys: List[str] = []
+        for start, end in spans:
+            block_lines = lines[start:end]
+            digest = hashlib.sha1("\n".join(block_lines).encode("utf-8")).hexdigest()
+            key = f"{int(has_file_markers)}:{digest}"
+            block_keys.append(key)
+            if key not in old_blocks:
+                pending.append((item.lower(), key, block_lines, not has_file_markers))
+
+        plans.append((item, lib_path, file_mtime, content, lines, spans, block_keys))
+
+    indexed = index_pending_blocks(pending)
+
+    for item, lib_path, file_mtime, content, lines, spans, block_keys in plans:
+        lib_key = item.lower()
+        old_blocks = block_cache.get(lib_key, {})
+        blocks = {
+            key: indexed.get((lib_key, key)) or old_blocks[key] for key in block_keys
+        }
+
         index = LibraryIndex(
-            name=item, path=lib_path, description="", sections=[], headers=[], topics=[]
+            name=item,
+            path=lib_path,
+            description="",
+            topics=[],
+            version=INDEX_VERSION,
         )
+        merge_blocks(index, [blocks[key] for key in block_keys], lines, spans)
+        index.description = extract_description(content)
+        index.file_mtime = file_mtime
+
+        block_cache[lib_key] = blocks
+        libraries[lib_key] = index
+
+    return libraries
+
 
+def split_file_blocks(lines: List[str]) -> List[tuple]:
+    """Split lines into a preamble plus one (start, end) span per FILE block."""
+    starts = [
+        i
+        for i, line in enumerate(lines)
+        if line.startswith((GITINGEST_SEPARATOR, "--- START OF FILE:"))
+        and parse_file_marker(lines, i)
+    ]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    ends = starts[1:] + [len(lines)]
+    return list(zip(starts, ends))
+
+
+def index_pending_blocks(pending: List[tuple]) -> Dict[tuple, Dict[str, Any]]:
+    """
+    Index (lib_key, block_key, lines, markdown_default) work items.
+
+    Items are batched into chunks of about INDEX_CHUNK_LINES lines, so a large
+    library is spread over several workers. The process pool is only used
+    when there is enough work to pay for it, and indexing falls back to this
+    process if the pool cannot be used.
+    """
+    total_lines = sum(len(item[2]) for item in pending)
+    batches: List[List[tuple]] = [[]]
+    batch_lines = 0
+    for item in pending:
+        if batch_lines >= INDEX_CHUNK_LINES:
+            batches.append([])
+            batch_lines = 0
+        batches[-1].append(item)
+        batch_lines += len(item[2])
+
+    workers = min(os.cpu_count() or 1, len(batches))
+    results: Optional[List[List[Dict[str, Any]]]] = None
+    if workers > 1 and total_lines >= PARALLEL_INDEX_MIN_LINES:
         try:
-            with open(full_context_file, "r", encoding="utf-8") as f:
-                content = f.read()
-                lines = content.split("\n")
-
-                in_section = False
-                current_section: Dict[str, Any] = {}
-                section_count = 0
-                found_headers: List[Dict[str, Any]] = []
-                found_topics: set = set()
-
-                for i, line in enumerate(lines):
-                    header_match = re.match(r"^(#{1,6})\s+(.+)$", line)
-                    if header_match:
-                        level = len(header_match.group(1))
-                        title = header_match.group(2).strip()
-                        header_entry: Dict[str, Any] = {
-                            "title": title,
-                            "level": level,
-                            "line": i,
-                        }
-                        found_headers.append(header_entry)
-                        found_topics.update(extract_topics(title))
-                        section_count += 1
-                        current_section = {
-                            "title": title,
-                            "level": level,
-                            "start_line": i,
-                            "line_count": 0,
-                        }
-                        index.sections.append(current_section)
-                        in_section = True
-                    elif in_section and line.startswith("--- END OF FILE:"):
-                        index.sections[-1]["end_line"] = i
-                        index.sections[-1]["line_count"] = (
-                            i - index.sections[-1]["start_line"]
-                        )
-                        in_section = False
-                    elif in_section:
-                        index.sections[-1]["line_count"] = (
-                            i - index.sections[-1]["start_line"]
-                        )
+            with ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                results = list(
+                    pool.map(
+                        index_block_batch,
+                        [[(item[2], item[3]) for item in batch] for batch in batches],
+                    )
+                )
+        except (BrokenProcessPool, pickle.PicklingError, OSError) as e:
+            print(
+                f"Parallel indexing failed, indexing in this process: {e!r}",
+                file=sys.stderr,
+            )
+            results = None
+    if results is None:
+        results = [
+            index_block_batch([(item[2], item[3]) for item in batch])
+            for batch in batches
+        ]
+
+    indexed: Dict[tuple, Dict[str, Any]] = {}
+    for batch, batch_results in zip(batches, results):
+        for item, result in zip(batch, batch_results):
+            indexed[(item[0], item[1])] = result
+    return indexed
+
+
+def index_block_batch(batch: List[tuple]) -> List[Dict[str, Any]]:
+    return [index_block(lines, markdown_default) for lines, markdown_default in batch]
+
+
+def parse_file_marker(lines: List[str], i: int) -> Optional[tuple]:
+    """
+    Recognise a file boundary at line i, either the gitingest layout
+    (separator / "FILE: path" / separator) or "--- START OF FILE: path ---".
+
+    Returns (path, first content line) or None.
+    """
+    line = lines[i]
+    if line.startswith("--- START OF FILE:"):
+        return line[len("--- START OF FILE:") :].strip(" -"), i + 1
+    if (
+        line.startswith(GITINGEST_SEPARATOR)
+        and i + 2 < len(lines)
+        and lines[i + 1].startswith("FILE: ")
+        and lines[i + 2].startswith(GITINGEST_SEPARATOR)
+    ):
+        return lines[i + 1][len("FILE: ") :].strip(), i + 3
+    return None
 
-                index.headers = found_headers
-                index.topics = sorted(list(found_topics))
 
-                first_desc = extract_description(content)
-                index.description = first_desc
+def index_block(lines: List[str], markdown_default: bool) -> Dict[str, Any]:
+    """
+    Index one block of a full-context file: its postings, per-line token
+    counts, trigram pages, file span, header tree, sections, code blocks and
+    Nim symbols, with line numbers, byte offsets and file indices relative to
+    the block.
 
-                index.file_mtime = os.path.getmtime(full_context_file)
+    Trigram pages map each lowercase trigram to a bitmask of the block's
+    TRIGRAM_PAGE_LINES-line pages whose lines contain it.
 
-        except Exception as e:
-            print(f"Error indexing {item}: {e}")
+    Markdown headers are only taken from markdown files (or from text outside
+    any file when markdown_default is set), outside fenced code, so Nim
+    comments do not show up as sections.
+    """
+    line_starts = [0]
+    for line in lines[:-1]:
+        line_starts.append(line_starts[-1] + len(line.encode("utf-8")) + 1)
+
+    files: List[Dict[str, Any]] = []
+    found_headers: List[Dict[str, Any]] = []
+    found_topics: set = set()
+    postings: Dict[str, List[int]] = {}
+    token_counts: List[int] = []
+    trigram_pages: Dict[str, int] = {}
+    code_blocks: List[Dict[str, Any]] = []
+    fence_start: Optional[int] = None
+    fence_lang = ""
+    term_count = 0
+    in_markdown = markdown_default
+    content_start = 0
+
+    for i, line in enumerate(lines):
+        line_lower = line.lower()
+        tokens = TOKEN_PATTERN.findall(line_lower)
+        token_counts.append(len(tokens))
+        line_terms = set(tokens)
+        term_count += len(line_terms)
+        for term in line_terms:
+            postings.setdefault(term, []).append(i)
+
+        page_bit = 1 << (i // TRIGRAM_PAGE_LINES)
+        for trigram in {line_lower[j : j + 3] for j in range(len(line_lower) - 2)}:
+            trigram_pages[trigram] = trigram_pages.get(trigram, 0) | page_bit
+
+        if i < content_start:
             continue
 
-        libraries[item.lower()] = index
+        marker = parse_file_marker(lines, i)
+        if marker is not None or line.startswith("--- END OF FILE:"):
+            fence_start = None
+            if files and files[-1]["end_line"] is None:
+                files[-1]["end_line"] = i
+            if marker is None:
+                in_markdown = False
+                continue
+            path, content_start = marker
+            files.append(
+                {
+                    "path": path,
+                    "start_line": content_start,
+                    "end_line": None,
+                    "header_start": len(found_headers),
+                    "header_count": 0,
+                }
+            )
+            in_markdown = path.lower().endswith(MARKDOWN_EXTENSIONS)
+            continue
 
-    return libraries
+        if line.lstrip().startswith("```"):
+            if fence_start is None:
+                fence_start = i
+                fence_lang = line.strip()[3:].strip().lower()
+            else:
+                code_blocks.append(
+                    {
+                        "lang": fence_lang,
+                        "start_line": fence_start,
+                        "end_line": i,
+                        "file": len(files) - 1,
+                        "length": len("\n".join(lines[fence_start + 1 : i]).strip()),
+                    }
+                )
+                fence_start = None
+            continue
+
+        if not in_markdown or fence_start is not None:
+            continue
+
+        header_match = HEADER_PATTERN.match(line)
+        if header_match:
+            title = header_match.group(2).strip()
+            found_headers.append(
+                {
+                    "title": title,
+                    "level": len(header_match.group(1)),
+                    "line": i,
+                    "file": len(files) - 1,
+                    "parent": -1,
+                }
+            )
+            found_topics.update(extract_topics(title))
+            if files:
+                files[-1]["header_count"] += 1
+
+    if files and files[-1]["end_line"] is None:
+        files[-1]["end_line"] = len(lines)
+
+    for entry in files:
+        end = entry["end_line"]
+        while end > entry["start_line"] and not lines[end - 1].strip():
+            end -= 1
+        entry["end_line"] = end
+        entry["start_byte"] = line_starts[min(entry["start_line"], len(lines) - 1)]
+        entry["end_byte"] = (
+            line_starts[end - 1] + len(lines[end - 1].encode("utf-8"))
+            if end > entry["start_line"]
+            else entry["start_byte"]
+        )
+
+    sections: List[Dict[str, Any]] = []
+    stack: List[int] = []
+    for h_idx, header in enumerate(found_headers):
+        if stack and found_headers[stack[-1]]["file"] != header["file"]:
+            stack = []
+        while stack and found_headers[stack[-1]]["level"] >= header["level"]:
+            sections[stack.pop()]["end_line"] = header["line"]
+        header["parent"] = stack[-1] if stack else -1
+        stack.append(h_idx)
+        file_idx = header["file"]
+        sections.append(
+            {
+                "title": header["title"],
+                "level": header["level"],
+                "start_line": header["line"],
+                "end_line": files[file_idx]["end_line"] if file_idx >= 0 else len(lines),
+                "file": file_idx,
+            }
+        )
+
+    symbols: List[Dict[str, Any]] = []
+    for file_idx, entry in enumerate(files):
+        if entry["path"].lower().endswith(NIM_EXTENSIONS):
+            symbols.extend(
+                extract_nim_symbols(
+                    lines, entry["start_line"], entry["end_line"], file_idx
+                )
+            )
+
+    return {
+        "line_count": len(lines),
+        "byte_count": sum(len(line.encode("utf-8")) + 1 for line in lines),
+        "term_count": term_count,
+        "postings": postings,
+        "token_counts": token_counts,
+        "trigram_pages": trigram_pages,
+        "files": files,
+        "headers": [
+            (h["title"], h["level"], h["line"], s["end_line"], h["file"], h["parent"])
+            for h, s in zip(found_headers, sections)
+        ],
+        "code_blocks": code_blocks,
+        "symbols": symbols,
+        "topics": sorted(found_topics),
+    }
+
+
+def merge_blocks(
+    index: LibraryIndex,
+    blocks: List[Dict[str, Any]],
+    lines: List[str],
+    spans: List[tuple],
+) -> None:
+    """Fill a LibraryIndex from block results, shifting them to file positions."""
+    postings: Dict[str, List[int]] = {}
+    token_counts: List[int] = []
+    trigram_pages: Dict[str, int] = {}
+    page_starts: List[int] = []
+    files: List[Dict[str, Any]] = []
+    headers = HeaderTable()
+    code_blocks: List[Dict[str, Any]] = []
+    symbols: List[Dict[str, Any]] = []
+    topics: set = set()
+    term_count = 0
+    byte_offset = 0
+
+    def shift_file(file_idx: int, file_offset: int) -> int:
+        return file_idx + file_offset if file_idx >= 0 else -1
+
+    for block, (line_offset, _) in zip(blocks, spans):
+        file_offset = len(files)
+        header_offset = len(headers)
+
+        for term, block_lines in block["postings"].items():
+            postings.setdefault(term, []).extend(i + line_offset for i in block_lines)
+        token_counts.extend(block["token_counts"])
+
+        page_offset = len(page_starts)
+        for trigram, mask in block["trigram_pages"].items():
+            trigram_pages[trigram] = trigram_pages.get(trigram, 0) | (mask << page_offset)
+        page_starts.extend(
+            range(line_offset, line_offset + block["line_count"], TRIGRAM_PAGE_LINES)
+        )
+
+        for entry in block["files"]:
+            files.append(
+                dict(
+                    entry,
+                    start_line=entry["start_line"] + line_offset,
+                    end_line=entry["end_line"] + line_offset,
+                    start_byte=entry["start_byte"] + byte_offset,
+                    end_byte=entry["end_byte"] + byte_offset,
+                    header_start=entry["header_start"] + header_offset,
+                )
+            )
+        for title, level, line, end_line, file_idx, parent in block["headers"]:
+            headers.append(
+                title,
+                level,
+                line + line_offset,
+                end_line + line_offset,
+                shift_file(file_idx, file_offset),
+                parent + header_offset if parent >= 0 else -1,
+            )
+        for code_block in block["code_blocks"]:
+            code_blocks.append(
+                dict(
+                    code_block,
+                    start_line=code_block["start_line"] + line_offset,
+                    end_line=code_block["end_line"] + line_offset,
+                    file=shift_file(code_block["file"], file_offset),
+                )
+            )
+        for symbol in block["symbols"]:
+            symbols.append(
+                dict(
+                    symbol,
+                    line=symbol["line"] + line_offset,
+                    end_line=symbol["end_line"] + line_offset,
+                    file=shift_file(symbol["file"], file_offset),
+                )
+            )
+
+        topics.update(block["topics"])
+        term_count += block["term_count"]
+        byte_offset += block["byte_count"]
+
+    index.postings = postings
+    index.token_starts = list(accumulate(token_counts, initial=0))
+    index.trigram_pages = trigram_pages
+    index.page_starts = page_starts
+    index.files = files
+    index.headers = headers
+    index.code_blocks = code_blocks
+    index.symbols = symbols
+    index.line_count = len(lines)
+    index.avg_line_terms = term_count / max(len(lines), 1)
+    index.topics = sorted(topics)
+    index.refresh_lookups()
+
+
+def nim_block_end(lines: List[str], start: int, end: int, indent: int) -> int:
+    """First line at or after start, before end, dedented to indent or less."""
+    i = start
+    while i < end:
+        line = lines[i]
+        stripped = line.strip()
+        if stripped and not stripped.startswith("#"):
+            if len(line) - len(line.lstrip()) <= indent:
+                break
+        i += 1
+    while i > start and not lines[i - 1].strip():
+        i -= 1
+    return i
+
+
+def nim_doc_comment(lines: List[str], start: int, end: int) -> str:
+    """Join the run of '##' doc comment lines starting at start."""
+    doc: List[str] = []
+    i = start
+    while i < end and lines[i].strip().startswith("##"):
+        doc.append(lines[i].strip()[2:].strip())
+        i += 1
+    return " ".join(d for d in doc if d)
+
+
+def nim_definition_symbol(
+    lines: List[str],
+    i: int,
+    end: int,
+    kind: str,
+    definition: "re.Match",
+    indent: int,
+    file_idx: int,
+) -> Dict[str, Any]:
+    """Build the symbol for a type or const definition starting at line i."""
+    name, marker, generics = definition.group(2), definition.group(3), definition.group(4)
+    body = definition.group(6).split("##")[0].strip()
+    entry_end = max(nim_block_end(lines, i + 1, end, indent), i + 1)
+
+    fields: List[str] = []
+    if kind == "type":
+        for field_line in lines[i + 1 : entry_end]:
+            if field_line.strip().startswith(("case ", "of ", "else", "when ", "#")):
+                continue
+            field_match = NIM_FIELD_PATTERN.match(field_line)
+            if field_match:
+                fields.append(
+                    f"{field_match.group(1).strip()}: {field_match.group(2).strip()}"
+                )
+
+    line = lines[i]
+    trailing_doc = line.split("##", 1)[1].strip() if "##" in line else ""
+    return {
+        "name": name,
+        "kind": kind,
+        "exported": marker == "*",
+        "signature": f"{name}{marker}{generics or ''} = {body}",
+        "doc": trailing_doc or nim_doc_comment(lines, i + 1, end),
+        "line": i,
+        "end_line": entry_end,
+        "file": file_idx,
+        "fields": fields,
+    }
+
+
+def extract_nim_symbols(
+    lines: List[str], start: int, end: int, file_idx: int
+) -> List[Dict[str, Any]]:
+    """
+    Extract routine, type and const declarations from the Nim source in
+    lines [start, end), with their export marker, signature, doc comment
+    and line span. Object types also get their field declarations.
+    """
+    symbols: List[Dict[str, Any]] = []
+    section_kind = ""
+    section_indent = -1
+    entry_indent = -1
+    i = start
+
+    while i < end:
+        line = lines[i]
+        stripped = line.strip()
+        if not stripped or stripped.startswith("#"):
+            i += 1
+            continue
+        indent = len(line) - len(line.lstrip())
+
+        if section_kind and indent <= section_indent:
+            section_kind = ""
+
+        routine = NIM_ROUTINE_PATTERN.match(line)
+        if routine:
+            section_kind = ""
+            sig_end = i
+            depth = 0
+            while sig_end < min(end, i + 15):
+                text = lines[sig_end]
+                depth += sum(text.count(c) for c in "([{")
+                depth -= sum(text.count(c) for c in ")]}")
+                if depth <= 0 and not text.rstrip().endswith((",", "(", "[", "{.")):
+                    break
+                sig_end += 1
+            sig_end = min(sig_end, end - 1)
+            signature = " ".join(t.strip() for t in lines[i : sig_end + 1])
+            signature = re.sub(r"([(\[])\s+|\s+(?=[)\]])", r"\1", signature)
+            if signature.endswith("="):
+                signature = signature[:-1].rstrip()
+            symbols.append(
+                {
+                    "name": routine.group(3).strip("`"),
+                    "kind": routine.group(2),
+                    "exported": routine.group(4) == "*",
+                    "signature": signature,
+                    "doc": nim_doc_comment(lines, sig_end + 1, end),
+                    "line": i,
+                    "end_line": nim_block_end(lines, sig_end + 1, end, indent),
+                    "file": file_idx,
+                }
+            )
+            i = symbols[-1]["end_line"] if indent == 0 else sig_end + 1
+            continue
+
+        section = NIM_SECTION_PATTERN.match(line)
+        if section and section.group(3) and not section.group(3).startswith("#"):
+            definition = NIM_DEFINITION_PATTERN.match(section.group(3))
+            section_kind = ""
+            if definition:
+                symbols.append(
+                    nim_definition_symbol(
+                        lines, i, end, section.group(2), definition, indent, file_idx
+                    )
+                )
+                i = symbols[-1]["end_line"]
+                continue
+        elif section:
+            section_kind = section.group(2)
+            section_indent = indent
+            entry_indent = -1
+            i += 1
+            continue
+
+        if section_kind:
+            if entry_indent < 0:
+                entry_indent = indent
+            definition = NIM_DEFINITION_PATTERN.match(line)
+            if definition and indent == entry_indent:
+                symbols.append(
+                    nim_definition_symbol(
+                        lines, i, end, section_kind, definition, indent, file_idx
+                    )
+                )
+                i = symbols[-1]["end_line"]
+                continue
+
+        i += 1
+
+    return symbols
 
 
 def build_library_index() -> Dict[str, LibraryIndex]:
     if not os.path.exists(DOCS_PATH):
         return {}
 
-    all_libs = [
-        item
-        for item in os.listdir(DOCS_PATH)
-        if os.path.isdir(os.path.join(DOCS_PATH, item))
-    ]
-
-    libraries = build_libraries(all_libs)
-
-    try:
-        with open(INDEX_CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump({k: v.__dict__ for k, v in libraries.items()}, f, indent=2)
-    except Exception:
-        pass
+    block_cache: Dict[str, Dict[str, Any]] = {}
+    libraries = build_libraries(list_library_dirs(), block_cache)
+    save_index_cache(libraries, block_cache)
 
     return libraries
 
@@ -206,58 +1179,1820 @@ def extract_topics(text: str) -> List[str]:
     return list(topics)
 
 
-def rank_match(content: str, query: str, search_type: SearchType) -> float:
-    content_lower = content.lower()
-    query_lower = query.lower()
+def query_term_lines(lib: LibraryIndex, query: str) -> Optional[List[tuple]]:
+    """
+    Map each term of a case-insensitive substring query to the set of lines
+    whose indexed terms can contain it.
+
+    A term touching the start of the query may be the suffix of a line term,
+    one touching the end may be a prefix, and inner terms must match exactly.
+    Returns None when the query has no indexable terms.
+    """
+    query_lower = query.lower()
+    term_spans = [
+        (m.group(0), m.start(), m.end()) for m in TOKEN_PATTERN.finditer(query_lower)
+    ]
+    if not term_spans:
+        return None
+
+    result: List[tuple] = []
+    for term, start, end in term_spans:
+        open_left = start == 0
+        open_right = end == len(query_lower)
+
+        if not open_left and not open_right:
+            matched = [term] if term in lib.postings else []
+        elif open_left and open_right:
+            matched = [t for t in lib.postings if term in t]
+        elif open_left:
+            matched = [t for t in lib.postings if t.endswith(term)]
+        else:
+            matched = [t for t in lib.postings if t.startswith(term)]
+
+        term_lines: set = set()
+        for t in matched:
+            term_lines.update(lib.postings[t])
+        result.append((term, term_lines))
+
+    return result
+
+
+def trigram_mask(lib: LibraryIndex, literals: List[str]) -> Optional[int]:
+    """
+    Intersect the trigram pages of every lowercase literal into a bitmask of
+    the pages that may hold a line containing all of them.
+
+    Returns None when no literal is long enough to have a trigram.
+    """
+    mask: Optional[int] = None
+    for literal in literals:
+        for j in range(len(literal) - 2):
+            pages = lib.trigram_pages.get(literal[j : j + 3], 0)
+            mask = pages if mask is None else mask & pages
+            if not mask:
+                return 0
+    return mask
+
+
+def page_ranges(lib: LibraryIndex, mask: int) -> List[tuple]:
+    """Turn a page bitmask into sorted (start, end) line ranges, merging runs."""
+    ranges: List[tuple] = []
+    while mask:
+        low = mask & -mask
+        page = low.bit_length() - 1
+        mask ^= low
+        start = lib.page_starts[page]
+        end = (
+            lib.page_starts[page + 1]
+            if page + 1 < len(lib.page_starts)
+            else lib.line_count
+        )
+        if ranges and ranges[-1][1] == start:
+            ranges[-1] = (ranges[-1][0], end)
+        else:
+            ranges.append((start, end))
+    return ranges
+
+
+def regex_literals(query: str) -> List[str]:
+    """
+    Lowercase literal runs that every match of a pattern must contain, taken
+    from the top level of its parse. Alternation, classes and repeats end a
+    run; a pattern that cannot be parsed here yields no literals.
+    """
+    try:
+        parsed = regex_parser.parse(query, re.IGNORECASE)
+    except Exception:
+        return []
+
+    literals: List[str] = []
+    run: List[str] = []
+    for op, arg in list(parsed) + [(None, None)]:
+        if op is regex_parser.LITERAL:
+            run.append(chr(arg))
+            continue
+        literal = "".join(run).lower()
+        if len(literal) >= 3 and literal.isascii():
+            literals.append(literal)
+        run = []
+    return literals
+
+
+def find_hit_lines(lib: LibraryIndex, lines: "LibraryDocument", query: str) -> tuple:
+    """
+    Line numbers containing a case-insensitive substring query, and how often
+    it occurs on each, reading only the candidate pages, each as one decoded
+    range. Queries too short for a trigram match most lines anyway and are
+    scanned in one pass.
+    """
+    query_lower = query.lower()
+    mask = trigram_mask(lib, [query_lower])
+    ranges = [(0, len(lines))] if mask is None else page_ranges(lib, mask)
+    decoded = LowercaseRanges(lines, ranges)
+    hit_lines = decoded.hit_lines(query_lower)
+    return hit_lines, decoded.line_counts(query_lower, hit_lines)
+
+
+class LowercaseRanges:
+    """
+    Line ranges of a document decoded and lowercased once, for any number of
+    case-insensitive substring lookups. Each lookup jumps between occurrences
+    with str.find and maps them to lines, so its cost follows the number of
+    matching lines rather than the size of the text searched.
+    """
+
+    def __init__(self, lines: "LibraryDocument", ranges: List[tuple]):
+        self.ranges = ranges
+        self._starts = [start for start, _ in ranges]
+        self._texts = [lines.text(start, end).lower() for start, end in ranges]
+        self._newlines: Dict[int, List[int]] = {}
+
+    def _newlines_of(self, r: int) -> List[int]:
+        newlines = self._newlines.get(r)
+        if newlines is None:
+            newlines = [m.start() for m in re.finditer("\n", self._texts[r])]
+            self._newlines[r] = newlines
+        return newlines
+
+    def hit_lines(
+        self, query_lower: str, within: Optional[List[tuple]] = None
+    ) -> List[int]:
+        """
+        Sorted lines containing the query, optionally searching only the given
+        line ranges, which must lie inside the decoded ones.
+        """
+        hits: List[int] = []
+        for start, end in self.ranges if within is None else within:
+            check_cancelled()
+            r = bisect.bisect_right(self._starts, start) - 1
+            text = self._texts[r]
+            base = self._starts[r]
+            lo, hi = 0, len(text)
+            if within is not None:
+                newlines = self._newlines_of(r)
+                if start > base:
+                    lo = newlines[start - base - 1] + 1
+                if end - base - 1 < len(newlines):
+                    hi = newlines[end - base - 1]
+
+            pos = text.find(query_lower, lo, hi)
+            if pos == -1:
+                continue
+            newlines = self._newlines_of(r)
+            while pos != -1:
+                line = bisect.bisect_left(newlines, pos)
+                hits.append(base + line)
+                if line == len(newlines):
+                    break
+                pos = text.find(query_lower, newlines[line] + 1, hi)
+        return hits
+
+    def line_counts(self, query_lower: str, hit_lines: List[int]) -> List[int]:
+        """Occurrences of the query on each of the given decoded lines."""
+        counts: List[int] = []
+        for line in hit_lines:
+            r = bisect.bisect_right(self._starts, line) - 1
+            text = self._texts[r]
+            newlines = self._newlines_of(r)
+            offset = line - self._starts[r]
+            lo = newlines[offset - 1] + 1 if offset > 0 else 0
+            hi = newlines[offset] if offset < len(newlines) else len(text)
+            counts.append(text.count(query_lower, lo, hi))
+        return counts
+
+
+def candidate_lines(
+    lib: LibraryIndex, query: str, term_lines: Optional[List[tuple]] = None
+) -> Optional[List[int]]:
+    """
+    Resolve a case-insensitive substring query to the sorted line numbers that
+    may contain it: the lines of the pages holding all of its trigrams, or for
+    queries too short to have one, the lines matching its postings terms.
+
+    Returns None when the query has no indexable terms and a scan is needed.
+    """
+    mask = trigram_mask(lib, [query.lower()])
+    if mask is not None:
+        return [i for start, end in page_ranges(lib, mask) for i in range(start, end)]
+
+    if term_lines is None:
+        term_lines = query_term_lines(lib, query)
+    if term_lines is None:
+        return None
+
+    candidates: Optional[set] = None
+    for _, lines_for_term in term_lines:
+        candidates = (
+            set(lines_for_term) if candidates is None else candidates & lines_for_term
+        )
+        if not candidates:
+            return []
+
+    return sorted(candidates or [])
+
+
+class WindowScorer:
+    """
+    Scores hit lines with BM25 over their snippet windows, treating the window
+    as the document and the library's lines as the collection, divided by the
+    best score the query can reach in this library so that scores from
+    different libraries land in [0, 1].
+
+    Without term_lines, a query term's document frequency is its exact
+    postings count, or for a partial word the number of hits, which avoids
+    scanning the vocabulary.
+
+    Neither terms nor the query can span a line break, so window counts are
+    sums of per-line counts, and window lengths come from the index's token
+    counts. Overlapping hit windows are merged into clusters and each cluster
+    is read once, on first use, into prefix sums of its query and term
+    counts, so only the lines around hits are read.
+    """
+
+    def __init__(
+        self,
+        lib: LibraryIndex,
+        lines: "LibraryDocument",
+        hit_lines: List[int],
+        hit_counts: List[int],
+        query: str,
+        term_lines: Optional[List[tuple]] = None,
+    ):
+        self.lib = lib
+        self.lines = lines
+        self.query_lower = query.lower()
+        if term_lines is None:
+            term_df = {
+                term: len(lib.postings.get(term) or hit_lines)
+                for term in TOKEN_PATTERN.findall(self.query_lower)
+            }
+        else:
+            term_df = {term: len(ls) for term, ls in term_lines}
+
+        total_lines = max(len(lines), 1)
+        self.idf = {
+            term: math.log(1 + (total_lines - df + 0.5) / (df + 0.5))
+            for term, df in term_df.items()
+        }
+        self.terms = list(self.idf)
+        self.phrase_weight = sum(self.idf.values()) or 1.0
+        self.best_score = sum(self.idf.values()) * (BM25_K1 + 1)
+        if len(self.idf) != 1:
+            self.best_score += self.phrase_weight
+        window_size = SNIPPET_BEFORE + SNIPPET_AFTER
+        self.avg_window_terms = max(lib.avg_line_terms * window_size, 1.0)
+
+        self.hit_lines = hit_lines
+        self.hit_count_sums = list(accumulate(hit_counts, initial=0))
+        self.clusters: List[List[int]] = []
+        for i in self.hit_lines:
+            start, end = self.window(i)
+            if self.clusters and start <= self.clusters[-1][1]:
+                self.clusters[-1][1] = max(self.clusters[-1][1], end)
+            else:
+                self.clusters.append([start, end])
+        self.cluster_starts = [c[0] for c in self.clusters]
+        self._prefix_sums: Dict[int, List[List[int]]] = {}
+        if self.terms == [self.query_lower]:
+            self._term_bound = None
+        else:
+            self._term_bound = sum(self.idf.values()) * (BM25_K1 + 1)
+
+    def window(self, i: int) -> tuple:
+        return max(0, i - SNIPPET_BEFORE), min(len(self.lines), i + SNIPPET_AFTER)
+
+    def norm(self, start: int, end: int) -> float:
+        token_starts = self.lib.token_starts
+        window_terms = token_starts[end] - token_starts[start]
+        return BM25_K1 * (1 - BM25_B + BM25_B * window_terms / self.avg_window_terms)
+
+    def _cluster_sums(self, c: int) -> List[List[int]]:
+        if c not in self._prefix_sums:
+            rows = []
+            for line in self.lines.lines(*self.clusters[c]):
+                line_lower = line.lower()
+                rows.append(
+                    [line_lower.count(self.query_lower)]
+                    + [line_lower.count(term) for term in self.terms]
+                )
+            self._prefix_sums[c] = [
+                list(accumulate(column, initial=0)) for column in zip(*rows)
+            ]
+        return self._prefix_sums[c]
+
+    def score(self, i: int) -> float:
+        start, end = self.window(i)
+        c = bisect.bisect_right(self.cluster_starts, start) - 1
+        offset = self.clusters[c][0]
+        window = [
+            col[end - offset] - col[start - offset] for col in self._cluster_sums(c)
+        ]
+        norm = self.norm(start, end)
+
+        total = 0.0
+        for term, tf in zip(self.terms, window[1:]):
+            total += self.idf[term] * tf * (BM25_K1 + 1) / (tf + norm)
+
+        phrase_tf = window[0]
+        if len(self.idf) != 1 and phrase_tf:
+            total += self.phrase_weight * phrase_tf / (phrase_tf + norm)
+
+        return total / self.best_score
+
+    def upper_bounds(self) -> List[float]:
+        """
+        An upper bound of score(i) for every hit line, from the query's count
+        on each hit line, without reading any window. The query occurs only on
+        hit lines, so its window count is exact, and so is the score when the
+        query is a single term. Other terms are bounded by their saturation
+        limit.
+        """
+        if self._term_bound is not None and len(self.idf) == 1:
+            return [self._term_bound / self.best_score] * len(self.hit_lines)
+
+        bounds: List[float] = []
+        hit_lines = self.hit_lines
+        count_sums = self.hit_count_sums
+        lo = hi = 0
+        for i in hit_lines:
+            start, end = self.window(i)
+            while hit_lines[lo] < start:
+                lo += 1
+            while hi < len(hit_lines) and hit_lines[hi] < end:
+                hi += 1
+            phrase_tf = count_sums[hi] - count_sums[lo]
+            norm = self.norm(start, end)
+
+            if self._term_bound is None:
+                idf = self.idf[self.query_lower]
+                total = idf * phrase_tf * (BM25_K1 + 1) / (phrase_tf + norm)
+            else:
+                total = self._term_bound
+                if phrase_tf:
+                    total += self.phrase_weight * phrase_tf / (phrase_tf + norm)
+            bounds.append(total / self.best_score)
+        return bounds
+
+
+def push_substring_hits(
+    top: "TopResults",
+    lib: LibraryIndex,
+    lines: "LibraryDocument",
+    query: str,
+    hit_lines: List[int],
+    hit_counts: List[int],
+    order_base: int,
+) -> None:
+    """
+    Score a library's sorted substring hits, given the query's count on each
+    hit line, into a TopResults, best upper bound first, stopping once no
+    remaining hit could beat the current k-th result.
+
+    The library is skipped without reading any hit window when its best bound
+    does not exceed the k-th score: libraries are scored in order, so every
+    held result has a lower order key and wins a tie.
+    """
+    scorer = WindowScorer(lib, lines, hit_lines, hit_counts, query)
+    ranked = []
+    for i, text_bound in zip(hit_lines, scorer.upper_bounds()):
+        bonus = proximity_bonus(lib, i)
+        ranked.append((bonus + TEXT_SCORE_SCALE * text_bound, bonus, i))
+    ranked.sort(key=lambda h: -h[0])
+    if not ranked or top.threshold() >= ranked[0][0]:
+        return
+    for bound, bonus, i in ranked:
+        check_cancelled()
+        if top.threshold() > bound:
+            break
+        if not top.admits(bound, order_base + i):
+            continue
+        score = TEXT_SCORE_SCALE * scorer.score(i) + bonus
+        start, end = scorer.window(i)
+        top.push(
+            score,
+            order_base + i,
+            {
+                "library": lib.name,
+                "match": {
+                    "line": i,
+                    "file": (lib.file_at_line(i) or {}).get("path", ""),
+                    "snippet": "\n".join(lines[start:end]),
+                },
+                "score": score,
+                "type": "substring",
+            },
+        )
+
+
+class TopResults:
+    """
+    Bounded min-heap of the k best results seen so far. Ties go to the lower
+    order key, so the outcome does not depend on the order of pushes.
+    """
+
+    def __init__(self, k: int):
+        self.k = max(k, 0)
+        self._heap: List[tuple] = []
+
+    def threshold(self) -> float:
+        """The score a new result must beat to get in, -inf until k are held."""
+        if len(self._heap) < self.k:
+            return -math.inf
+        return self._heap[0][0] if self._heap else math.inf
+
+    def admits(self, score: float, order: int) -> bool:
+        """Whether a result with this score and order key would get in."""
+        if len(self._heap) < self.k:
+            return True
+        return bool(self._heap) and (score, -order) > self._heap[0][:2]
+
+    def push(self, score: float, order: int, result: Dict[str, Any]) -> None:
+        entry = (score, -order, result)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+        elif self.admits(score, order):
+            heapq.heapreplace(self._heap, entry)
+
+    def results(self) -> List[Dict[str, Any]]:
+        """Held results, best first."""
+        return [r for _, _, r in sorted(self._heap, key=lambda e: e[:2], reverse=True)]
+
+
+def proximity_bonus(lib: LibraryIndex, line: int) -> float:
+    """Bonus for a hit on or just below a header, or inside fenced code."""
+    bonus = 0.0
+    h = bisect.bisect_right(lib.header_lines, line) - 1
+    if h >= 0:
+        distance = line - lib.header_lines[h]
+        if distance == 0:
+            bonus += 2.0
+        elif distance <= SNIPPET_AFTER:
+            bonus += 1.0 * (1 - distance / (SNIPPET_AFTER + 1))
+
+    b = bisect.bisect_right(lib.fence_starts, line) - 1
+    if b >= 0 and line <= lib.code_blocks[b]["end_line"]:
+        bonus += 1.5 if lib.code_blocks[b]["lang"] == "nim" else 1.0
+
+    return bonus
+
+
+@functools.lru_cache(maxsize=REGEX_CACHE_SIZE)
+def compile_query_pattern(query: str) -> Any:
+    """Compile a case-insensitive search pattern, reusing recent compilations."""
+    if regex_engine is not None:
+        try:
+            return regex_engine.compile(query, regex_engine.IGNORECASE)
+        except regex_engine.error as e:
+            raise re.error(str(e)) from e
+    return re.compile(query, re.IGNORECASE)
+
+
+def scan_regex(
+    lines: "LibraryDocument",
+    pattern: Any,
+    deadline: float,
+    ranges: Optional[List[tuple]] = None,
+) -> tuple:
+    """
+    Match a pattern against every line in one pass, reading chunk by chunk,
+    until the deadline passes or the request is cancelled. With ranges, only
+    those (start, end) line spans are read.
+
+    Returns (first matched lines, total match count, whether the scan finished).
+    The optional regex module gives every match a timeout; without it the scan
+    runs in a REGEX_WORKERS child process, which is killed at the deadline.
+    Either way a single catastrophic match cannot outlive the deadline.
+    """
+    if ranges is None:
+        ranges = [(0, len(lines))]
+    chunks = [
+        (chunk_start, min(chunk_start + REGEX_CHUNK_LINES, end))
+        for start, end in ranges
+        for chunk_start in range(start, end, REGEX_CHUNK_LINES)
+    ]
+    if regex_engine is None:
+        return REGEX_WORKERS.scan(lines, pattern, chunks, deadline)
+
+    matched_lines: List[int] = []
+    match_count = 0
+    for chunk_start, chunk_end in chunks:
+        chunk = lines.lines(chunk_start, chunk_end)
+        try:
+            for offset, line in enumerate(chunk):
+                check_cancelled()
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return matched_lines, match_count, False
+                found = sum(1 for _ in pattern.finditer(line, timeout=remaining))
+                if found:
+                    match_count += found
+                    if len(matched_lines) < REGEX_MAX_LINES:
+                        matched_lines.append(chunk_start + offset)
+        except TimeoutError:
+            return matched_lines, match_count, False
+
+    return matched_lines, match_count, True
+
+
+class RegexWorker:
+    """One regex_worker.py child process and the pipes to it."""
+
+    def __init__(self):
+        request_read, request_write = os.pipe()
+        reply_read, reply_write = os.pipe()
+        try:
+            self.process = subprocess.Popen(
+                [sys.executable, REGEX_WORKER_SCRIPT],
+                stdin=request_read,
+                stdout=reply_write,
+            )
+        except BaseException:
+            for fd in (request_write, reply_read):
+                os.close(fd)
+            raise
+        finally:
+            os.close(request_read)
+            os.close(reply_write)
+        self.requests = Connection(request_write, readable=False)
+        self.replies = Connection(reply_read, writable=False)
+
+    def kill(self) -> None:
+        self.process.kill()
+        self.process.wait()
+        self.requests.close()
+        self.replies.close()
+
+
+class RegexWorkers:
+    """
+    Idle RegexWorker processes, reused across searches. A worker is taken for
+    one scan at a time and only returned once that scan finished; a scan that
+    passed its deadline or was cancelled kills its worker, since a runaway
+    `re` match cannot be interrupted any other way.
+    """
+
+    def __init__(self):
+        self._idle: List[RegexWorker] = []
+        self._lock = threading.Lock()
+
+    def scan(
+        self,
+        lines: "LibraryDocument",
+        pattern: Any,
+        chunks: List[tuple],
+        deadline: float,
+    ) -> tuple:
+        """scan_regex() over chunks of (start, end) lines, in a worker process."""
+        matched_lines: List[int] = []
+        match_count = 0
+        if not chunks:
+            return matched_lines, match_count, True
+        check_cancelled()
+        if time.monotonic() >= deadline:
+            return matched_lines, match_count, False
+
+        with self._lock:
+            worker = self._idle.pop() if self._idle else None
+        if worker is None:
+            worker = RegexWorker()
+
+        try:
+            worker.requests.send(
+                (
+                    pattern.pattern,
+                    pattern.flags,
+                    [
+                        (start, "\n".join(lines.lines(start, end)))
+                        for start, end in chunks
+                    ],
+                )
+            )
+            for _ in chunks:
+                while not worker.replies.poll(REGEX_POLL_INTERVAL):
+                    check_cancelled()
+                    if time.monotonic() >= deadline:
+                        worker.kill()
+                        return matched_lines, match_count, False
+                chunk_lines, found = worker.replies.recv()
+                match_count += found
+                matched_lines.extend(
+                    chunk_lines[: REGEX_MAX_LINES - len(matched_lines)]
+                )
+        except BaseException:
+            worker.kill()
+            raise
+
+        with self._lock:
+            self._idle.append(worker)
+        return matched_lines, match_count, True
+
+
+REGEX_WORKERS = RegexWorkers()
+
+
+class LibraryDocument:
+    """
+    A snapshot of a library's full-context file, with the byte offset of every
+    line start. Lines are decoded only when they are read.
+
+    The file is copied into memory rather than mapped: a mapping faults with
+    SIGBUS, killing the server, if the file is truncated while being read.
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        with open(filepath, "rb") as f:
+            stat = os.fstat(f.fileno())
+            self.buffer: Any = f.read()
+        self.mtime = stat.st_mtime
+        self.size = len(self.buffer)
+        self.line_offsets = array("Q", [0])
+        self.line_offsets.extend(m.end() for m in re.finditer(rb"\n", self.buffer))
+
+    def __len__(self) -> int:
+        return len(self.line_offsets)
+
+    def __getitem__(self, key: Any) -> Any:
+        if isinstance(key, slice):
+            return self.lines(*key.indices(len(self))[:2])
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError("line index out of range")
+        return self.text(key, key + 1)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.text(i, i + 1)
+
+    def is_current(self, stat: os.stat_result) -> bool:
+        return stat.st_mtime == self.mtime and stat.st_size == self.size
+
+    def byte_span(self, start: int, end: int) -> tuple:
+        """Byte range covering lines [start, end), without the final newline."""
+        end = min(end, len(self))
+        if start >= end:
+            return 0, 0
+        start_byte = self.line_offsets[start]
+        end_byte = self.line_offsets[end] - 1 if end < len(self) else self.size
+        return start_byte, end_byte
+
+    def text(self, start: int = 0, end: Optional[int] = None) -> str:
+        """Decode lines [start, end) as one newline-joined string."""
+        start_byte, end_byte = self.byte_span(
+            start, len(self) if end is None else end
+        )
+        METRICS.add_bytes(end_byte - start_byte)
+        return self.buffer[start_byte:end_byte].decode("utf-8", errors="replace")
+
+    def lines(self, start: int, end: int) -> List[str]:
+        if start >= end:
+            return []
+        return self.text(start, end).split("\n")
+
+    def close(self) -> None:
+        """Release what the document holds open; plain snapshots hold nothing."""
+
+
+def decompress_frame(codec: str, payload: bytes) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdDecompressor().decompress(payload)
+    return zlib.decompress(payload)
+
+
+class CompressedDocument(LibraryDocument):
+    """
+    A block-compressed full-context file (see write_compressed_context). Only
+    the frame table is read when it is opened; a frame is decompressed when a
+    read first touches it, and the most recently used ones are kept, so memory
+    and page cache follow what is queried rather than the size of the library.
+    """
+
+    def __init__(self, filepath: str):
+        self.filepath = filepath
+        # Frames are read with pread on the open file, never mapped, so a file
+        # truncated under a read gives a decompression error, not SIGBUS.
+        self._file = open(filepath, "rb")
+        try:
+            stat = os.fstat(self._file.fileno())
+            self.mtime = stat.st_mtime
+            self.size = stat.st_size
+            self._read_header()
+        except BaseException:
+            self._file.close()
+            raise
+        self._frames: "OrderedDict[int, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _read(self, offset: int, count: int) -> bytes:
+        data = os.pread(self._file.fileno(), count, offset)
+        if len(data) != count:
+            raise ValueError(f"Compressed file was truncated: {self.filepath}")
+        return data
+
+    def _read_header(self) -> None:
+        header = self._read(0, COMPRESSED_HEADER.size)
+        magic, codec, count = COMPRESSED_HEADER.unpack(header)
+        if magic != COMPRESSED_MAGIC:
+            raise ValueError(f"Not a compressed full-context file: {self.filepath}")
+        self.codec = codec.decode("ascii")
+        if self.codec == "zstd" and zstandard is None:
+            raise ValueError(f"Reading {self.filepath} needs the zstandard module")
+
+        table = array("Q")
+        table.frombytes(
+            self._read(COMPRESSED_HEADER.size, 3 * (count + 1) * table.itemsize)
+        )
+        if sys.byteorder == "big":
+            table.byteswap()
+        self.data_start = COMPRESSED_HEADER.size + len(table) * table.itemsize
+        self.frame_offsets = table[: count + 1]
+        self.frame_lines = table[2 * (count + 1) :]
+
+    def __len__(self) -> int:
+        return self.frame_lines[-1]
+
+    def frame(self, i: int) -> tuple:
+        """Frame i's text and the offset of each line start within it."""
+        with self._lock:
+            cached = self._frames.get(i)
+            if cached is not None:
+                self._frames.move_to_end(i)
+                return cached
+
+        data = self.decompress(i)
+        offsets = array("Q", [0])
+        offsets.extend(m.end() for m in re.finditer(rb"\n", data))
+        with self._lock:
+            self._frames[i] = (data, offsets)
+            while len(self._frames) > COMPRESSED_CACHED_FRAMES:
+                self._frames.popitem(last=False)
+        return data, offsets
+
+    def text(self, start: int = 0, end: Optional[int] = None) -> str:
+        end = len(self) if end is None else min(end, len(self))
+        if start >= end:
+            return ""
+        first = bisect.bisect_right(self.frame_lines, start) - 1
+        last = bisect.bisect_right(self.frame_lines, end - 1) - 1
+        parts = []
+        for i in range(first, last + 1):
+            data, offsets = self.frame(i)
+            base = self.frame_lines[i]
+            lo = offsets[start - base] if i == first else 0
+            # Frames but the last end in a newline, which is kept between frames.
+            if i < last or end - base >= len(offsets):
+                hi = len(data)
+            else:
+                hi = offsets[end - base] - 1
+            parts.append(data[lo:hi])
+        raw = b"".join(parts)
+        METRICS.add_bytes(len(raw))
+        return raw.decode("utf-8", errors="replace")
+
+    def decompress(self, i: int) -> bytes:
+        start = self.data_start + self.frame_offsets[i]
+        end = self.data_start + self.frame_offsets[i + 1]
+        return decompress_frame(self.codec, self._read(start, end - start))
+
+    def read_all(self) -> bytes:
+        """The whole original file, without filling the frame cache."""
+        return b"".join(
+            self.decompress(i) for i in range(len(self.frame_offsets) - 1)
+        )
+
+    def cached_bytes(self) -> int:
+        return sum(len(data) for data, _ in list(self._frames.values()))
+
+    def close(self) -> None:
+        self._frames.clear()
+        self._file.close()
+
+
+def write_compressed_context(source: str, target: str, codec: str = "") -> tuple:
+    """
+    Write the full-context file source to target as independently compressed
+    frames of about COMPRESSED_FRAME_BYTES each. Frames start at FILE block
+    boundaries where they can, and always at line starts; a table after the
+    header holds each frame's compressed offset, text offset and first line.
+
+    Uses zstd when the zstandard module is installed, else zlib, unless codec
+    names one. Returns (frame count, text bytes, compressed bytes).
+    """
+    codec = codec or ("zstd" if zstandard is not None else "zlib")
+    if codec == "zstd":
+        if zstandard is None:
+            raise ValueError("zstd compression needs the zstandard module")
+        compress = zstandard.ZstdCompressor(level=19).compress
+    elif codec == "zlib":
+        compress = functools.partial(zlib.compress, level=9)
+    else:
+        raise ValueError(f"Unknown codec '{codec}'")
+
+    with open(source, "rb") as f:
+        data = f.read()
+    lines = [
+        line.rstrip("\r") for line in data.decode("utf-8", errors="replace").split("\n")
+    ]
+    line_starts = [0]
+    line_starts.extend(m.end() for m in re.finditer(rb"\n", data))
+    line_starts.append(len(data) + 1)
+
+    frame_lines = [0]
+    for start, end in split_file_blocks(lines):
+        if line_starts[start] - line_starts[frame_lines[-1]] >= COMPRESSED_FRAME_BYTES:
+            frame_lines.append(start)
+        while line_starts[end] - line_starts[frame_lines[-1]] > (
+            2 * COMPRESSED_FRAME_BYTES
+        ):
+            cut = bisect.bisect_left(
+                line_starts, line_starts[frame_lines[-1]] + COMPRESSED_FRAME_BYTES
+            )
+            cut = max(cut, frame_lines[-1] + 1)
+            if cut >= end:
+                break
+            frame_lines.append(cut)
+    frame_lines.append(len(lines))
+
+    text_offsets = [min(line_starts[line], len(data)) for line in frame_lines]
+    frames = [
+        compress(data[text_offsets[i] : text_offsets[i + 1]])
+        for i in range(len(frame_lines) - 1)
+    ]
+    frame_offsets = list(accumulate((len(frame) for frame in frames), initial=0))
+
+    table = array("Q", frame_offsets + text_offsets + frame_lines)
+    if sys.byteorder == "big":
+        table.byteswap()
+    header = COMPRESSED_HEADER.pack(COMPRESSED_MAGIC, codec.encode("ascii"), len(frames))
+    payload = header + table.tobytes() + b"".join(frames)
+    write_atomically(target, payload)
+    return len(frames), len(data), len(payload)
+
+
+class DocumentStore:
+    """
+    Process-wide cache of LibraryDocument objects shared by all tools.
+
+    A replaced document is dropped rather than closed, since a tool call may
+    still be reading it. Documents are immutable snapshots, so that call keeps
+    reading the old text, however the file was replaced.
+    """
+
+    def __init__(self):
+        self._documents: Dict[str, LibraryDocument] = {}
+        self._lock = threading.Lock()
+
+    def get(self, lib: LibraryIndex) -> LibraryDocument:
+        filepath = full_context_path(lib.path, lib.name)
+        stat = os.stat(filepath)
+        with self._lock:
+            document = self._documents.get(lib.name)
+            if (
+                document is not None
+                and document.filepath == filepath
+                and document.is_current(stat)
+            ):
+                return document
+
+            if filepath.endswith(COMPRESSED_CONTEXT_SUFFIX):
+                document = CompressedDocument(filepath)
+            else:
+                document = LibraryDocument(filepath)
+            self._documents[lib.name] = document
+            return document
+
+    def invalidate(self, lib_name: str) -> None:
+        with self._lock:
+            self._documents.pop(lib_name, None)
+
+    def document_bytes(self, lib_name: str) -> int:
+        """Size of a library's open document file, or 0 if it is not open."""
+        document = self._documents.get(lib_name)
+        return document.size if document is not None else 0
+
+    def decompressed_bytes(self, lib_name: str) -> int:
+        """Text held by an open compressed document's frame cache, or 0."""
+        document = self._documents.get(lib_name)
+        if isinstance(document, CompressedDocument):
+            return document.cached_bytes()
+        return 0
+
+
+DOCUMENT_STORE = DocumentStore()
+
+
+class ResultCache:
+    """
+    Two-tier cache of tool results: an in-process LRU, optionally backed by
+    one JSON file per entry in RESULT_CACHE_DIR.
+
+    Keys combine the tool name, its arguments and the mtime each
+    library's index was built from, so entries go stale as soon as a changed
+    *_full_context.txt is re-indexed, and a call racing that re-index cannot
+    file an old answer under the new key.
+    """
+
+    def __init__(self, max_entries: int, disk_dir: str = ""):
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self._entries: "OrderedDict[str, str]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._cacheable: contextvars.ContextVar = contextvars.ContextVar(
+            "cacheable", default=True
+        )
+        self._disk_writes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def make_key(self, tool: str, arguments: Dict[str, Any]) -> str:
+        # Arguments are keyed verbatim: whitespace in a query changes its
+        # results, and messages echo library_name as it was given.
+        mtimes = sorted(LIBRARY_INDEX.index_mtimes().items())
+        raw = json.dumps([INDEX_VERSION, tool, arguments, mtimes], sort_keys=True)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return result
+
+        if self.disk_dir:
+            try:
+                with open(os.path.join(self.disk_dir, f"{key}.json"), "r") as f:
+                    result = json.load(f)["result"]
+                self._remember(key, result)
+                with self._lock:
+                    self.disk_hits += 1
+                return result
+            except Exception:
+                pass
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, result: str) -> None:
+        self._remember(key, result)
+        if not self.disk_dir:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            with open(os.path.join(self.disk_dir, f"{key}.json"), "w") as f:
+                json.dump({"result": result}, f)
+            self._disk_writes += 1
+            if self._disk_writes % 64 == 0:
+                self._prune_disk()
+        except Exception:
+            pass
+
+    def skip_current(self) -> None:
+        """Keep the result of the running tool call out of the cache."""
+        self._cacheable.set(False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+        }
+
+    def _remember(self, key: str, result: str) -> None:
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _prune_disk(self) -> None:
+        paths = [
+            os.path.join(self.disk_dir, name)
+            for name in os.listdir(self.disk_dir)
+            if name.endswith(".json")
+        ]
+        if len(paths) <= RESULT_CACHE_DISK_ENTRIES:
+            return
+        paths.sort(key=os.path.getmtime)
+        for path in paths[: len(paths) - RESULT_CACHE_DISK_ENTRIES]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+RESULT_CACHE = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_DIR)
+
+
+class ServerMetrics:
+    """
+    Counters behind get_knowledge_server_stats: per-tool latency histograms
+    and recent samples, errors, cancellations, cache hits and bytes scanned,
+    plus index build and load timings.
+
+    Per-request counts go into a dict held in REQUEST_STATS, which each tool
+    call gets in its own context. With TRACE_FILE set, every call is also
+    written as one JSON line; tools named in PROFILE_TOOLS ("*" for all) are
+    run under cProfile, for a PROFILE_RATE share of calls, with the stats
+    dumped to PROFILE_DIR. Only one call is profiled at a time, since a
+    process can only have one active profiler on Python 3.12+; calls that
+    start meanwhile just run unprofiled.
+    """
+
+    def __init__(self, trace_file: str = ""):
+        self.started = time.time()
+        self.trace_file = trace_file
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+        self._tools: Dict[str, Dict[str, Any]] = {}
+        self._index_events: List[Dict[str, Any]] = []
+        self._memory: Dict[str, tuple] = {}
+
+    def add_bytes(self, count: int) -> None:
+        stats = REQUEST_STATS.get()
+        if stats is not None:
+            stats["bytes_scanned"] += count
+
+    def mark_cache_hit(self) -> None:
+        stats = REQUEST_STATS.get()
+        if stats is not None:
+            stats["cache_hit"] = True
+
+    def record_index(self, event: str, seconds: float, **details: Any) -> None:
+        """Note an index load, build or refresh and how long it took."""
+        with self._lock:
+            self._index_events.append(
+                {"event": event, "seconds": round(seconds, 4), **details}
+            )
+            del self._index_events[:-100]
+
+    def run_tool(self, name: str, func: Callable, args: tuple, kwargs: dict) -> Any:
+        """Call a tool in the current context, measuring (and maybe profiling) it."""
+        stats = {"bytes_scanned": 0, "cache_hit": False}
+        REQUEST_STATS.set(stats)
+        profiler = None
+        if (
+            ("*" in PROFILE_TOOLS or name in PROFILE_TOOLS)
+            and random.random() < PROFILE_RATE
+            and self._profile_lock.acquire(blocking=False)
+        ):
+            profiler = cProfile.Profile()
+
+        outcome = "ok"
+        start = time.perf_counter()
+        try:
+            if profiler is not None:
+                return profiler.runcall(func, *args, **kwargs)
+            return func(*args, **kwargs)
+        except ToolCancelled:
+            outcome = "cancelled"
+            raise
+        except Exception:
+            outcome = "error"
+            raise
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            if profiler is not None:
+                self._profile_lock.release()
+            profile_path = self._dump_profile(name, profiler)
+            self._observe(name, elapsed_ms, outcome, stats)
+            if self.trace_file:
+                self._trace(
+                    {
+                        "time": time.time(),
+                        "tool": name,
+                        "arguments": kwargs,
+                        "ms": round(elapsed_ms, 3),
+                        "outcome": outcome,
+                        **stats,
+                        **({"profile": profile_path} if profile_path else {}),
+                    }
+                )
+
+    def _observe(
+        self, name: str, elapsed_ms: float, outcome: str, stats: Dict[str, Any]
+    ) -> None:
+        with self._lock:
+            tool = self._tools.get(name)
+            if tool is None:
+                tool = {
+                    "calls": 0,
+                    "errors": 0,
+                    "cancelled": 0,
+                    "cache_hits": 0,
+                    "bytes_scanned": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "histogram": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+                    "samples": deque(maxlen=LATENCY_SAMPLES),
+                }
+                self._tools[name] = tool
+            tool["calls"] += 1
+            tool["errors"] += outcome == "error"
+            tool["cancelled"] += outcome == "cancelled"
+            tool["cache_hits"] += stats["cache_hit"]
+            tool["bytes_scanned"] += stats["bytes_scanned"]
+            tool["total_ms"] += elapsed_ms
+            tool["max_ms"] = max(tool["max_ms"], elapsed_ms)
+            tool["histogram"][bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+            tool["samples"].append(elapsed_ms)
+
+    def _trace(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, default=str) + "\n"
+        try:
+            with self._lock, open(self.trace_file, "a", encoding="utf-8") as f:
+                f.write(line)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _dump_profile(name: str, profiler: Optional[cProfile.Profile]) -> str:
+        if profiler is None:
+            return ""
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            path = os.path.join(PROFILE_DIR, f"{name}-{time.time():.6f}.prof")
+            profiler.dump_stats(path)
+            return path
+        except OSError:
+            return ""
+
+    def library_memory(self, lib: LibraryIndex) -> int:
+        """Deep size in bytes of a library's in-memory index, cached per index."""
+        cached = self._memory.get(lib.name)
+        if cached is not None and cached[0] is lib:
+            return cached[1]
+        size = deep_sizeof(lib.__dict__)
+        self._memory[lib.name] = (lib, size)
+        return size
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            tools = {}
+            for name, tool in sorted(self._tools.items()):
+                samples = sorted(tool["samples"])
+                tools[name] = {
+                    "calls": tool["calls"],
+                    "errors": tool["errors"],
+                    "cancelled": tool["cancelled"],
+                    "cache_hits": tool["cache_hits"],
+                    "bytes_scanned": tool["bytes_scanned"],
+                    "mean_ms": round(tool["total_ms"] / tool["calls"], 3),
+                    "max_ms": round(tool["max_ms"], 3),
+                    "p50_ms": round(percentile(samples, 50), 3),
+                    "p95_ms": round(percentile(samples, 95), 3),
+                    "p99_ms": round(percentile(samples, 99), 3),
+                    "histogram_ms": {
+                        (f"<={bound}" if i < len(LATENCY_BUCKETS_MS) else "more"): n
+                        for i, (bound, n) in enumerate(
+                            zip(LATENCY_BUCKETS_MS + (None,), tool["histogram"])
+                        )
+                        if n
+                    },
+                }
+            index_events = list(self._index_events)
+        return {
+            "uptime_s": round(time.time() - self.started, 1),
+            "tools": tools,
+            "index_events": index_events,
+        }
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list (0.0 when empty)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(math.ceil(pct / 100 * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+def deep_sizeof(obj: Any) -> int:
+    """Approximate memory held by nested dicts, lists, tuples, strings and numbers."""
+    seen: set = set()
+    total = 0
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(type(item), "__slots__"):
+            stack.extend(getattr(item, name, None) for name in type(item).__slots__)
+    return total
+
+
+REQUEST_STATS: contextvars.ContextVar = contextvars.ContextVar(
+    "request_stats", default=None
+)
+METRICS = ServerMetrics(TRACE_FILE)
+
+
+class ToolCancelled(BaseException):
+    """
+    Raised inside a tool whose request the client abandoned. A BaseException,
+    so the per-library `except Exception` guards in the tools let it through.
+    """
+
+
+TOOL_EXECUTOR = ThreadPoolExecutor(
+    max_workers=TOOL_WORKERS, thread_name_prefix="nim-docs-tool"
+)
+TOOL_CANCEL: contextvars.ContextVar = contextvars.ContextVar(
+    "tool_cancel", default=None
+)
+
+
+def check_cancelled() -> None:
+    """Stop the running tool if its request was cancelled."""
+    cancel = TOOL_CANCEL.get()
+    if cancel is not None and cancel.is_set():
+        raise ToolCancelled()
+
+
+def offloaded_tool(func):
+    """
+    Turn a blocking tool into a coroutine that runs it in TOOL_EXECUTOR, so
+    the event loop keeps answering other requests meanwhile.
+
+    When the request is cancelled, a call still queued is dropped and a
+    running one stops at its next check_cancelled().
+    """
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        cancel = threading.Event()
+        context = contextvars.copy_context()
+        context.run(TOOL_CANCEL.set, cancel)
+        loop = asyncio.get_running_loop()
+        call = functools.partial(
+            context.run, METRICS.run_tool, func.__name__, func, args, kwargs
+        )
+        try:
+            return await loop.run_in_executor(TOOL_EXECUTOR, call)
+        except asyncio.CancelledError:
+            cancel.set()
+            raise
+
+    return wrapper
+
+
+def cached_tool(func):
+    """Serve repeated calls of a tool from RESULT_CACHE."""
+    signature = inspect.signature(func)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = RESULT_CACHE.make_key(func.__name__, dict(bound.arguments))
+        result = RESULT_CACHE.get(key)
+        if result is not None:
+            METRICS.mark_cache_hit()
+            return result
+
+        token = RESULT_CACHE._cacheable.set(True)
+        try:
+            result = func(*args, **kwargs)
+            if RESULT_CACHE._cacheable.get():
+                RESULT_CACHE.put(key, result)
+        finally:
+            RESULT_CACHE._cacheable.reset(token)
+        return result
+
+    return wrapper
+
+
+class LibraryRegistry:
+    """
+    Read-only mapping of library key to LibraryIndex, filled by a background
+    thread so the server can answer the MCP handshake before indexing ends.
+
+    Library names come from a directory listing and summaries from the
+    manifest, both available at once. Looking up a library waits only until
+    that library is loaded.
+
+    refresh() re-indexes libraries whose files changed and swaps the new
+    indexes in by replacing whole dicts, so calls already holding a
+    LibraryIndex finish with it undisturbed.
+    """
+
+    def __init__(self):
+        self._libraries: Dict[str, LibraryIndex] = {}
+        self._ready: Dict[str, threading.Event] = {}
+        self._names: Dict[str, str] = {}
+        self._manifest: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Start loading in the background; later calls do nothing."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            if os.path.exists(DOCS_PATH):
+                self._names = {
+                    item.lower(): item
+                    for item in list_library_dirs()
+                    if os.path.exists(
+                        full_context_path(os.path.join(DOCS_PATH, item), item)
+                    )
+                }
+            self._ready = {key: threading.Event() for key in self._names}
+            self._manifest = load_manifest()
+            self._thread = threading.Thread(
+                target=self._load, name="nim-docs-index"
+            )
+            self._thread.start()
+
+    def _load(self) -> None:
+        try:
+            load_library_index(on_ready=self._publish)
+        except Exception as e:
+            print(f"Error loading documentation index: {e}", file=sys.stderr)
+        finally:
+            for key in list(self._names):
+                if key not in self._libraries:
+                    del self._names[key]
+            for event in self._ready.values():
+                event.set()
+
+        if numpy is not None:
+            try:
+                SEMANTIC_INDEX.get(list(self._libraries.values()))
+            except Exception as e:
+                print(f"Error building semantic index: {e}", file=sys.stderr)
+
+    def _publish(self, lib_key: str, lib: LibraryIndex) -> None:
+        self._libraries[lib_key] = lib
+        self._names.setdefault(lib_key, lib.name)
+        self._ready.setdefault(lib_key, threading.Event()).set()
+
+    def wait(self, lib_key: str) -> Optional[LibraryIndex]:
+        self.start()
+        event = self._ready.get(lib_key)
+        if event is None:
+            return None
+        event.wait()
+        return self._libraries.get(lib_key)
+
+    def is_ready(self, lib_key: str) -> bool:
+        event = self._ready.get(lib_key)
+        return event is not None and event.is_set()
+
+    def names(self) -> List[str]:
+        """Display names of all libraries, without waiting for any index."""
+        self.start()
+        return list(self._names.values())
+
+    def summary(self, lib_key: str) -> Optional[Dict[str, Any]]:
+        """A library's summary, from the manifest when it is still current."""
+        lib = self._libraries.get(lib_key)
+        if lib is not None:
+            return lib.summary()
+        entry = self._manifest.get(lib_key)
+        if entry is not None:
+            item = self._names.get(lib_key, entry["name"])
+            filepath = full_context_path(os.path.join(DOCS_PATH, item), item)
+            try:
+                if abs(os.path.getmtime(filepath) - entry["file_mtime"]) <= 0.001:
+                    return entry
+            except OSError:
+                pass
+        lib = self.wait(lib_key)
+        return lib.summary() if lib is not None else None
+
+    def library_files(self) -> Dict[str, str]:
+        """Full-context file path of every library, without waiting."""
+        self.start()
+        return {
+            key: full_context_path(os.path.join(DOCS_PATH, item), item)
+            for key, item in self._names.items()
+        }
+
+    def index_mtimes(self) -> Dict[str, float]:
+        """
+        The file mtime each library's index was built from, or for libraries
+        still loading, the mtime of their file now. Does not wait.
+        """
+        libraries = self._libraries
+        mtimes: Dict[str, float] = {}
+        for key, filepath in self.library_files().items():
+            lib = libraries.get(key)
+            if lib is not None:
+                mtimes[key] = lib.file_mtime
+                continue
+            try:
+                mtimes[key] = os.path.getmtime(filepath)
+            except OSError:
+                mtimes[key] = 0.0
+        return mtimes
+
+    def refresh(self) -> List[str]:
+        """
+        Re-index the libraries whose full-context file changed, appeared or
+        disappeared since it was indexed, then swap them in and drop what
+        depended on the old indexes. Returns the keys that changed.
+        """
+        self.start()
+        if self._thread is not None:
+            self._thread.join()
+
+        with self._refresh_lock:
+            names: Dict[str, str] = {}
+            changed: List[str] = []
+            if os.path.exists(DOCS_PATH):
+                for item in list_library_dirs():
+                    filepath = full_context_path(os.path.join(DOCS_PATH, item), item)
+                    try:
+                        mtime = os.path.getmtime(filepath)
+                    except OSError:
+                        continue
+                    names[item.lower()] = item
+                    lib = self._libraries.get(item.lower())
+                    if lib is None or abs(mtime - lib.file_mtime) > 0.001:
+                        changed.append(item)
+            removed = [key for key in self._libraries if key not in names]
+            if not changed and not removed:
+                return []
+
+            started = time.perf_counter()
+            cache = load_index_cache()
+            block_cache: Dict[str, Dict[str, Any]] = cache.get("blocks", {})
+            libraries = dict(self._libraries)
+            libraries.update(build_libraries(changed, block_cache))
+            for key in removed:
+                del libraries[key]
+            for key in set(block_cache) - set(libraries):
+                del block_cache[key]
+            save_index_cache(libraries, block_cache)
+
+            old_libraries = self._libraries
+            for key in libraries:
+                self._ready.setdefault(key, threading.Event()).set()
+            self._libraries = libraries
+            self._names = {key: item for key, item in names.items() if key in libraries}
+
+            for item in changed:
+                DOCUMENT_STORE.invalidate(item)
+            for key in removed:
+                DOCUMENT_STORE.invalidate(old_libraries[key].name)
+            RESULT_CACHE.clear()
+            METRICS.record_index(
+                "refresh",
+                time.perf_counter() - started,
+                changed=[item.lower() for item in changed],
+                removed=removed,
+            )
+            return [item.lower() for item in changed] + removed
+
+    def __contains__(self, lib_key: object) -> bool:
+        self.start()
+        return lib_key in self._names
+
+    def __getitem__(self, lib_key: str) -> LibraryIndex:
+        lib = self.wait(lib_key)
+        if lib is None:
+            raise KeyError(lib_key)
+        return lib
+
+    def __iter__(self) -> Iterator[str]:
+        self.start()
+        return iter(list(self._names))
+
+    def __len__(self) -> int:
+        self.start()
+        return len(self._names)
+
+    def values(self) -> Iterator[LibraryIndex]:
+        """Yield every library, waiting for each one in turn."""
+        for lib_key in self:
+            lib = self.wait(lib_key)
+            if lib is not None:
+                yield lib
+
+
+LIBRARY_INDEX = LibraryRegistry()
+
+
+def semantic_features(text: str) -> Dict[str, int]:
+    """
+    Count the TF-IDF features of a text: its words, with identifiers split at
+    camelCase and underscores and stopwords dropped, plus each long word's
+    first SEMANTIC_PREFIX_CHARS characters, so "rectangle" meets "rect" and
+    "rounded" meets "round".
+    """
+    features: Dict[str, int] = {}
+    for word in SEMANTIC_WORD_PATTERN.findall(text):
+        word = word.lower()
+        if word in SEMANTIC_STOPWORDS:
+            continue
+        features[word] = features.get(word, 0) + 1
+        if len(word) > SEMANTIC_PREFIX_CHARS:
+            prefix = word[:SEMANTIC_PREFIX_CHARS]
+            features[prefix] = features.get(prefix, 0) + 1
+    return features
+
+
+class SemanticIndex:
+    """
+    Section- and symbol-level TF-IDF vectors for all libraries, as a sparse
+    matrix in compressed-column form (one column of unit rows and weights per
+    feature) kept in NumPy arrays and saved to SEMANTIC_INDEX_FILE.
+
+    Units are the markdown section spans and the parsed Nim symbols of each
+    LibraryIndex. Rows are L2-normalised, so a query's scores are cosine
+    similarities, computed with one weighted bincount over the query's
+    feature columns.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._data: Optional[Dict[str, Any]] = None
+
+    @staticmethod
+    def fingerprint(libraries: List[LibraryIndex]) -> str:
+        return json.dumps(
+            [INDEX_VERSION, sorted((lib.name, lib.file_mtime) for lib in libraries)]
+        )
+
+    def get(self, libraries: List[LibraryIndex]) -> Dict[str, Any]:
+        """The matrix for these libraries: in memory, from disk, or rebuilt."""
+        fingerprint = self.fingerprint(libraries)
+        with self._lock:
+            if self._data is None or self._data["fingerprint"] != fingerprint:
+                data = self._load()
+                if data is None or data["fingerprint"] != fingerprint:
+                    started = time.perf_counter()
+                    data = self._build(libraries, fingerprint)
+                    self._save(data)
+                    METRICS.record_index(
+                        "semantic_build",
+                        time.perf_counter() - started,
+                        units=len(data["units"]),
+                    )
+                self._data = data
+            return self._data
 
-    if search_type == SearchType.REGEX:
+    def _load(self) -> Optional[Dict[str, Any]]:
+        try:
+            with numpy.load(self.path, allow_pickle=False) as npz:
+                data = {name: npz[name] for name in npz.files}
+        except Exception:
+            return None
+        data["fingerprint"] = str(data["fingerprint"])
+        data["units"] = json.loads(data["units"].tobytes().decode("utf-8"))
+        data["lookup"] = {f: i for i, f in enumerate(data["vocabulary"].tolist())}
+        return data
+
+    def _save(self, data: Dict[str, Any]) -> None:
+        buffer = io.BytesIO()
+        numpy.savez(
+            buffer,
+            fingerprint=numpy.array(data["fingerprint"]),
+            vocabulary=data["vocabulary"],
+            idf=data["idf"],
+            indptr=data["indptr"],
+            rows=data["rows"],
+            weights=data["weights"],
+            libraries=data["libraries"],
+            unit_library=data["unit_library"],
+            units=numpy.frombuffer(
+                json.dumps(data["units"]).encode("utf-8"), dtype=numpy.uint8
+            ),
+        )
         try:
-            matches = list(re.finditer(query, content, re.IGNORECASE))
-            if not matches:
-                return 0.0
-            score = len(matches) * 0.5
-            for m in matches[:5]:
-                pos = m.start()
-                context_start = max(0, pos - 50)
-                context_end = min(len(content), pos + 50)
-                context = content[context_start:context_end].lower()
-                header_bonus = (
-                    2.0 if any(h in context for h in ["#", "##", "###"]) else 0
+            write_atomically(self.path, buffer.getvalue())
+        except OSError as e:
+            print(f"Error saving semantic index: {e}", file=sys.stderr)
+
+    def _build(
+        self, libraries: List[LibraryIndex], fingerprint: str
+    ) -> Dict[str, Any]:
+        units: List[Dict[str, Any]] = []
+        unit_features: List[Dict[str, int]] = []
+
+        for lib in libraries:
+            lines = DOCUMENT_STORE.get(lib)
+            for section in lib.sections:
+                start = section.start_line
+                end = min(section.end_line, start + SEMANTIC_UNIT_LINES)
+                units.append(
+                    {
+                        "library": lib.name,
+                        "kind": "section",
+                        "title": section.title,
+                        "file": section.file,
+                        "line": start,
+                    }
+                )
+                unit_features.append(semantic_features(lines.text(start, end)))
+            for symbol in lib.symbols:
+                units.append(
+                    {
+                        "library": lib.name,
+                        "kind": symbol["kind"],
+                        "title": symbol["name"],
+                        "file": symbol["file"],
+                        "line": symbol["line"],
+                    }
+                )
+                unit_features.append(
+                    semantic_features(
+                        f"{symbol['name']} {symbol['signature']} {symbol['doc']}"
+                    )
                 )
-                code_bonus = 1.5 if "```" in context else 0
-                score += header_bonus + code_bonus
-            return min(score, 10.0)
-        except re.error:
-            return 0.0
-
-    count = content_lower.count(query_lower)
-    if count == 0:
-        return 0.0
 
-    score = count * 0.3
+        vocabulary = sorted({f for features in unit_features for f in features})
+        lookup = {f: i for i, f in enumerate(vocabulary)}
+        rows = numpy.fromiter(
+            (u for u, features in enumerate(unit_features) for _ in features),
+            dtype=numpy.int32,
+        )
+        cols = numpy.fromiter(
+            (lookup[f] for features in unit_features for f in features),
+            dtype=numpy.int32,
+        )
+        counts = numpy.fromiter(
+            (n for features in unit_features for n in features.values()),
+            dtype=numpy.float32,
+        )
 
-    if (
-        content_lower.startswith(query_lower)
-        or content_lower[:100].count(query_lower) > 0
-    ):
-        score += 1.0
+        df = numpy.bincount(cols, minlength=len(vocabulary))
+        idf = (numpy.log((len(units) + 1) / (df + 1)) + 1).astype(numpy.float32)
+        weights = numpy.log1p(counts) * idf[cols]
+        norms = numpy.sqrt(
+            numpy.bincount(rows, weights=weights**2, minlength=len(units))
+        )
+        weights = (weights / norms[rows]).astype(numpy.float32)
+
+        order = numpy.argsort(cols, kind="stable")
+        library_ids = {lib.name: i for i, lib in enumerate(libraries)}
+        return {
+            "fingerprint": fingerprint,
+            "vocabulary": numpy.array(vocabulary, dtype=str),
+            "idf": idf,
+            "indptr": numpy.concatenate(([0], numpy.cumsum(df))).astype(numpy.int64),
+            "rows": rows[order],
+            "weights": weights[order],
+            "libraries": numpy.array([lib.name for lib in libraries], dtype=str),
+            "unit_library": numpy.array(
+                [library_ids[unit["library"]] for unit in units], dtype=numpy.int32
+            ),
+            "units": units,
+            "lookup": lookup,
+        }
+
+    @staticmethod
+    def query(
+        data: Dict[str, Any], text: str, k: int, library_name: str = ""
+    ) -> List[tuple]:
+        """The k best (unit index, cosine score) pairs for a query, best first."""
+        features = semantic_features(text)
+        cols = [data["lookup"][f] for f in features if f in data["lookup"]]
+        if not cols or k <= 0:
+            return []
+        query_weights = numpy.log1p(
+            numpy.array([features[f] for f in features if f in data["lookup"]])
+        ) * data["idf"][cols]
+        query_weights /= numpy.linalg.norm(query_weights)
+
+        indptr = data["indptr"]
+        spans = [numpy.arange(indptr[c], indptr[c + 1]) for c in cols]
+        entries = numpy.concatenate(spans)
+        scores = numpy.bincount(
+            data["rows"][entries],
+            weights=data["weights"][entries]
+            * numpy.repeat(query_weights, [len(span) for span in spans]),
+            minlength=len(data["units"]),
+        )
+        if library_name:
+            names = [name.lower() for name in data["libraries"].tolist()]
+            library = names.index(library_name.lower())
+            scores[data["unit_library"] != library] = 0.0
+
+        k = min(k, int(numpy.count_nonzero(scores > 0)))
+        if k == 0:
+            return []
+        top = numpy.argpartition(-scores, k - 1)[:k]
+        top = top[numpy.argsort(-scores[top], kind="stable")]
+        return [(int(u), float(scores[u])) for u in top]
+
+
+SEMANTIC_INDEX = SemanticIndex(SEMANTIC_INDEX_FILE)
+
+
+class InotifyWaiter:
+    """
+    Minimal inotify binding over ctypes: wakes the watcher when anything under
+    the watched directories is written, moved, created or deleted. Raises
+    OSError where inotify is unavailable.
+    """
+
+    EVENTS = 0x002 | 0x004 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+
+    def watch(self, path: str) -> None:
+        """Watch a directory; watching it again does nothing."""
+        self._libc.inotify_add_watch(self._fd, os.fsencode(path), self.EVENTS)
+
+    def wait(self, timeout: float) -> bool:
+        """Block until an event or the timeout; True if events arrived."""
+        ready, _, _ = select.select([self._fd], [], [], timeout)
+        if not ready:
+            return False
+        try:
+            while os.read(self._fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self) -> None:
+        os.close(self._fd)
 
-    code_match = "```" in content and any(
-        c in content_lower for c in ["proc", "func", "type", "var", "let", "import"]
-    )
-    if code_match:
-        score += 0.5
 
-    header_bonus = 1.0 if any(h in content_lower[:200] for h in ["#", "##"]) else 0
-    score += header_bonus
+class LibraryWatcher:
+    """
+    Background thread that keeps LIBRARY_INDEX in step with refs/: on an
+    inotify event (or every WATCH_INTERVAL seconds where inotify is missing,
+    and as a safety net otherwise) it lets writes settle for WATCH_SETTLE
+    seconds, then calls LIBRARY_INDEX.refresh().
+    """
+
+    def __init__(self, registry: LibraryRegistry, interval: float):
+        self.registry = registry
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        if self._thread is not None or self.interval <= 0:
+            return
+        self._thread = threading.Thread(target=self._run, name="nim-docs-watcher")
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        try:
+            waiter: Optional[InotifyWaiter] = InotifyWaiter()
+        except (OSError, AttributeError):
+            waiter = None
+
+        try:
+            while not self._stop.is_set():
+                if waiter is not None and os.path.isdir(DOCS_PATH):
+                    waiter.watch(DOCS_PATH)
+                    for item in list_library_dirs():
+                        waiter.watch(os.path.join(DOCS_PATH, item))
+                    if waiter.wait(self.interval):
+                        self._stop.wait(WATCH_SETTLE)
+                else:
+                    self._stop.wait(self.interval)
+                if self._stop.is_set():
+                    break
 
-    return min(score, 10.0)
+                try:
+                    if self.registry.refresh() and numpy is not None:
+                        SEMANTIC_INDEX.get(list(self.registry.values()))
+                except Exception as e:
+                    print(
+                        f"Error refreshing documentation index: {e}", file=sys.stderr
+                    )
+        finally:
+            if waiter is not None:
+                waiter.close()
 
 
-LIBRARY_INDEX = load_library_index()
+LIBRARY_WATCHER = LibraryWatcher(LIBRARY_INDEX, WATCH_INTERVAL)
 
 
 @mcp.tool()
+@offloaded_tool
 def list_nim_libraries() -> str:
     """
     List all available Nim library documentation in the knowledge base.
@@ -268,18 +3003,10 @@ def list_nim_libraries() -> str:
     if not LIBRARY_INDEX:
         return "No documentation libraries found."
 
+    summaries = [LIBRARY_INDEX.summary(lib_key) for lib_key in LIBRARY_INDEX]
     result = {
         "count": len(LIBRARY_INDEX),
-        "libraries": [
-            {
-                "name": lib.name,
-                "description": lib.description,
-                "topics": lib.topics,
-                "section_count": len(lib.sections),
-                "header_count": len(lib.headers),
-            }
-            for lib in LIBRARY_INDEX.values()
-        ],
+        "libraries": [summary for summary in summaries if summary is not None],
     }
 
     output = f"Available Nim Documentation Libraries ({result['count']}):\n\n"
@@ -298,6 +3025,8 @@ def list_nim_libraries() -> str:
 
 
 @mcp.tool()
+@offloaded_tool
+@cached_tool
 def get_nim_library_toc(library_name: str = "") -> str:
     """
     Get the table of contents/headers for a specific library or all libraries.
@@ -312,16 +3041,28 @@ def get_nim_library_toc(library_name: str = "") -> str:
     if library_name:
         lib_key = library_name.lower()
         if lib_key not in LIBRARY_INDEX:
-            available = ", ".join(lib.name for lib in LIBRARY_INDEX.values())
+            available = ", ".join(LIBRARY_INDEX.names())
             return f"Library '{library_name}' not found. Available: {available}"
 
         lib = LIBRARY_INDEX[lib_key]
         output = f"Table of Contents: {lib.name}\n{'=' * 40}\n\n"
 
+        current_file = -1
         for header in lib.headers:
-            indent = "  " * (header["level"] - 1)
-            line_num = header["line"]
-            output += f"{indent}• {header['title']} (line {line_num})\n"
+            if header.file != current_file and header.file >= 0:
+                current_file = header.file
+                output += f"[{lib.files[current_file]['path']}]\n"
+            indent = "  " * (header.level - 1)
+            line_num = header.line
+            output += f"{indent}• {header.title} (line {line_num})\n"
+
+        if lib.files:
+            output += f"\nFiles ({len(lib.files)}):\n"
+            for entry in lib.files:
+                output += (
+                    f"  {entry['path']} "
+                    f"(lines {entry['start_line']}-{entry['end_line']})\n"
+                )
 
         output += f"\nTopics: {', '.join(lib.topics)}\n"
         output += f"Total sections: {len(lib.sections)}\n"
@@ -331,9 +3072,9 @@ def get_nim_library_toc(library_name: str = "") -> str:
     output = "All Library Tables of Contents\n" + "=" * 40 + "\n\n"
     for lib in LIBRARY_INDEX.values():
         output += f"--- {lib.name} ({len(lib.headers)} headers) ---\n"
-        top_headers = [h for h in lib.headers if h["level"] == 1][:5]
+        top_headers = [h for h in lib.headers if h.level == 1][:5]
         for h in top_headers:
-            output += f"  • {h['title']}\n"
+            output += f"  • {h.title}\n"
         if len(lib.headers) > 5:
             output += f"  ... and {len(lib.headers) - 5} more\n"
         output += "\n"
@@ -342,11 +3083,14 @@ def get_nim_library_toc(library_name: str = "") -> str:
 
 
 @mcp.tool()
+@offloaded_tool
+@cached_tool
 def search_nim_docs(
     query: str,
     library_name: str = "",
     search_type: str = "substring",
     max_results: int = 5,
+    max_chars: int = 0,
 ) -> str:
     """
     Search the Nim library documentation for specific concepts, syntax, or patterns.
@@ -357,6 +3101,10 @@ def search_nim_docs(
         library_name: (Optional) Limit search to a specific library (e.g., "necsus", "nim-chronos")
         search_type: Type of search - "substring", "regex", or "topic" (default: "substring")
         max_results: Maximum number of results to return (default: 5, max: 20)
+        max_chars: (Optional) Response budget in characters, about 4 per token.
+                   When set, the best matches are returned as merged, deduplicated
+                   excerpts until the budget is full, instead of max_results
+                   snippets cut to 300 characters.
     """
     max_results = min(max_results, 20)
 
@@ -367,7 +3115,7 @@ def search_nim_docs(
     if library_name:
         lib_key = library_name.lower()
         if lib_key not in LIBRARY_INDEX:
-            available = ", ".join(lib.name for lib in LIBRARY_INDEX.values())
+            available = ", ".join(LIBRARY_INDEX.names())
             return f"Library '{library_name}' not found. Available: {available}"
         libraries_to_search = [LIBRARY_INDEX[lib_key]]
     else:
@@ -375,118 +3123,544 @@ def search_nim_docs(
 
     search_type_enum = SearchType(search_type)
 
-    results: List[Dict[str, Any]] = []
-    for lib in libraries_to_search:
-        filepath = os.path.join(lib.path, f"{lib.name}_full_context.txt")
+    pattern = None
+    if search_type_enum == SearchType.REGEX:
+        try:
+            pattern = compile_query_pattern(query)
+        except re.error as e:
+            return f"Invalid regex '{query}': {e}"
+    started = time.monotonic()
+    deadline = started + REGEX_TIME_BUDGET
+    partial = False
+
+    top = TopResults(PACK_MAX_HITS if max_chars > 0 else max_results)
+    for lib_order, lib in enumerate(libraries_to_search):
+        check_cancelled()
+        filepath = full_context_path(lib.path, lib.name)
         if not os.path.exists(filepath):
             continue
+        order_base = lib_order << 32
 
         try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                content = f.read()
-
             if search_type_enum == SearchType.TOPIC:
-                matches: List[tuple] = []
-                for section in lib.sections:
-                    if query.lower() in section.get("title", "").lower():
-                        matches.append((section, 5.0))
-                for header in lib.headers:
-                    if query.lower() in header["title"].lower():
-                        matches.append((header, 3.0))
+                rows = lib.headers.find_titles(query.lower())
+
+                # Each matching header counts once as a section, then as a header.
+                matches: List[tuple] = [
+                    (lib.sections[i].section_dict(), 5.0) for i in rows[:max_results]
+                ]
+                matches += [
+                    (lib.headers[i].header_dict(), 3.0)
+                    for i in rows[: max_results - len(matches)]
+                ]
                 for t in lib.topics:
                     if query.lower() in t.lower():
                         topic_match: List[Dict[str, str]] = [{"topic": t}]
                         matches.append((topic_match, 2.0))
                         break
-                for match, score in matches[:max_results]:
-                    results.append(
+                for n, (match, score) in enumerate(matches[:max_results]):
+                    top.push(
+                        score,
+                        order_base + n,
                         {
                             "library": lib.name,
                             "match": match,
                             "score": score,
                             "type": "topic",
-                        }
+                        },
                     )
             else:
-                content_lower = content.lower()
-                query_lower = query.lower()
+                lines = DOCUMENT_STORE.get(lib)
 
                 if search_type_enum == SearchType.SUBSTRING:
-                    lines = content.split("\n")
-                    for i, line in enumerate(lines):
-                        if query_lower in line.lower():
-                            score = rank_match(content, query, search_type_enum)
-                            start = max(0, i - 3)
-                            end = min(len(lines), i + 10)
-                            snippet = "\n".join(lines[start:end])
-                            results.append(
-                                {
-                                    "library": lib.name,
-                                    "match": {"line": i, "snippet": snippet},
-                                    "score": score,
-                                    "type": "substring",
-                                }
-                            )
-                            if len(results) >= max_results * 3:
-                                break
+                    hit_lines, hit_counts = find_hit_lines(lib, lines, query)
+                    push_substring_hits(
+                        top, lib, lines, query, hit_lines, hit_counts, order_base
+                    )
                 else:
-                    score = rank_match(content, query, search_type_enum)
-                    if score > 0:
-                        lines = content.split("\n")
-                        matched_lines: List[int] = []
-                        pattern = re.compile(query, re.IGNORECASE)
-                        for i, line in enumerate(lines):
-                            if pattern.search(line):
-                                matched_lines.append(i)
-                                if len(matched_lines) >= 10:
-                                    break
-                        if matched_lines:
-                            start = max(0, matched_lines[0] - 3)
-                            end = min(len(lines), matched_lines[-1] + 10)
-                            snippet = "\n".join(lines[start:end])
-                            results.append(
-                                {
-                                    "library": lib.name,
-                                    "match": {
-                                        "lines": matched_lines,
-                                        "snippet": snippet,
-                                    },
-                                    "score": score,
-                                    "type": "regex",
-                                }
-                            )
+                    mask = trigram_mask(lib, regex_literals(query))
+                    if mask == 0:
+                        continue
+                    ranges = None if mask is None else page_ranges(lib, mask)
+                    matched_lines, match_count, complete = scan_regex(
+                        lines, pattern, deadline, ranges
+                    )
+                    if not complete:
+                        partial = True
+                    if matched_lines:
+                        score = match_count * 0.5 + sum(
+                            proximity_bonus(lib, i) for i in matched_lines[:5]
+                        )
+                        start = max(0, matched_lines[0] - SNIPPET_BEFORE)
+                        end = min(len(lines), matched_lines[-1] + SNIPPET_AFTER)
+                        snippet = "\n".join(lines[start:end])
+                        top.push(
+                            min(score, 10.0),
+                            order_base,
+                            {
+                                "library": lib.name,
+                                "match": {
+                                    "lines": matched_lines,
+                                    "snippet": snippet,
+                                },
+                                "score": min(score, 10.0),
+                                "type": "regex",
+                            },
+                        )
 
         except Exception:
             continue
 
+    if partial:
+        RESULT_CACHE.skip_current()
+
+    elapsed_ms = (time.monotonic() - started) * 1000
+    results = top.results()
     if not results:
-        return f"No results found for '{query}' in the documentation."
+        if partial:
+            message = (
+                f"No results found for '{query}' before the search was stopped "
+                f"after {elapsed_ms:.0f} ms."
+            )
+        else:
+            message = f"No results found for '{query}' in the documentation."
+        return message[:max_chars] if max_chars > 0 else message
 
-    results.sort(key=lambda x: x["score"], reverse=True)
-    results = results[:max_results]
+    preamble = ""
+    if partial:
+        preamble = (
+            f"(search stopped after {elapsed_ms:.0f} ms; results are partial)\n\n"
+        )
+    if max_chars > 0:
+        return format_packed_results(query, results, max_chars, preamble)
 
     output = (
         f"Search Results for '{query}' ({len(results)} matches):\n" + "=" * 50 + "\n\n"
     )
+    output += preamble
 
     for i, r in enumerate(results, 1):
-        output += f"[{i}] {r['library']} (score: {r['score']:.1f}, type: {r['type']})\n"
-        match = r["match"]
-        if r["type"] == "substring":
-            output += f"    Line {match['line']}:\n"
-            output += f"    {match['snippet'][:300]}\n"
-        elif r["type"] == "regex":
-            output += f"    Lines: {match['lines']}\n"
-            output += f"    {match['snippet'][:300]}\n"
-        elif r["type"] == "topic":
-            output += f"    {match}\n"
-        output += "\n"
+        output += format_search_result(i, r)
+
+    return output
+
+
+def format_search_result(rank: int, r: Dict[str, Any]) -> str:
+    output = f"[{rank}] {r['library']} (score: {r['score']:.1f}, type: {r['type']})\n"
+    match = r["match"]
+    if r["type"] == "substring":
+        location = f" ({match['file']})" if match.get("file") else ""
+        output += f"    Line {match['line']}{location}:\n"
+        output += f"    {match['snippet'][:300]}\n"
+    elif r["type"] == "regex":
+        output += f"    Lines: {match['lines']}\n"
+        output += f"    {match['snippet'][:300]}\n"
+    elif r["type"] == "topic":
+        output += f"    {match}\n"
+    return output + "\n"
+
+
+@dataclass
+class Excerpt:
+    """A window [start, end) of lines of one library file, and the hits in it."""
+
+    lib: LibraryIndex
+    path: str
+    start: int
+    end: int
+    score: float
+    rank: int
+    kind: str
+    hits: List[int] = field(default_factory=list)
+
+
+def result_excerpts(rank: int, r: Dict[str, Any]) -> List[Excerpt]:
+    """Snippet windows around the hits of a substring or regex result."""
+    lib = LIBRARY_INDEX[r["library"].lower()]
+    match = r["match"]
+    hits = [match["line"]] if r["type"] == "substring" else match["lines"]
+    line_count = len(DOCUMENT_STORE.get(lib))
+
+    excerpts = []
+    for i in hits[:PACK_REGEX_LINES]:
+        start = max(0, i - SNIPPET_BEFORE)
+        end = min(line_count, i + SNIPPET_AFTER)
+        file = lib.file_at_line(i)
+        if file is not None:
+            start = max(start, file["start_line"])
+            end = min(end, file["end_line"])
+        path = file["path"] if file is not None else ""
+        excerpts.append(
+            Excerpt(lib, path, start, end, r["score"], rank, r["type"], [i])
+        )
+    return excerpts
+
+
+def merge_excerpts(excerpts: List[Excerpt]) -> List[Excerpt]:
+    """Merge windows of the same file that overlap or touch."""
+    merged: List[Excerpt] = []
+    for e in sorted(excerpts, key=lambda e: (e.lib.name, e.start)):
+        last = merged[-1] if merged else None
+        if (
+            last is not None
+            and last.lib is e.lib
+            and last.path == e.path
+            and e.start <= last.end
+        ):
+            last.end = max(last.end, e.end)
+            last.score = max(last.score, e.score)
+            last.rank = min(last.rank, e.rank)
+            last.hits.extend(e.hits)
+        else:
+            merged.append(e)
+    return merged
+
+
+def excerpt_header(
+    n: int, e: Excerpt, start: int, end: int, compact: bool = False
+) -> str:
+    if compact:
+        return f"[{n}] {e.lib.name} line {start}:\n"
+    location = f" {e.path}" if e.path else ""
+    return (
+        f"[{n}] {e.lib.name} (score: {e.score:.1f}, type: {e.kind})"
+        f"{location} lines {start}-{end - 1}:\n"
+    )
+
+
+def fit_window(
+    sizes: List[int], pivot: int, header_size: int, room: int
+) -> Optional[tuple]:
+    """
+    Grow a window of lines out from pivot, alternating below and above, while
+    it still fits in room characters. None if not even the pivot line fits.
+    """
+    used = header_size + sizes[pivot]
+    if used > room:
+        return None
+    lo, hi = pivot, pivot + 1
+    while True:
+        grown = False
+        if hi < len(sizes) and used + sizes[hi] <= room:
+            used += sizes[hi]
+            hi += 1
+            grown = True
+        if lo > 0 and used + sizes[lo - 1] <= room:
+            lo -= 1
+            used += sizes[lo]
+            grown = True
+        if not grown:
+            return lo, hi
+
+
+def pack_excerpts(excerpts: List[Excerpt], budget: int) -> tuple:
+    """
+    Render merged excerpts best first into at most budget characters. Text
+    identical to an excerpt already shown is replaced by a pointer to it, and
+    an excerpt longer than what is left, or than half the budget so one run of
+    hits cannot crowd out the rest, is cut down around its first hit. When
+    not even that line fits, the best excerpt still shows the start of it.
+    Returns the rendered blocks and the number of excerpts that did not fit.
+    """
+    blocks: List[List[str]] = []
+    seen: Dict[str, int] = {}
+    omitted = 0
+    remaining = budget
+    min_chars = min(PACK_MIN_CHARS, budget)
+
+    for e in sorted(
+        merge_excerpts(excerpts), key=lambda e: (-e.score, e.rank, e.start)
+    ):
+        check_cancelled()
+        text_lines = DOCUMENT_STORE.get(e.lib)[e.start : e.end]
+        key = "\n".join(line.strip() for line in text_lines).strip()
+        if key in seen:
+            path = f" {e.path}" if e.path else ""
+            note = f"(same text also at {e.lib.name}{path} line {e.start})\n"
+            if len(note) <= remaining:
+                blocks[seen[key]].insert(-1, note)
+                remaining -= len(note)
+            continue
+        if remaining < min_chars or remaining <= 0:
+            omitted += 1
+            continue
+
+        start, end = e.start, e.end
+        header = excerpt_header(len(blocks) + 1, e, start, end)
+        sizes = [len(line) + 1 for line in text_lines]
+        room = min(remaining, max(budget // 2, min_chars))
+        if len(header) + sum(sizes) + 1 > room:
+            # Headers only get shorter as the window shrinks.
+            pivot = min(e.hits) - e.start
+            window = fit_window(sizes, pivot, len(header), room - 1)
+            if window is None and not blocks:
+                window = (pivot, pivot + 1)
+            if window is None:
+                omitted += 1
+                continue
+            start, end = e.start + window[0], e.start + window[1]
+            text_lines = text_lines[window[0] : window[1]]
+            header = excerpt_header(len(blocks) + 1, e, start, end)
+            cut = room - len(header) - 2
+            if len(text_lines) == 1 and len(text_lines[0]) > cut:
+                header = excerpt_header(len(blocks) + 1, e, start, end, True)
+                cut = room - len(header) - 2
+                if cut <= 0:
+                    omitted += 1
+                    continue
+                text_lines = [text_lines[0][:cut]]
+
+        block = [header, "\n".join(text_lines) + "\n", "\n"]
+        remaining -= sum(len(part) for part in block)
+        seen[key] = len(blocks)
+        blocks.append(block)
+
+    return ["".join(block) for block in blocks], omitted
+
+
+def format_packed_results(
+    query: str, results: List[Dict[str, Any]], max_chars: int, preamble: str
+) -> str:
+    """
+    Search output that fills max_chars by score: overlapping snippets are
+    merged into one excerpt and duplicate text is only shown once.
+
+    The frame around the excerpts is sized for the largest counts it can
+    show. When the full frame would leave less than PACK_MIN_CHARS for the
+    excerpts, a one-line one is used, and a budget too small even for that
+    cuts the output at max_chars.
+    """
+    if results[0]["type"] == "topic":
+        blocks = [format_search_result(i, r) for i, r in enumerate(results, 1)]
+        excerpts: List[Excerpt] = []
+    else:
+        excerpts = [
+            e for rank, r in enumerate(results) for e in result_excerpts(rank, r)
+        ]
+    most = max(len(results), len(excerpts))
+
+    compact = False
+    frame = packed_frame(query, most, len(results), most, max_chars, compact)
+    budget = max_chars - len(preamble) - sum(map(len, frame))
+    if budget < PACK_MIN_CHARS:
+        compact = True
+        frame = packed_frame(query, most, len(results), most, max_chars, compact)
+        budget = max_chars - len(preamble) - sum(map(len, frame))
+
+    if excerpts:
+        blocks, omitted = pack_excerpts(excerpts, budget)
+    else:
+        kept: List[str] = []
+        for block in blocks:
+            if sum(map(len, kept)) + len(block) > budget:
+                break
+            kept.append(block)
+        blocks, omitted = kept, len(blocks) - len(kept)
+
+    header, footer = packed_frame(
+        query, len(blocks), len(results), omitted, max_chars, compact
+    )
+    return (header + preamble + "".join(blocks) + footer)[:max_chars]
+
+
+def packed_frame(
+    query: str, shown: int, total: int, omitted: int, max_chars: int, compact: bool
+) -> tuple:
+    """The header and footer around packed search results."""
+    if compact:
+        return (
+            f"'{query}': {shown} of {total} matches\n",
+            f"(+{omitted} more)\n" if omitted else "",
+        )
+    return (
+        f"Search Results for '{query}' ({shown} excerpts from "
+        f"{total} matches, budget {max_chars} chars):\n" + "=" * 50 + "\n\n",
+        (
+            f"({omitted} more excerpts did not fit; raise max_chars to see them)\n"
+            if omitted
+            else ""
+        ),
+    )
+
+
+def fit_lines(lines: List[str], max_chars: int) -> str:
+    """
+    Join whole lines into at most max_chars characters, saying how many were
+    left out. When not even the first line fits beside that note, it is
+    returned alone, cut short if need be, followed by "...".
+    """
+    text = "\n".join(lines)
+    if len(text) <= max_chars:
+        return text
+
+    def note(left_out: int) -> str:
+        return f"\n... ({left_out} more lines; raise max_chars to see them)"
+
+    kept = used = 0
+    while kept < len(lines):
+        size = used + bool(kept) + len(lines[kept])
+        if size + len(note(len(lines) - kept - 1)) > max_chars:
+            break
+        used = size
+        kept += 1
+    if kept:
+        return "\n".join(lines[:kept]) + note(len(lines) - kept)
+    if len(lines[0]) + 4 <= max_chars:
+        return lines[0] + "\n..."
+    if max_chars <= 3:
+        return lines[0][:max_chars]
+    return lines[0][: max_chars - 3] + "..."
+
+
+@mcp.tool()
+@offloaded_tool
+@cached_tool
+def batch_search_nim_docs(
+    queries: List[str], library_name: str = "", max_results: int = 5
+) -> str:
+    """
+    Run several case-insensitive substring searches at once, e.g. one per
+    identifier you are about to use, in one call. Each library's candidate
+    pages are read and lowercased once for all queries, but hits are still
+    found and ranked query by query, so this saves the repeated reads and
+    round trips rather than most of the search work.
+
+    Args:
+        queries: The literal strings to search for (up to 50)
+        library_name: (Optional) Limit search to a specific library (e.g., "pixie")
+        max_results: Maximum number of results per query (default: 5, max: 20)
+    """
+    max_results = min(max_results, 20)
+    queries = list(dict.fromkeys(q for q in queries if q.strip()))
+    if not queries:
+        return "No queries given."
+    if len(queries) > BATCH_MAX_QUERIES:
+        return f"Too many queries ({len(queries)}); the limit is {BATCH_MAX_QUERIES}."
+
+    if not LIBRARY_INDEX:
+        return "No documentation libraries available."
+
+    if library_name:
+        lib_key = library_name.lower()
+        if lib_key not in LIBRARY_INDEX:
+            available = ", ".join(LIBRARY_INDEX.names())
+            return f"Library '{library_name}' not found. Available: {available}"
+        libraries_to_search = [LIBRARY_INDEX[lib_key]]
+    else:
+        libraries_to_search = list(LIBRARY_INDEX.values())
+
+    tops = {q: TopResults(max_results) for q in queries}
+
+    for lib_order, lib in enumerate(libraries_to_search):
+        check_cancelled()
+        filepath = full_context_path(lib.path, lib.name)
+        if not os.path.exists(filepath):
+            continue
+
+        try:
+            lines = DOCUMENT_STORE.get(lib)
+            masks = [trigram_mask(lib, [q.lower()]) for q in queries]
+            if any(mask is None for mask in masks):
+                ranges = [(0, len(lines))]
+            else:
+                union = 0
+                for mask in masks:
+                    union |= mask
+                ranges = page_ranges(lib, union)
+            decoded = LowercaseRanges(lines, ranges)
+
+            for query, mask in zip(queries, masks):
+                check_cancelled()
+                if mask == 0:
+                    continue
+                within = None if mask is None else page_ranges(lib, mask)
+                hit_lines = decoded.hit_lines(query.lower(), within)
+                if hit_lines:
+                    push_substring_hits(
+                        tops[query],
+                        lib,
+                        lines,
+                        query,
+                        hit_lines,
+                        decoded.line_counts(query.lower(), hit_lines),
+                        lib_order << 32,
+                    )
+        except Exception:
+            continue
+
+    output = f"Batch Search Results ({len(queries)} queries):\n" + "=" * 50 + "\n\n"
+    for query in queries:
+        results = tops[query].results()
+        output += f"## '{query}' ({len(results)} matches)\n\n"
+        if not results:
+            output += "No results found in the documentation.\n\n"
+        for i, r in enumerate(results, 1):
+            output += format_search_result(i, r)
+
+    return output
+
+
+@mcp.tool()
+@offloaded_tool
+@cached_tool
+def semantic_search_nim_docs(
+    query: str, library_name: str = "", max_results: int = 5
+) -> str:
+    """
+    Find documentation sections and Nim symbols related to a question in plain
+    words, even when the docs use other terms (e.g. "draw a rounded rectangle"
+    finds roundedRect). Works offline from a local TF-IDF index.
+
+    Args:
+        query: A natural-language question or description
+        library_name: (Optional) Limit search to a specific library (e.g., "pixie")
+        max_results: Maximum number of results to return (default: 5, max: 20)
+    """
+    max_results = min(max_results, 20)
+
+    if numpy is None:
+        return "Semantic search needs NumPy, which is not installed."
+
+    if not LIBRARY_INDEX:
+        return "No documentation libraries available."
+
+    if library_name and library_name.lower() not in LIBRARY_INDEX:
+        available = ", ".join(LIBRARY_INDEX.names())
+        return f"Library '{library_name}' not found. Available: {available}"
+
+    data = SEMANTIC_INDEX.get(list(LIBRARY_INDEX.values()))
+    hits = SemanticIndex.query(data, query, max_results, library_name)
+    if not hits:
+        return f"No related documentation found for '{query}'."
+
+    output = (
+        f"Semantic Search Results for '{query}' ({len(hits)} matches):\n"
+        + "=" * 50
+        + "\n\n"
+    )
+    for rank, (u, score) in enumerate(hits, 1):
+        unit = data["units"][u]
+        lib = LIBRARY_INDEX[unit["library"].lower()]
+        lines = DOCUMENT_STORE.get(lib)
+        file_path = lib.files[unit["file"]]["path"] if unit["file"] >= 0 else ""
+        location = f" ({file_path})" if file_path else ""
+        snippet = "\n".join(lines[unit["line"] : unit["line"] + SNIPPET_AFTER])
+
+        output += (
+            f"[{rank}] {unit['library']} (score: {score:.2f}, type: {unit['kind']})\n"
+        )
+        output += f"    {unit['title']} - Line {unit['line']}{location}:\n"
+        output += f"    {snippet[:300]}\n\n"
 
     return output
 
 
 @mcp.tool()
-def get_nim_doc_section(library_name: str, section_title: str = "") -> str:
+@offloaded_tool
+@cached_tool
+def get_nim_doc_section(
+    library_name: str, section_title: str = "", max_chars: int = 0
+) -> str:
     """
     Get the full content of a specific documentation section.
 
@@ -494,121 +3668,385 @@ def get_nim_doc_section(library_name: str, section_title: str = "") -> str:
         library_name: Name of the library (e.g., "necsus", "nim-chronos")
         section_title: (Optional) Title of section to retrieve. If not provided,
                        returns the introduction/first section.
+        max_chars: (Optional) Response budget in characters, about 4 per token.
+                   When set, as much of the section as fits is returned instead
+                   of its first 100 lines.
     """
     lib_key = library_name.lower()
     if lib_key not in LIBRARY_INDEX:
-        available = ", ".join(lib.name for lib in LIBRARY_INDEX.values())
+        available = ", ".join(LIBRARY_INDEX.names())
         return f"Library '{library_name}' not found. Available: {available}"
 
     lib = LIBRARY_INDEX[lib_key]
-    filepath = os.path.join(lib.path, f"{lib.name}_full_context.txt")
+    filepath = full_context_path(lib.path, lib.name)
 
     if not os.path.exists(filepath):
         return f"Documentation file not found for {library_name}"
 
     try:
-        with open(filepath, "r", encoding="utf-8") as f:
-            content = f.read()
-            lines = content.split("\n")
+        lines = DOCUMENT_STORE.get(lib)
 
         if not section_title:
-            first_content = []
-            in_file = False
-            for line in lines:
-                if line.startswith("--- START OF FILE:"):
-                    in_file = True
-                    continue
-                if in_file and line.startswith("--- END OF FILE:"):
-                    break
-                if in_file and line.strip():
-                    first_content.append(line)
-                elif in_file and not line.strip() and first_content:
-                    break
-            return "\n".join(first_content[:50])
+            intro_file = next(
+                (
+                    f
+                    for f in lib.files
+                    if f["path"].lower().endswith(MARKDOWN_EXTENSIONS)
+                ),
+                lib.files[0] if lib.files else None,
+            )
+            if intro_file is not None:
+                start, end = intro_file["start_line"], intro_file["end_line"]
+                file_idx = lib.files.index(intro_file)
+                file_headers = [
+                    line
+                    for line, f in zip(lib.headers.lines, lib.headers.files)
+                    if f == file_idx
+                ]
+            else:
+                start, end = 0, len(lines)
+                file_headers = lib.headers.lines
+            if len(file_headers) > 1:
+                end = min(end, file_headers[1])
+            if max_chars > 0:
+                return fit_lines(lines[start:end], max_chars).strip("\n")
+            return "\n".join(lines[start : min(end, start + 50)]).strip("\n")
+
+        title_lower = section_title.lower()
+        rows = lib.sections.find_titles(title_lower)
+        if rows:
+            section = lib.sections[rows[0]]
+            start = section.start_line
+            if max_chars > 0:
+                return fit_lines(lines[start : section.end_line], max_chars)
+            return "\n".join(lines[start : min(section.end_line, start + 101)])
+
+        lines_with_title = candidate_lines(lib, section_title)
+        if lines_with_title is None:
+            lines_with_title = range(len(lines))
+
+        section_start = next(
+            (
+                i
+                for i in lines_with_title
+                if title_lower in lines[i].lower() and lines[i].strip().startswith("#")
+            ),
+            None,
+        )
 
         section_content: List[str] = []
-        found_section = False
-        for i, line in enumerate(lines):
-            if section_title.lower() in line.lower() and line.strip().startswith("#"):
-                found_section = True
-                section_content.append(line)
-                continue
-            elif found_section:
+        if section_start is not None:
+            scan_end = section_start + 102
+            if max_chars > 0:
+                file = lib.file_at_line(section_start)
+                scan_end = file["end_line"] if file is not None else len(lines)
+            section_content.append(lines[section_start])
+            for line in lines[section_start + 1 : scan_end]:
                 if line.startswith("--- END OF FILE:") or (
-                    line.strip().startswith("#")
-                    and section_title.lower() not in line.lower()
+                    line.strip().startswith("#") and title_lower not in line.lower()
                 ):
                     break
                 section_content.append(line)
-                if len(section_content) > 100:
+                if len(section_content) > 100 and max_chars <= 0:
                     break
 
         if not section_content:
             return f"Section '{section_title}' not found in {library_name}"
 
+        if max_chars > 0:
+            return fit_lines(section_content, max_chars)
         return "\n".join(section_content)
 
     except Exception as e:
+        RESULT_CACHE.skip_current()
         return f"Error reading section: {e}"
 
 
 @mcp.tool()
-def extract_nim_code_examples(library_name: str = "") -> str:
+@offloaded_tool
+def get_nim_source_file(
+    library_name: str,
+    file_path: str,
+    section_title: str = "",
+    start_line: int = 0,
+    max_lines: int = 400,
+) -> str:
     """
-    Extract and format all Nim code examples from documentation.
+    Get the content of one source file from a library's reference dump,
+    or of one header section inside that file.
 
     Args:
-        library_name: (Optional) Name of library to extract from. If not provided,
-                      extracts from all libraries.
+        library_name: Name of the library (e.g., "pixie", "boxy")
+        file_path: Path of the file inside the library (e.g., "src/pixie/images.nim").
+                   A unique path suffix such as "images.nim" also works.
+        section_title: (Optional) Return only the section under this header.
+        start_line: (Optional) First line to return, relative to the file/section start.
+        max_lines: Maximum number of lines to return (default: 400)
+    """
+    lib_key = library_name.lower()
+    if lib_key not in LIBRARY_INDEX:
+        available = ", ".join(LIBRARY_INDEX.names())
+        return f"Library '{library_name}' not found. Available: {available}"
+
+    lib = LIBRARY_INDEX[lib_key]
+    entries = lib.find_files(file_path)
+    if not entries:
+        return f"File '{file_path}' not found in {library_name}"
+    if len(entries) > 1:
+        candidates = "\n".join(f"  {e['path']}" for e in entries)
+        return (
+            f"File '{file_path}' matches {len(entries)} files in {library_name}; "
+            f"give one of these paths:\n{candidates}"
+        )
+    entry = entries[0]
+
+    start, end = entry["start_line"], entry["end_line"]
+    if section_title:
+        file_idx = lib.file_lookup[entry["path"]]
+        title_lower = section_title.lower()
+        row = next(
+            (
+                i
+                for i in lib.sections.find_titles(title_lower)
+                if lib.sections.files[i] == file_idx
+            ),
+            None,
+        )
+        if row is None:
+            return f"Section '{section_title}' not found in {entry['path']}"
+        start, end = lib.sections.lines[row], lib.sections.end_lines[row]
+
+    try:
+        lines = DOCUMENT_STORE.get(lib)
+    except OSError as e:
+        return f"Error reading file: {e}"
+
+    first = min(start + max(start_line, 0), end)
+    last = min(end, first + max(max_lines, 1))
+    output = f"FILE: {entry['path']} (lines {first}-{last} of {start}-{end})\n"
+    output += "=" * 50 + "\n"
+    output += lines.text(first, last)
+    if last < end:
+        output += f"\n... {end - last} more lines (use start_line={last - start})"
+
+    return output
+
+
+@mcp.tool()
+@offloaded_tool
+def lookup_nim_symbol(
+    name: str,
+    library_name: str = "",
+    kind: str = "",
+    prefix: bool = False,
+    exported_only: bool = False,
+    include_source: bool = False,
+    max_results: int = 10,
+) -> str:
+    """
+    Look up Nim declarations (procs, funcs, templates, macros, types, consts...)
+    by name and return their signatures, doc comments and type fields.
+
+    Args:
+        name: Identifier to look up (e.g., "fillPath", "Boxy"). Matching follows
+              Nim rules: case and underscores are ignored after the first
+              character.
+        library_name: (Optional) Limit the lookup to a specific library
+        kind: (Optional) Only return this kind, e.g. "proc", "type", "template"
+        prefix: Match all identifiers starting with name (default: False)
+        exported_only: Only return symbols exported with '*' (default: False)
+        include_source: Include the declaration's source span (default: False)
+        max_results: Maximum number of symbols to return (default: 10, max: 50)
     """
+    max_results = min(max_results, 50)
+
+    if not LIBRARY_INDEX:
+        return "No documentation libraries available."
+
     libraries_to_search: List[LibraryIndex] = []
     if library_name:
         lib_key = library_name.lower()
         if lib_key not in LIBRARY_INDEX:
-            available = ", ".join(lib.name for lib in LIBRARY_INDEX.values())
+            available = ", ".join(LIBRARY_INDEX.names())
             return f"Library '{library_name}' not found. Available: {available}"
         libraries_to_search = [LIBRARY_INDEX[lib_key]]
     else:
         libraries_to_search = list(LIBRARY_INDEX.values())
 
-    all_examples: List[Dict[str, Any]] = []
-
+    matches: List[tuple] = []
     for lib in libraries_to_search:
-        filepath = os.path.join(lib.path, f"{lib.name}_full_context.txt")
-        if not os.path.exists(filepath):
-            continue
+        for symbol_idx in lib.find_symbols(name, prefix):
+            symbol = lib.symbols[symbol_idx]
+            if kind and symbol["kind"] != kind.lower():
+                continue
+            if exported_only and not symbol["exported"]:
+                continue
+            matches.append((lib, symbol))
 
-        try:
-            with open(filepath, "r", encoding="utf-8") as f:
-                content = f.read()
+    if not matches:
+        mode = "starting with" if prefix else "named"
+        return f"No symbols {mode} '{name}' found."
 
-            pattern = r"```nim\s*\n(.*?)\n```"
-            matches = re.findall(pattern, content, re.DOTALL)
+    matches.sort(key=lambda m: (not m[1]["exported"], len(m[1]["name"])))
+    total = len(matches)
+    matches = matches[:max_results]
 
-            for i, code in enumerate(matches, 1):
-                if len(code.strip()) > 10:
-                    all_examples.append(
-                        {"library": lib.name, "example_num": i, "code": code.strip()}
-                    )
+    output = f"Symbols for '{name}' ({len(matches)} of {total}):\n" + "=" * 50 + "\n\n"
+    for i, (lib, symbol) in enumerate(matches, 1):
+        path = lib.files[symbol["file"]]["path"] if symbol["file"] >= 0 else ""
+        marker = "*" if symbol["exported"] else ""
+        output += (
+            f"[{i}] {symbol['kind']} {symbol['name']}{marker} - {lib.name} "
+            f"({path}:{symbol['line']}-{symbol['end_line']})\n"
+        )
+        output += f"    {symbol['signature']}\n"
+        if symbol["doc"]:
+            output += f"    ## {symbol['doc']}\n"
+        if symbol.get("fields"):
+            output += "    Fields:\n"
+            for field_decl in symbol["fields"]:
+                output += f"      {field_decl}\n"
+        if include_source:
+            try:
+                lines = DOCUMENT_STORE.get(lib)
+                end = min(symbol["end_line"], symbol["line"] + 60)
+                output += f"```nim\n{lines.text(symbol['line'], end)}\n```\n"
+            except OSError as e:
+                output += f"    (source unavailable: {e})\n"
+        output += "\n"
 
-        except Exception:
-            continue
+    return output
+
+
+@mcp.tool()
+@offloaded_tool
+@cached_tool
+def extract_nim_code_examples(
+    library_name: str = "",
+    file_path: str = "",
+    min_length: int = 10,
+    offset: int = 0,
+    limit: int = 10,
+) -> str:
+    """
+    Extract Nim code examples from documentation, one page at a time.
+
+    Args:
+        library_name: (Optional) Name of library to extract from. If not provided,
+                      extracts from all libraries.
+        file_path: (Optional) Only return examples from this file, or from every
+                   file whose path ends with it (e.g., "README.md")
+        min_length: Only return examples longer than this many characters (default: 10)
+        offset: Index of the first example to return, for paging (default: 0)
+        limit: Maximum number of examples to return (default: 10, max: 50)
+    """
+    limit = max(1, min(limit, 50))
+    offset = max(0, offset)
+
+    libraries_to_search: List[LibraryIndex] = []
+    if library_name:
+        lib_key = library_name.lower()
+        if lib_key not in LIBRARY_INDEX:
+            available = ", ".join(LIBRARY_INDEX.names())
+            return f"Library '{library_name}' not found. Available: {available}"
+        libraries_to_search = [LIBRARY_INDEX[lib_key]]
+    else:
+        libraries_to_search = list(LIBRARY_INDEX.values())
+
+    matching: List[tuple] = []
+    for lib in libraries_to_search:
+        check_cancelled()
+        file_indices: Optional[set] = None
+        if file_path:
+            file_indices = {
+                lib.file_lookup[entry["path"]] for entry in lib.find_files(file_path)
+            }
+            if not file_indices:
+                continue
+
+        nim_blocks = [b for b in lib.code_blocks if b["lang"] == "nim"]
+        for i, block in enumerate(nim_blocks, 1):
+            if block["length"] <= min_length:
+                continue
+            if file_indices is not None and block["file"] not in file_indices:
+                continue
+            matching.append((lib, i, block))
 
-    if not all_examples:
+    if not matching:
         return "No code examples found."
+    if offset >= len(matching):
+        return f"No code examples at offset {offset} ({len(matching)} total)."
 
-    output = f"Nim Code Examples ({len(all_examples)} total):\n" + "=" * 50 + "\n\n"
+    page = matching[offset : offset + limit]
+    output = (
+        f"Nim Code Examples ({offset + 1}-{offset + len(page)} of {len(matching)}):\n"
+        + "=" * 50
+        + "\n\n"
+    )
 
     current_lib = ""
-    for ex in all_examples:
-        if ex["library"] != current_lib:
-            current_lib = ex["library"]
+    for lib, example_num, block in page:
+        if lib.name != current_lib:
+            current_lib = lib.name
             output += f"\n--- {current_lib} ---\n\n"
-        output += f"Example {ex['example_num']}:\n"
-        output += f"```nim\n{ex['code']}\n```\n\n"
+        try:
+            code = DOCUMENT_STORE.get(lib).text(block["start_line"] + 1, block["end_line"])
+        except OSError as e:
+            RESULT_CACHE.skip_current()
+            output += f"Example {example_num}: (unavailable: {e})\n\n"
+            continue
+        path = lib.files[block["file"]]["path"] if block["file"] >= 0 else ""
+        location = f" ({path}, line {block['start_line']})" if path else ""
+        output += f"Example {example_num}{location}:\n"
+        output += f"```nim\n{code.strip()}\n```\n\n"
+
+    next_offset = offset + len(page)
+    if next_offset < len(matching):
+        output += f"More examples available: call again with offset={next_offset}\n"
 
     return output
 
 
+@mcp.tool()
+@offloaded_tool
+def get_knowledge_server_stats() -> str:
+    """
+    Report the knowledge server's own metrics as JSON: per-tool call counts,
+    latency percentiles and histograms, cache hits and bytes scanned, index
+    load and build timings, and memory used per library and by the process.
+    """
+    libraries = {}
+    for lib in LIBRARY_INDEX.values():
+        libraries[lib.name] = {
+            "index_bytes": METRICS.library_memory(lib),
+            "document_bytes": DOCUMENT_STORE.document_bytes(lib.name),
+            "decompressed_bytes": DOCUMENT_STORE.decompressed_bytes(lib.name),
+            "lines": lib.line_count,
+            "files": len(lib.files),
+            "symbols": len(lib.symbols),
+        }
+
+    process: Dict[str, Any] = {}
+    try:
+        with open("/proc/self/statm") as f:
+            process["rss_bytes"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        process["peak_rss_bytes"] = peak if sys.platform == "darwin" else peak * 1024
+
+    stats = METRICS.snapshot()
+    stats["result_cache"] = RESULT_CACHE.stats()
+    stats["libraries"] = libraries
+    stats["process"] = process
+    return json.dumps(stats, indent=2)
+
+
 if __name__ == "__main__":
-    mcp.run()
+    LIBRARY_INDEX.start()
+    LIBRARY_WATCHER.start()
+    try:
+        mcp.run()
+    finally:
+        LIBRARY_WATCHER.stop()
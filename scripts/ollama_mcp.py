@@ -1,12 +1,611 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import struct
+import subprocess
+import zlib
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
 from mcp.server.fastmcp import FastMCP
 import ollama
 
+try:
+    import numpy
+except ImportError:  # Needed to diff images, and to crop or resize without PIL.
+    numpy = None
+
+try:
+    from PIL import Image
+except ImportError:  # PNGs are then decoded by decode_png below.
+    Image = None
+
+MODEL_NAME = os.environ.get("OLLAMA_VISION_MODEL", "openbmb/minicpm-v4.5")
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://localhost:11434")
+CACHE_DIR = os.environ.get("OLLAMA_CACHE_DIR", "./.ollama_cache")
+MAX_CONCURRENT = int(os.environ.get("OLLAMA_MAX_CONCURRENT", "1"))
+MAX_QUEUED = int(os.environ.get("OLLAMA_MAX_QUEUED", "8"))
+REQUEST_TIMEOUT = float(os.environ.get("OLLAMA_REQUEST_TIMEOUT", "300"))
+VISION_MAX_SIDE = int(os.environ.get("OLLAMA_MAX_IMAGE_SIDE", "1344"))
+VISION_JPEG_QUALITY = 90
+
+ROOT_DIR = Path(__file__).parent.parent
+GOLDEN_DIR = ROOT_DIR / "tests" / "golden"
+GOLDEN_TOLERANCE = 0.1
+GOLDEN_MATCH_RATIO = 0.0005
+GOLDEN_MISMATCH_RATIO = 0.02
+GOLDEN_DELTA_CEILING = 0.3
+GOLDEN_DENSE_PIXELS = 16
+GOLDEN_DENSE_SHARE = 0.5
+GOLDEN_TILE = 32
+GOLDEN_CROP_MARGIN = 16
+GOLDEN_QUESTION = (
+    "The first image is the approved golden rendering of a UI test and the "
+    "second is a new rendering of the same region. Are the differences "
+    "meaningful (layout, colour, missing or extra elements) or only "
+    "anti-aliasing noise? Start your answer with MEANINGFUL or NOISE, then "
+    "explain briefly."
+)
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+
 # Initialize the MCP Server
 mcp = FastMCP("Ollama Bridge")
 
 
+class AnswerCache:
+    """
+    Model answers on disk, one JSON file per (image content, question, model).
+    Keys hash the image bytes rather than the path, so a re-rendered but
+    unchanged screenshot still hits and a changed one never does.
+    """
+
+    def __init__(self, cache_dir: str = ""):
+        self.cache_dir = cache_dir
+
+    @staticmethod
+    def make_key(image_hash: str, question: str, model: str) -> str:
+        raw = json.dumps([model, question.strip(), image_hash])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.cache_dir:
+            return None
+        try:
+            with open(os.path.join(self.cache_dir, f"{key}.json"), "r") as f:
+                return json.load(f)["answer"]
+        except Exception:
+            return None
+
+    def put(self, key: str, entry: Dict[str, str]) -> None:
+        if not self.cache_dir:
+            return
+        path = os.path.join(self.cache_dir, f"{key}.json")
+        tmp_file = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with open(tmp_file, "w") as f:
+                json.dump(entry, f)
+            os.replace(tmp_file, path)
+        except Exception:
+            try:
+                os.remove(tmp_file)
+            except OSError:
+                pass
+
+
+class VisionQueue:
+    """
+    Sends chat requests through one reused Ollama client, at most
+    MAX_CONCURRENT at a time with up to MAX_QUEUED more waiting; beyond that
+    callers are turned away instead of piling up behind a slow model.
+
+    Identical requests already in flight share one answer. Each request runs
+    as its own task, owned by no single caller: a cancelled caller only stops
+    waiting, and the request is cancelled once nobody is waiting for it.
+    """
+
+    def __init__(self, host: str, max_concurrent: int, max_queued: int):
+        self.host = host
+        self.max_pending = max(max_concurrent, 1) + max(max_queued, 0)
+        self._semaphore = asyncio.Semaphore(max(max_concurrent, 1))
+        self._client: Optional[ollama.AsyncClient] = None
+        self._in_flight: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[asyncio.Task, int] = {}
+
+    @property
+    def client(self) -> ollama.AsyncClient:
+        if self._client is None:
+            self._client = ollama.AsyncClient(host=self.host, timeout=REQUEST_TIMEOUT)
+        return self._client
+
+    @property
+    def pending(self) -> int:
+        """Requests running or queued."""
+        return len(self._in_flight)
+
+    async def ask(
+        self, key: str, question: str, images: List[bytes], model: str
+    ) -> str:
+        request = self._in_flight.get(key)
+        if request is None or request.cancelled():
+            if self.pending >= self.max_pending:
+                raise RuntimeError(
+                    f"{self.pending} vision requests are running or queued; "
+                    "try again later"
+                )
+            request = asyncio.ensure_future(self._request(question, images, model))
+            self._in_flight[key] = request
+            request.add_done_callback(lambda done: self._finished(key, done))
+
+        self._waiters[request] = self._waiters.get(request, 0) + 1
+        try:
+            return await asyncio.shield(request)
+        finally:
+            self._waiters[request] -= 1
+            if not self._waiters[request]:
+                del self._waiters[request]
+                request.cancel()  # Nobody is left waiting; no-op once done.
+
+    async def _request(self, question: str, images: List[bytes], model: str) -> str:
+        async with self._semaphore:
+            message = {"role": "user", "content": question, "images": images}
+            response = await self.client.chat(model=model, messages=[message])
+        return response["message"]["content"]
+
+    def _finished(self, key: str, request: asyncio.Task) -> None:
+        if self._in_flight.get(key) is request:
+            del self._in_flight[key]
+        if not request.cancelled():
+            request.exception()  # Retrieved, even if every waiter has left.
+
+
+ANSWER_CACHE = AnswerCache(CACHE_DIR)
+VISION_QUEUE = VisionQueue(OLLAMA_HOST, MAX_CONCURRENT, MAX_QUEUED)
+
+
+def read_image(image_path: str) -> tuple:
+    """Return an image's bytes and their SHA-256."""
+    with open(image_path, "rb") as f:
+        data = f.read()
+    return data, hashlib.sha256(data).hexdigest()
+
+
+async def ask_vision_model(question: str, images: List[bytes]) -> str:
+    """Ask about images through ANSWER_CACHE and VISION_QUEUE."""
+    image_hash = "+".join(hashlib.sha256(image).hexdigest() for image in images)
+    key = AnswerCache.make_key(image_hash, question, MODEL_NAME)
+    answer = await asyncio.to_thread(ANSWER_CACHE.get, key)
+    if answer is not None:
+        return answer
+
+    answer = await VISION_QUEUE.ask(key, question, images, MODEL_NAME)
+    entry = {
+        "model": MODEL_NAME,
+        "question": question,
+        "image_sha256": image_hash,
+        "answer": answer,
+    }
+    await asyncio.to_thread(ANSWER_CACHE.put, key, entry)
+    return answer
+
+
+def image_size(data: bytes) -> Optional[tuple]:
+    """(width, height) from a PNG header, or via PIL for other formats."""
+    if data.startswith(PNG_SIGNATURE) and data[12:16] == b"IHDR":
+        return struct.unpack(">II", data[16:24])
+    if Image is not None:
+        with Image.open(io.BytesIO(data)) as image:
+            return image.size
+    return None
+
+
+def crop_box(region: List[int], size: tuple) -> tuple:
+    """Clip an [x, y, width, height] region to the image; (x0, y0, x1, y1)."""
+    if len(region) != 4:
+        raise ValueError("region must be [x, y, width, height]")
+    x, y, w, h = (int(v) for v in region)
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, size[0]), min(y + h, size[1])
+    if x1 <= x0 or y1 <= y0:
+        raise ValueError(f"region {region} is outside the {size[0]}x{size[1]} image")
+    return x0, y0, x1, y1
+
+
+def prepare_image(
+    data: bytes, region: Optional[List[int]], max_side: int
+) -> tuple:
+    """
+    Crop an image to region and shrink it so neither side exceeds max_side
+    (0 for no limit). The image is only decoded and re-encoded when one of
+    those applies: as JPEG if PIL is installed and the result is opaque,
+    otherwise as PNG.
+
+    Returns the image and a note for the caller, empty unless an image that
+    should have been shrunk is sent at full size: without PIL only PNGs can
+    be decoded (by decode_png, which needs NumPy and undoes Average and Paeth
+    filters in Python, so a large screenshot takes a few seconds).
+    """
+    size = image_size(data)
+    if size is None and region:
+        raise RuntimeError("cropping an image other than a PNG needs PIL")
+    if size is None:
+        note = ""
+        if max_side > 0:
+            note = "the image was sent at full size: resizing it needs PIL"
+        return data, note
+    shrink = max_side > 0 and max(size) > max_side
+    if not region and not shrink:
+        return data, ""
+    if region:
+        crop_box(region, size)  # Reject a bad region before decoding.
+
+    if Image is not None:
+        with Image.open(io.BytesIO(data)) as image:
+            image = image.convert("RGBA")
+        if region:
+            image = image.crop(crop_box(region, image.size))
+        if max_side > 0:
+            image.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        if image.getchannel("A").getextrema()[0] == 255:
+            image.convert("RGB").save(out, "JPEG", quality=VISION_JPEG_QUALITY)
+        else:
+            image.save(out, "PNG", optimize=True)
+        return out.getvalue(), ""
+
+    if numpy is None:
+        if region:
+            raise RuntimeError("cropping an image needs PIL or NumPy")
+        return data, "the image was sent at full size: resizing it needs PIL or NumPy"
+    x0, y0, x1, y1 = crop_box(region, size) if region else (0, 0, *size)
+    pixels = decode_png(data, rows=y1)[y0:y1, x0:x1]
+    factor = -(-max(pixels.shape[:2]) // max_side) if max_side > 0 else 1
+    if factor > 1:
+        pixels = downscale(pixels, factor)
+    return encode_png(numpy.ascontiguousarray(pixels)), ""
+
+
+def downscale(pixels: "numpy.ndarray", factor: int) -> "numpy.ndarray":
+    """Shrink by an integer factor, averaging each factor x factor block."""
+    height, width, channels = pixels.shape
+    pad_y, pad_x = -height % factor, -width % factor
+    if pad_y or pad_x:
+        pixels = numpy.pad(pixels, ((0, pad_y), (0, pad_x), (0, 0)), mode="edge")
+    blocks = pixels.reshape(
+        pixels.shape[0] // factor, factor, pixels.shape[1] // factor, factor, channels
+    )
+    return blocks.mean(axis=(1, 3)).round().astype(numpy.uint8)
+
+
+def combine_questions(questions: List[str]) -> str:
+    """One prompt for several questions, so the image is only sent once."""
+    if len(questions) == 1:
+        return questions[0]
+    numbered = "\n".join(f"{n}. {q}" for n, q in enumerate(questions, 1))
+    return (
+        "Answer each of these questions about the image, numbering your "
+        f"answers to match:\n{numbered}"
+    )
+
+
+def decode_png(data: bytes, rows: int = 0) -> "numpy.ndarray":
+    """
+    Decode an 8-bit, non-interlaced PNG (what pixie writes) to an RGBA array,
+    for when PIL is not installed. With rows, only the first rows are decoded.
+    """
+    if not data.startswith(PNG_SIGNATURE):
+        raise ValueError("not a PNG file")
+    header = None
+    palette = None
+    transparency = b""
+    idat: List[bytes] = []
+    pos = len(PNG_SIGNATURE)
+    while pos < len(data):
+        length, kind = struct.unpack(">I4s", data[pos : pos + 8])
+        chunk = data[pos + 8 : pos + 8 + length]
+        pos += length + 12
+        if kind == b"IHDR":
+            header = struct.unpack(">IIBBBBB", chunk)
+        elif kind == b"PLTE":
+            palette = numpy.frombuffer(chunk, numpy.uint8).reshape(-1, 3)
+        elif kind == b"tRNS":
+            transparency = chunk
+        elif kind == b"IDAT":
+            idat.append(chunk)
+        elif kind == b"IEND":
+            break
+    if header is None:
+        raise ValueError("PNG has no IHDR chunk")
+    width, height, depth, color, _, _, interlace = header
+    if depth != 8 or interlace or color not in PNG_CHANNELS:
+        raise ValueError("only 8-bit non-interlaced PNGs can be read without PIL")
+
+    if rows:
+        height = min(height, rows)
+    channels = PNG_CHANNELS[color]
+    stride = width * channels
+    raw = numpy.frombuffer(zlib.decompress(b"".join(idat)), numpy.uint8)
+    raw = raw[: height * (stride + 1)].reshape(height, stride + 1)
+    pixels = numpy.empty((height, stride), numpy.uint8)
+    prior = numpy.zeros(stride, numpy.uint8)
+    for y in range(height):
+        kind, line = raw[y, 0], raw[y, 1:]
+        if kind == 0:
+            row = line
+        elif kind == 1:
+            row = numpy.cumsum(
+                line.reshape(width, channels), axis=0, dtype=numpy.uint8
+            ).reshape(stride)
+        elif kind == 2:
+            row = line + prior
+        else:
+            row = numpy.frombuffer(
+                unfilter_row(kind, line.tobytes(), prior.tobytes(), channels),
+                numpy.uint8,
+            )
+        pixels[y] = row
+        prior = pixels[y]
+
+    pixels = pixels.reshape(height, width, channels)
+    if color == 3:
+        if palette is None:
+            raise ValueError("paletted PNG has no PLTE chunk")
+        alpha = numpy.full(len(palette), 255, numpy.uint8)
+        alpha[: len(transparency)] = numpy.frombuffer(transparency, numpy.uint8)[
+            : len(palette)
+        ]
+        lookup = numpy.concatenate([palette, alpha[:, None]], axis=1)
+        return lookup[pixels[..., 0]]
+    if color in (0, 4):
+        gray = pixels[..., :1]
+        pixels = numpy.concatenate([gray, gray, gray, pixels[..., 1:]], axis=2)
+    if pixels.shape[2] == 3:
+        opaque = numpy.full((height, width, 1), 255, numpy.uint8)
+        pixels = numpy.concatenate([pixels, opaque], axis=2)
+    return pixels
+
+
+def unfilter_row(kind: int, line: bytes, prior: bytes, bpp: int) -> bytearray:
+    """Undo the Average (3) or Paeth (4) filter, which run left to right."""
+    row = bytearray(line)
+    for i in range(len(row)):
+        left = row[i - bpp] if i >= bpp else 0
+        up = prior[i]
+        if kind == 3:
+            row[i] = (row[i] + ((left + up) >> 1)) & 0xFF
+        elif kind == 4:
+            up_left = prior[i - bpp] if i >= bpp else 0
+            estimate = left + up - up_left
+            pa = abs(estimate - left)
+            pb = abs(estimate - up)
+            pc = abs(estimate - up_left)
+            if pa <= pb and pa <= pc:
+                row[i] = (row[i] + left) & 0xFF
+            elif pb <= pc:
+                row[i] = (row[i] + up) & 0xFF
+            else:
+                row[i] = (row[i] + up_left) & 0xFF
+        else:
+            raise ValueError(f"invalid PNG filter type {kind}")
+    return row
+
+
+def encode_png(pixels: "numpy.ndarray") -> bytes:
+    """Encode an RGBA (or RGB) uint8 array as a PNG."""
+    if Image is not None:
+        out = io.BytesIO()
+        Image.fromarray(pixels).save(out, format="PNG")
+        return out.getvalue()
+
+    height, width, channels = pixels.shape
+    rows = numpy.zeros((height, width * channels + 1), numpy.uint8)
+    rows[:, 1:] = pixels.reshape(height, -1)
+
+    def chunk(kind: bytes, body: bytes) -> bytes:
+        crc = zlib.crc32(kind + body) & 0xFFFFFFFF
+        return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", crc)
+
+    color = 6 if channels == 4 else 2
+    return (
+        PNG_SIGNATURE
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, color, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(rows.tobytes(), 6))
+        + chunk(b"IEND", b"")
+    )
+
+
+def load_rgba(data: bytes) -> "numpy.ndarray":
+    if Image is not None:
+        with Image.open(io.BytesIO(data)) as image:
+            return numpy.asarray(image.convert("RGBA"))
+    return decode_png(data)
+
+
+def perceptual_delta(a: "numpy.ndarray", b: "numpy.ndarray") -> "numpy.ndarray":
+    """
+    Per-pixel colour distance in [0, 1], from the YIQ metric pixelmatch uses.
+    Pixels are blended over both white and black and the larger distance is
+    kept, so a change to a transparent region shows up against either. Only
+    pixels whose bytes differ are measured.
+    """
+    delta = numpy.zeros(a.shape[:2], numpy.float32)
+    differs = (a != b).any(axis=2)
+    if not differs.any():
+        return delta
+
+    a = a[differs].astype(numpy.float32) / 255
+    b = b[differs].astype(numpy.float32) / 255
+    worst = numpy.zeros(len(a), numpy.float32)
+    for background in (1.0, 0.0):
+        rgb_a = background + (a[:, :3] - background) * a[:, 3:]
+        rgb_b = background + (b[:, :3] - background) * b[:, 3:]
+        r, g, bl = (rgb_a - rgb_b).T
+        y = 0.29889531 * r + 0.58662247 * g + 0.11448223 * bl
+        i = 0.59597799 * r - 0.27417610 * g - 0.32180189 * bl
+        q = 0.21147017 * r - 0.52261711 * g + 0.31114694 * bl
+        numpy.maximum(
+            worst, 0.5053 * y * y + 0.299 * i * i + 0.1957 * q * q, out=worst
+        )
+    delta[differs] = numpy.sqrt(worst / (35215 / 255**2))
+    return delta
+
+
+def changed_regions(changed: "numpy.ndarray", tile: int) -> List[List[int]]:
+    """Bounding boxes [x0, y0, x1, y1) of connected groups of changed tiles."""
+    height, width = changed.shape
+    rows, cols = -(-height // tile), -(-width // tile)
+    padded = numpy.zeros((rows * tile, cols * tile), bool)
+    padded[:height, :width] = changed
+    tiles = padded.reshape(rows, tile, cols, tile).any(axis=(1, 3))
+
+    regions = []
+    seen = numpy.zeros_like(tiles)
+    for ty, tx in zip(*numpy.nonzero(tiles)):
+        if seen[ty, tx]:
+            continue
+        seen[ty, tx] = True
+        stack = [(ty, tx)]
+        group = []
+        while stack:
+            y, x = stack.pop()
+            group.append((y, x))
+            for ny, nx in ((y - 1, x), (y + 1, x), (y, x - 1), (y, x + 1)):
+                if 0 <= ny < rows and 0 <= nx < cols and tiles[ny, nx]:
+                    if not seen[ny, nx]:
+                        seen[ny, nx] = True
+                        stack.append((ny, nx))
+        ys = [y for y, _ in group]
+        xs = [x for _, x in group]
+        y0, y1 = min(ys) * tile, min((max(ys) + 1) * tile, height)
+        x0, x1 = min(xs) * tile, min((max(xs) + 1) * tile, width)
+        sub = changed[y0:y1, x0:x1]
+        sy, sx = numpy.nonzero(sub.any(axis=1))[0], numpy.nonzero(sub.any(axis=0))[0]
+        regions.append(
+            [
+                int(x0 + sx[0]),
+                int(y0 + sy[0]),
+                int(x0 + sx[-1] + 1),
+                int(y0 + sy[-1] + 1),
+            ]
+        )
+    return regions
+
+
+def diff_heatmap(actual: "numpy.ndarray", delta: "numpy.ndarray") -> "numpy.ndarray":
+    """The new rendering greyed out, with changed pixels in red by distance."""
+    gray = actual[..., :3].mean(axis=2) * (actual[..., 3] / 255) * 0.3 + 40
+    heat = numpy.repeat(gray[..., None], 3, axis=2)
+    heat[..., 0] = numpy.maximum(heat[..., 0], delta * 255)
+    heat[..., 1:] *= (1 - delta)[..., None]
+    return heat.clip(0, 255).astype(numpy.uint8)
+
+
+def read_golden(golden: Path, image_path: str) -> bytes:
+    """
+    Read the golden image. Golden tests render straight into tests/golden, so
+    when the image under test is the golden file itself, compare against the
+    committed version instead.
+    """
+    if os.path.exists(image_path) and golden.exists():
+        if os.path.samefile(image_path, golden):
+            relative = golden.resolve().relative_to(ROOT_DIR.resolve()).as_posix()
+            return subprocess.run(
+                ["git", "show", f"HEAD:{relative}"],
+                cwd=ROOT_DIR,
+                check=True,
+                capture_output=True,
+            ).stdout
+    return golden.read_bytes()
+
+
+def compare_images(
+    golden: "numpy.ndarray", actual: "numpy.ndarray", tolerance: float
+) -> tuple:
+    """
+    Diff two RGBA arrays; returns the report dict and the distance map.
+
+    A tiny share of changed pixels is only a match while every change is
+    faint (at most GOLDEN_DELTA_CEILING) and scattered: a region of at least
+    GOLDEN_DENSE_PIXELS changed pixels filling GOLDEN_DENSE_SHARE of its box
+    counts as dense. A strong change or a dense region alone is ambiguous;
+    both together, or a large share of changed pixels, is a mismatch.
+    """
+    if golden.shape != actual.shape:
+        report = {
+            "verdict": "mismatch",
+            "mismatch_score": 1.0,
+            "reason": f"size differs: golden {golden.shape[1]}x{golden.shape[0]}, "
+            f"image {actual.shape[1]}x{actual.shape[0]}",
+        }
+        return report, None
+
+    delta = perceptual_delta(golden, actual)
+    changed = delta > tolerance
+    changed_pixels = int(changed.sum())
+    ratio = changed_pixels / changed.size
+    max_delta = float(delta.max())
+    report: Dict[str, Any] = {
+        "mismatch_score": round(ratio, 6),
+        "changed_pixels": changed_pixels,
+        "max_delta": round(max_delta, 4),
+        "mean_delta": round(float(delta.mean()), 6),
+        "bbox": None,
+        "regions": [],
+        "dense_region": None,
+    }
+    if changed_pixels:
+        ys = numpy.nonzero(changed.any(axis=1))[0]
+        xs = numpy.nonzero(changed.any(axis=0))[0]
+        report["bbox"] = [int(xs[0]), int(ys[0]), int(xs[-1] + 1), int(ys[-1] + 1)]
+        report["regions"] = changed_regions(changed, GOLDEN_TILE)
+        report["dense_region"] = densest_region(changed, report["regions"])
+
+    strong = max_delta > GOLDEN_DELTA_CEILING
+    dense = report["dense_region"] is not None
+    if ratio >= GOLDEN_MISMATCH_RATIO or (strong and dense):
+        report["verdict"] = "mismatch"
+    elif ratio <= GOLDEN_MATCH_RATIO and not strong and not dense:
+        report["verdict"] = "match"
+    else:
+        report["verdict"] = "ambiguous"
+    return report, delta
+
+
+def densest_region(
+    changed: "numpy.ndarray", regions: List[List[int]]
+) -> Optional[List[int]]:
+    """The dense region with the most changed pixels, or None."""
+    best, best_pixels = None, 0
+    for x0, y0, x1, y1 in regions:
+        pixels = int(changed[y0:y1, x0:x1].sum())
+        area = (x1 - x0) * (y1 - y0)
+        if pixels >= GOLDEN_DENSE_PIXELS and pixels >= GOLDEN_DENSE_SHARE * area:
+            if pixels > best_pixels:
+                best, best_pixels = [x0, y0, x1, y1], pixels
+    return best
+
+
+def crop_for_review(pixels: "numpy.ndarray", bbox: List[int]) -> bytes:
+    height, width = pixels.shape[:2]
+    x0 = max(bbox[0] - GOLDEN_CROP_MARGIN, 0)
+    y0 = max(bbox[1] - GOLDEN_CROP_MARGIN, 0)
+    x1 = min(bbox[2] + GOLDEN_CROP_MARGIN, width)
+    y1 = min(bbox[3] + GOLDEN_CROP_MARGIN, height)
+    return encode_png(numpy.ascontiguousarray(pixels[y0:y1, x0:x1]))
+
+
 @mcp.tool()
-def analyze_ui_screenshot(question: str, image_path: str) -> str:
+async def analyze_ui_screenshot(
+    question: str,
+    image_path: str,
+    more_questions: Optional[List[str]] = None,
+    region: Optional[List[int]] = None,
+    max_side: int = VISION_MAX_SIDE,
+) -> str:
     """
     Uses Ollama's Vision model (MiniCPM-V4.5) to analyze a UI screenshot.
     Use this to check layout, alignment, or describe what is visible.
@@ -14,16 +613,82 @@ def analyze_ui_screenshot(question: str, image_path: str) -> str:
     Args:
         question: What you want to know about the image (e.g., "Is the button centered?")
         image_path: Absolute path to the screenshot file.
+        more_questions: (Optional) Further questions about the same image, all
+                        answered in one request (answers are numbered).
+        region: (Optional) [x, y, width, height] in pixels to crop to before
+                asking, e.g. the widget the question is about.
+        max_side: Shrink the image so neither side exceeds this many pixels
+                  (default: 1344; 0 sends it at full resolution). Without
+                  PIL, only PNGs can be shrunk; the answer says when an image
+                  was sent at full size.
     """
     try:
-        response = ollama.chat(
-            model="openbmb/minicpm-v4.5",  # Ensure you pulled this model
-            messages=[{"role": "user", "content": question, "images": [image_path]}],
-        )
-        return response["message"]["content"]
+        image, _ = await asyncio.to_thread(read_image, image_path)
+        image, note = await asyncio.to_thread(prepare_image, image, region, max_side)
+        questions = [question] + [q for q in more_questions or [] if q.strip()]
+        answer = await ask_vision_model(combine_questions(questions), [image])
+        return f"{answer}\n\n(Note: {note}.)" if note else answer
     except Exception as e:
         return f"Ollama Vision Error: {str(e)}"
 
 
+@mcp.tool()
+async def compare_golden_image(
+    image_path: str,
+    golden_path: str = "",
+    tolerance: float = GOLDEN_TOLERANCE,
+    heatmap_path: str = "",
+    escalate: bool = True,
+) -> str:
+    """
+    Diff a rendered image against its golden PNG pixel by pixel, in
+    milliseconds. Only when the result is ambiguous (a small but not
+    negligible share of pixels changed, or a strong or dense change too small
+    to call) is the vision model asked to judge the changed region. Returns a
+    JSON report.
+
+    Args:
+        image_path: Path to the new rendering.
+        golden_path: (Optional) Golden image to compare against. Defaults to
+                     tests/golden/<same file name>; if that is image_path itself,
+                     the committed (HEAD) version is used.
+        tolerance: Per-pixel colour distance (0-1) below which a pixel counts
+                   as unchanged (default: 0.1)
+        heatmap_path: (Optional) Where to write a PNG highlighting changed pixels.
+        escalate: Ask the vision model about ambiguous results (default: true)
+    """
+    if numpy is None:
+        return "Golden image comparison needs NumPy, which is not installed."
+
+    golden_file = Path(golden_path or GOLDEN_DIR / Path(image_path).name)
+
+    def compare() -> tuple:
+        golden = load_rgba(read_golden(golden_file, image_path))
+        actual = load_rgba(Path(image_path).read_bytes())
+        report, delta = compare_images(golden, actual, tolerance)
+        if heatmap_path and delta is not None:
+            Path(heatmap_path).write_bytes(encode_png(diff_heatmap(actual, delta)))
+            report["heatmap"] = heatmap_path
+        return report, golden, actual
+
+    try:
+        report, golden, actual = await asyncio.to_thread(compare)
+        report = {"image": image_path, "golden": str(golden_file), **report}
+        if report["verdict"] == "ambiguous" and escalate:
+            images = [crop_for_review(golden, report["bbox"])]
+            images.append(crop_for_review(actual, report["bbox"]))
+            try:
+                answer = await ask_vision_model(GOLDEN_QUESTION, images)
+                report["vision_answer"] = answer
+                first_word = (answer.split() or [""])[0].strip(".:,*").upper()
+                verdicts = {"MEANINGFUL": "mismatch", "NOISE": "match"}
+                report["verdict"] = verdicts.get(first_word, report["verdict"])
+            except Exception as e:
+                report["vision_error"] = str(e)
+        return json.dumps(report, indent=2)
+    except Exception as e:
+        return f"Golden Comparison Error: {str(e)}"
+
+
 if __name__ == "__main__":
     mcp.run()
@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+"""Child process for knowledge_server.py regex searches.
+
+Used when the optional regex module, which can time out a single match, is
+not installed: a runaway `re` match is stopped by killing this process.
+
+Reads (pattern, flags, chunks) requests on stdin, where each chunk is a
+(first line number, newline-joined lines) pair, and answers every chunk on
+stdout with (matched line numbers, match count). Exits when stdin closes.
+"""
+
+import re
+from multiprocessing.connection import Connection
+
+
+def main():
+    requests = Connection(0, writable=False)
+    replies = Connection(1, readable=False)
+    while True:
+        try:
+            query, flags, chunks = requests.recv()
+        except EOFError:
+            return
+        pattern = re.compile(query, flags)
+        for chunk_start, text in chunks:
+            matched_lines = []
+            match_count = 0
+            for offset, line in enumerate(text.split("\n")):
+                found = sum(1 for _ in pattern.finditer(line))
+                if found:
+                    match_count += found
+                    matched_lines.append(chunk_start + offset)
+            replies.send((matched_lines, match_count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,426 @@
+"""Tests for scripts/knowledge_server.py, run against copies of refs/.
+
+Run with: python3 -m pytest tests/test_knowledge_server.py
+"""
+
+import importlib
+import inspect
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).parent.parent
+REFS_DIR = ROOT_DIR / "refs"
+sys.path.insert(0, str(ROOT_DIR / "scripts"))
+
+
+def load_server(work_dir: Path):
+    """
+    A fresh import of knowledge_server serving work_dir/refs, with the result
+    cache off. The module keeps its real name, so process pools can pickle it.
+    """
+    os.environ["NIM_DOCS_RESULT_CACHE_DIR"] = ""
+    os.chdir(work_dir)
+    import knowledge_server
+
+    return importlib.reload(knowledge_server)
+
+
+def wait_loaded(server):
+    server.LIBRARY_INDEX.start()
+    server.LIBRARY_INDEX._thread.join()
+    return server
+
+
+def tool(server, name):
+    """A tool's own function, without the MCP, executor and cache layers."""
+    return inspect.unwrap(getattr(server, name))
+
+
+@pytest.fixture(scope="module")
+def shared_copy(tmp_path_factory):
+    work_dir = tmp_path_factory.mktemp("refs-copy")
+    shutil.copytree(REFS_DIR, work_dir / "refs")
+    return {"dir": work_dir, "registry": None}
+
+
+@pytest.fixture
+def server(shared_copy):
+    """
+    A loaded server over an unmodified copy of refs/, shared read-only. Tests
+    that load their own server replace the module's state, so after them it
+    is reloaded, from the copy's index cache.
+    """
+    cwd = os.getcwd()
+    module = sys.modules.get("knowledge_server")
+    try:
+        if module is None or module.LIBRARY_INDEX is not shared_copy["registry"]:
+            module = wait_loaded(load_server(shared_copy["dir"]))
+            shared_copy["registry"] = module.LIBRARY_INDEX
+        os.chdir(shared_copy["dir"])
+        yield module
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture
+def work_dir(tmp_path):
+    """A private copy of refs/ for tests that change files or caches."""
+    shutil.copytree(REFS_DIR, tmp_path / "refs")
+    cwd = os.getcwd()
+    try:
+        yield tmp_path
+    finally:
+        os.chdir(cwd)
+
+
+# Symbol lookup
+
+
+def test_identifiers_ignore_case_and_underscores_after_first_char(server):
+    normalize = server.normalize_nim_identifier
+    assert normalize("new_image") == normalize("newImage")
+    assert normalize("fill_Path") == normalize("fillpath")
+    assert normalize("vec2") != normalize("Vec2")
+    assert normalize("GVec2") != normalize("gvec2")
+
+
+def test_symbol_lookup_keeps_first_char_case(server):
+    lookup = tool(server, "lookup_nim_symbol")
+    procs = lookup("vec2", library_name="vmath")
+    types = lookup("Vec2", library_name="vmath")
+    assert "proc vec2*" in procs and "type Vec2*" not in procs
+    assert "type Vec2*" in types and "proc vec2*" not in types
+    assert lookup("new_image", library_name="pixie") == lookup(
+        "newImage", library_name="pixie"
+    ).replace("'newImage'", "'new_image'")
+
+
+# Pagination
+
+
+def example_keys(output: str) -> list:
+    """(library, example header) for every code example on a page."""
+    keys, library = [], ""
+    for line in output.split("\n"):
+        if line.startswith("--- ") and line.endswith(" ---"):
+            library = line[4:-4]
+        elif line.startswith("Example "):
+            keys.append((library, line))
+    return keys
+
+
+def test_code_example_pages_cover_every_example_once(server):
+    extract = tool(server, "extract_nim_code_examples")
+    everything = example_keys(extract(limit=50))
+    assert len(everything) > 4
+
+    paged, offset = [], 0
+    while True:
+        page = extract(offset=offset, limit=4)
+        if page.startswith("No code examples"):
+            break
+        keys = example_keys(page)
+        assert 0 < len(keys) <= 4
+        paged.extend(keys)
+        offset += len(keys)
+        if "More examples available" not in page:
+            break
+        assert f"offset={offset}" in page
+
+    assert paged == everything
+    assert len(set(paged)) == len(paged)
+    assert f"({len(everything)} total)" in extract(offset=len(everything))
+
+
+# Index build
+
+
+def test_parallel_and_serial_indexing_agree(work_dir, monkeypatch, capsys):
+    server = load_server(work_dir)
+    monkeypatch.setattr(server, "INDEX_CHUNK_LINES", 2000)
+    serial = server.build_libraries(server.list_library_dirs())
+
+    pools = []
+
+    class RecordingPool(server.ProcessPoolExecutor):
+        def __init__(self, *args, **kwargs):
+            pools.append(self)
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(server, "ProcessPoolExecutor", RecordingPool)
+    monkeypatch.setattr(server, "PARALLEL_INDEX_MIN_LINES", 0)
+    monkeypatch.setattr(os, "cpu_count", lambda: 2)
+    parallel = server.build_libraries(server.list_library_dirs())
+
+    assert pools
+    assert "Parallel indexing failed" not in capsys.readouterr().err
+    assert sorted(parallel) == sorted(serial)
+    for key, lib in serial.items():
+        assert parallel[key].to_dict() == lib.to_dict()
+
+
+def insert_line(path: Path, after: str, line: str) -> None:
+    """Insert line two lines below the line `after`, past its FILE marker."""
+    lines = path.read_text(encoding="utf-8").split("\n")
+    lines.insert(lines.index(after) + 2, line)
+    path.write_text("\n".join(lines), encoding="utf-8")
+
+
+def test_restart_reindexes_only_the_changed_block(work_dir, monkeypatch):
+    wait_loaded(load_server(work_dir))
+    pixie_file = work_dir / "refs" / "pixie" / "pixie_full_context.txt"
+    insert_line(pixie_file, "FILE: examples/heart.nim", "# zzqx inserted line")
+    os.utime(pixie_file, (time.time() + 10, time.time() + 10))
+
+    server = load_server(work_dir)
+    batches = []
+    index_pending_blocks = server.index_pending_blocks
+    monkeypatch.setattr(
+        server,
+        "index_pending_blocks",
+        lambda pending: batches.append(pending) or index_pending_blocks(pending),
+    )
+    wait_loaded(server)
+
+    assert [[(lib, lines[1]) for lib, _, lines, _ in b] for b in batches] == [
+        [("pixie", "FILE: examples/heart.nim")]
+    ]
+    fresh = server.build_libraries(["pixie"])["pixie"]
+    assert server.LIBRARY_INDEX["pixie"].to_dict() == fresh.to_dict()
+    assert "zzqx" in tool(server, "search_nim_docs")("zzqx inserted")
+
+
+# Regex search
+
+CATASTROPHIC_PATTERN = r"(\w+\s*)*x$"
+
+
+def test_catastrophic_regex_stops_at_the_budget(server):
+    search = tool(server, "search_nim_docs")
+    started = time.monotonic()
+    output = search(CATASTROPHIC_PATTERN, search_type="regex")
+    elapsed = time.monotonic() - started
+    assert elapsed < server.REGEX_TIME_BUDGET + 1.0
+    assert "stopped after" in output
+    assert search(r"proc\s+newImage", search_type="regex").startswith(
+        "Search Results"
+    )
+
+
+def test_cancelled_regex_search_stops_promptly(server):
+    search = tool(server, "search_nim_docs")
+    cancel = threading.Event()
+    token = server.TOOL_CANCEL.set(cancel)
+    timer = threading.Timer(0.1, cancel.set)
+    started = time.monotonic()
+    timer.start()
+    try:
+        with pytest.raises(server.ToolCancelled):
+            search(CATASTROPHIC_PATTERN, search_type="regex")
+    finally:
+        server.TOOL_CANCEL.reset(token)
+        timer.cancel()
+    assert time.monotonic() - started < server.REGEX_TIME_BUDGET
+
+
+# Top-k search
+
+
+def first_result(output: str) -> str:
+    return output.split("\n[2] ")[0].split("[1] ", 1)[1].rstrip()
+
+
+def test_top_k_search_skips_hits_and_libraries_that_cannot_place(
+    server, monkeypatch
+):
+    search = tool(server, "search_nim_docs")
+    best = first_result(search("newImage", max_results=50))
+
+    scored = []
+    score = server.WindowScorer.score
+    monkeypatch.setattr(
+        server.WindowScorer,
+        "score",
+        lambda self, i: scored.append((self.lib.name, i)) or score(self, i),
+    )
+    assert first_result(search("newImage", max_results=1)) == best
+
+    hits = {
+        lib.name: server.find_hit_lines(lib, server.DOCUMENT_STORE.get(lib), "newImage")
+        for lib in server.LIBRARY_INDEX.values()
+    }
+    assert hits["vmath"][0]
+    assert "vmath" not in {name for name, _ in scored}
+    assert len(scored) < sum(len(lines) for lines, _ in hits.values())
+
+
+def result_blocks(output: str) -> str:
+    return "\n[".join(output.split("\n[")[1:])
+
+
+def test_batch_search_matches_single_searches(server):
+    queries = ["newImage", "fillPath", "proc draw", "vec2(", "Image", "zzzq", "a"]
+    batch = tool(server, "batch_search_nim_docs")(queries, max_results=5)
+    search = tool(server, "search_nim_docs")
+    starts = [0]
+    for query in queries:
+        starts.append(batch.index(f"## '{query}' (", starts[-1]))
+    starts.append(len(batch))
+    for query, start, end in zip(queries, starts[1:], starts[2:]):
+        section = batch[start:end]
+        single = search(query, max_results=5)
+        if single.startswith("No results"):
+            assert "(0 matches)" in section
+        else:
+            assert result_blocks(section) == result_blocks(single)
+
+
+# Compressed documents
+
+COMPRESSED_CALLS = [
+    ("search_nim_docs", ("newImage",), {}),
+    ("search_nim_docs", (r"fill\w*Path",), {"search_type": "regex"}),
+    ("get_nim_doc_section", ("pixie", "Text"), {}),
+    ("get_nim_source_file", ("vmath", "src/vmath.nim"), {"start_line": 100}),
+    ("lookup_nim_symbol", ("newImage",), {}),
+    ("extract_nim_code_examples", ("boxy",), {}),
+]
+
+
+def compressed_call_answers(server) -> list:
+    return [tool(server, name)(*args, **kw) for name, args, kw in COMPRESSED_CALLS]
+
+
+def test_compressed_documents_answer_like_plain_ones(server, work_dir):
+    plain = compressed_call_answers(server)
+
+    for lib_dir in (work_dir / "refs").iterdir():
+        source = lib_dir / f"{lib_dir.name}{server.FULL_CONTEXT_SUFFIX}"
+        target = lib_dir / f"{lib_dir.name}{server.COMPRESSED_CONTEXT_SUFFIX}"
+        server.write_compressed_context(str(source), str(target))
+        source.unlink()
+    server = wait_loaded(load_server(work_dir))
+
+    assert all(
+        isinstance(server.DOCUMENT_STORE.get(lib), server.CompressedDocument)
+        for lib in server.LIBRARY_INDEX.values()
+    )
+    assert compressed_call_answers(server) == plain
+
+
+# Watcher
+
+
+def test_watcher_picks_up_an_edited_library(work_dir, monkeypatch):
+    server = wait_loaded(load_server(work_dir))
+    monkeypatch.setattr(server, "WATCH_SETTLE", 0.05)
+    search = tool(server, "search_nim_docs")
+    assert search("zzqxWatched").startswith("No results")
+
+    watcher = server.LibraryWatcher(server.LIBRARY_INDEX, 0.1)
+    watcher.start()
+    try:
+        vmath_file = work_dir / "refs" / "vmath" / "vmath_full_context.txt"
+        insert_line(vmath_file, "FILE: src/vmath.nim", "proc zzqxWatched*() = discard")
+        os.utime(vmath_file, (time.time() + 10, time.time() + 10))
+        deadline = time.monotonic() + 10
+        while search("zzqxWatched").startswith("No results"):
+            assert time.monotonic() < deadline, "watcher did not refresh vmath"
+            time.sleep(0.05)
+    finally:
+        watcher.stop()
+
+    assert "proc zzqxWatched*" in tool(server, "lookup_nim_symbol")("zzqxWatched")
+
+
+# Response budgets
+
+BUDGETS = [1, 10, 30, 50, 75, 100, 150, 200, 300, 500, 1000, 2000, 4000]
+
+
+@pytest.mark.parametrize("max_chars", BUDGETS)
+@pytest.mark.parametrize(
+    "query, search_type",
+    [
+        ("newImage", "substring"),
+        ("proc draw", "substring"),
+        ("fill.*Path", "regex"),
+        ("image", "topic"),
+        ("zzzq", "substring"),
+    ],
+)
+def test_search_output_fits_max_chars(server, query, search_type, max_chars):
+    output = tool(server, "search_nim_docs")(
+        query, search_type=search_type, max_chars=max_chars
+    )
+    assert len(output) <= max_chars
+
+
+@pytest.mark.parametrize("max_chars", BUDGETS)
+@pytest.mark.parametrize(
+    "library, section", [("pixie", ""), ("pixie", "Text"), ("vmath", "About")]
+)
+def test_doc_section_fits_max_chars_and_shows_its_first_line(
+    server, library, section, max_chars
+):
+    get_section = tool(server, "get_nim_doc_section")
+    full = get_section(library, section).strip("\n")
+    output = get_section(library, section, max_chars=max_chars)
+    assert 0 < len(output) <= max_chars
+    first_line = full.split("\n")[0]
+    assert first_line.startswith(output.rstrip(".")[: len(first_line)])
+
+
+def test_small_search_budget_still_shows_a_hit(server):
+    output = tool(server, "search_nim_docs")("newImage", max_chars=100)
+    assert "newImage(" in output
+
+
+# Metrics
+
+
+def test_overlapping_profiled_calls_run_one_profile_at_a_time(
+    server, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(server, "PROFILE_TOOLS", frozenset({"*"}))
+    monkeypatch.setattr(server, "PROFILE_RATE", 1.0)
+    monkeypatch.setattr(server, "PROFILE_DIR", str(tmp_path))
+    metrics = server.ServerMetrics()
+    started, release = threading.Event(), threading.Event()
+
+    def slow_tool():
+        started.set()
+        release.wait(5)
+        return "slow"
+
+    results = []
+    worker = threading.Thread(
+        target=lambda: results.append(metrics.run_tool("slow", slow_tool, (), {}))
+    )
+    worker.start()
+    started.wait(5)
+    try:
+        assert metrics.run_tool("fast", lambda: "fast", (), {}) == "fast"
+    finally:
+        release.set()
+        worker.join()
+    assert results == ["slow"]
+    assert [p.name.split("-")[0] for p in tmp_path.iterdir()] == ["slow"]
+
+    assert metrics.run_tool("fast", lambda: "fast", (), {}) == "fast"
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_stats_report_document_bytes(server):
+    tool(server, "search_nim_docs")("newImage")
+    stats = json.loads(tool(server, "get_knowledge_server_stats")())
+    pixie = stats["libraries"]["pixie"]
+    assert pixie["document_bytes"] > 0
+    assert "mapped_bytes" not in pixie
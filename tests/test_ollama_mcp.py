@@ -0,0 +1,275 @@
+"""Tests for scripts/ollama_mcp.py: the request queue, against a stub Ollama,
+image preparation, and the pure-Python PNG codec and golden image diff.
+
+Run with: python3 -m unittest tests/test_ollama_mcp.py
+"""
+
+import asyncio
+import json
+import sys
+import struct
+import tempfile
+import threading
+import time
+import unittest
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "scripts"))
+
+import ollama_mcp  # noqa: E402
+from ollama_mcp import VisionQueue  # noqa: E402
+
+numpy = ollama_mcp.numpy
+
+REPLY_DELAY = 0.2
+
+
+class StubOllama(BaseHTTPRequestHandler):
+    """Answers /api/chat after REPLY_DELAY, recording calls and concurrency."""
+
+    protocol_version = "HTTP/1.1"
+    lock = threading.Lock()
+    questions: list = []
+    active = 0
+    peak = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        question = body["messages"][0]["content"]
+        cls = type(self)
+        with cls.lock:
+            cls.questions.append(question)
+            cls.active += 1
+            cls.peak = max(cls.peak, cls.active)
+        time.sleep(REPLY_DELAY)
+        with cls.lock:
+            cls.active -= 1
+
+        reply = {
+            "model": body["model"],
+            "created_at": "2024-01-01T00:00:00Z",
+            "message": {"role": "assistant", "content": f"answer to {question}"},
+            "done": True,
+        }
+        payload = json.dumps(reply).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+class VisionQueueTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StubOllama)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.host = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        with StubOllama.lock:
+            StubOllama.questions = []
+            StubOllama.active = StubOllama.peak = 0
+
+    def ask(self, queue, question, key=None):
+        return queue.ask(key or question, question, [b"image"], "stub-model")
+
+    async def test_identical_requests_share_one_call(self):
+        queue = VisionQueue(self.host, max_concurrent=1, max_queued=4)
+        answers = await asyncio.gather(*[self.ask(queue, "q") for _ in range(3)])
+        self.assertEqual(answers, ["answer to q"] * 3)
+        self.assertEqual(StubOllama.questions, ["q"])
+        self.assertEqual(queue.pending, 0)
+
+    async def test_concurrency_is_bounded(self):
+        queue = VisionQueue(self.host, max_concurrent=2, max_queued=4)
+        questions = [f"q{i}" for i in range(5)]
+        answers = await asyncio.gather(*[self.ask(queue, q) for q in questions])
+        self.assertEqual(answers, [f"answer to {q}" for q in questions])
+        self.assertEqual(StubOllama.peak, 2)
+
+    async def test_full_queue_turns_callers_away(self):
+        queue = VisionQueue(self.host, max_concurrent=1, max_queued=1)
+        first = asyncio.ensure_future(self.ask(queue, "a"))
+        second = asyncio.ensure_future(self.ask(queue, "b"))
+        await asyncio.sleep(0)
+        with self.assertRaises(RuntimeError):
+            await self.ask(queue, "c")
+        self.assertEqual(await first, "answer to a")
+        self.assertEqual(await second, "answer to b")
+
+    async def test_cancelled_caller_does_not_cancel_other_waiters(self):
+        queue = VisionQueue(self.host, max_concurrent=1, max_queued=4)
+        first = asyncio.ensure_future(self.ask(queue, "q"))
+        second = asyncio.ensure_future(self.ask(queue, "q"))
+        await asyncio.sleep(REPLY_DELAY / 4)
+        first.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await first
+        self.assertEqual(await second, "answer to q")
+        self.assertEqual(StubOllama.questions, ["q"])
+
+    async def test_request_is_cancelled_when_every_caller_leaves(self):
+        queue = VisionQueue(self.host, max_concurrent=1, max_queued=4)
+        running = asyncio.ensure_future(self.ask(queue, "slow"))
+        queued = asyncio.ensure_future(self.ask(queue, "queued"))
+        await asyncio.sleep(REPLY_DELAY / 4)
+        queued.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await queued
+        await asyncio.sleep(0)
+        self.assertEqual(queue.pending, 1)
+        self.assertEqual(await running, "answer to slow")
+        self.assertEqual(StubOllama.questions, ["slow"])
+
+
+def filtered_png(pixels) -> bytes:
+    """An RGBA PNG whose rows cycle through all five filter types."""
+    height, width, bpp = pixels.shape
+    raw = bytearray()
+    prior = bytes(width * bpp)
+    for y in range(height):
+        line = pixels[y].tobytes()
+        kind = y % 5
+        raw.append(kind)
+        for i, value in enumerate(line):
+            left = line[i - bpp] if i >= bpp else 0
+            up = prior[i]
+            up_left = prior[i - bpp] if i >= bpp else 0
+            estimate = left + up - up_left
+            paeth = min(
+                (abs(estimate - left), 0, left),
+                (abs(estimate - up), 1, up),
+                (abs(estimate - up_left), 2, up_left),
+            )[2]
+            predicted = [0, left, up, (left + up) >> 1, paeth][kind]
+            raw.append((value - predicted) & 0xFF)
+        prior = line
+
+    def chunk(kind: bytes, body: bytes) -> bytes:
+        crc = zlib.crc32(kind + body) & 0xFFFFFFFF
+        return struct.pack(">I", len(body)) + kind + body + struct.pack(">I", crc)
+
+    return (
+        ollama_mcp.PNG_SIGNATURE
+        + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        + chunk(b"IDAT", zlib.compress(bytes(raw)))
+        + chunk(b"IEND", b"")
+    )
+
+
+@unittest.skipIf(numpy is None, "needs NumPy")
+class PngCodecTest(unittest.TestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(7)
+        self.pixels = rng.integers(0, 256, (23, 17, 4), numpy.uint8)
+
+    def test_every_filter_type_decodes(self):
+        decoded = ollama_mcp.decode_png(filtered_png(self.pixels))
+        numpy.testing.assert_array_equal(decoded, self.pixels)
+
+    def test_round_trip_and_partial_decode(self):
+        data = ollama_mcp.encode_png(self.pixels)
+        numpy.testing.assert_array_equal(ollama_mcp.decode_png(data), self.pixels)
+        numpy.testing.assert_array_equal(
+            ollama_mcp.decode_png(data, rows=5), self.pixels[:5]
+        )
+
+    def test_rgb_gains_an_opaque_alpha_channel(self):
+        data = ollama_mcp.encode_png(self.pixels[..., :3].copy())
+        decoded = ollama_mcp.decode_png(data)
+        numpy.testing.assert_array_equal(decoded[..., :3], self.pixels[..., :3])
+        self.assertTrue((decoded[..., 3] == 255).all())
+
+
+@unittest.skipIf(numpy is None, "needs NumPy")
+class PrepareImageTest(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        rng = numpy.random.default_rng(5)
+        self.pixels = rng.integers(0, 256, (200, 300, 4), numpy.uint8)
+        self.png = filtered_png(self.pixels)
+
+    def test_large_png_is_shrunk(self):
+        image, note = ollama_mcp.prepare_image(self.png, None, 100)
+        self.assertEqual(note, "")
+        self.assertLessEqual(max(ollama_mcp.image_size(image)), 100)
+
+    def test_crop_then_shrink(self):
+        image, note = ollama_mcp.prepare_image(self.png, [10, 20, 150, 60], 50)
+        self.assertEqual(note, "")
+        self.assertEqual(ollama_mcp.image_size(image), (50, 20))
+
+    def test_small_png_is_sent_as_is(self):
+        self.assertEqual(ollama_mcp.prepare_image(self.png, None, 400), (self.png, ""))
+
+    @unittest.skipIf(ollama_mcp.Image is not None, "PIL can resize any image")
+    async def test_answer_notes_an_image_sent_at_full_size(self):
+        async def answer(question, images):
+            return "a screenshot"
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = Path(tmp) / "screen.jpg"
+            path.write_bytes(b"\xff\xd8\xff\xe0 not decodable without PIL")
+            with mock.patch.object(ollama_mcp, "ask_vision_model", answer):
+                reply = await ollama_mcp.analyze_ui_screenshot("what?", str(path))
+        self.assertTrue(reply.startswith("a screenshot\n\n(Note: "))
+        self.assertIn("full size", reply)
+
+
+@unittest.skipIf(numpy is None, "needs NumPy")
+class CompareImagesTest(unittest.TestCase):
+    def setUp(self):
+        self.golden = numpy.full((300, 400, 4), 255, numpy.uint8)
+        self.actual = self.golden.copy()
+
+    def verdict(self):
+        report, _ = ollama_mcp.compare_images(
+            self.golden, self.actual, ollama_mcp.GOLDEN_TOLERANCE
+        )
+        return report
+
+    def test_identical_images_match(self):
+        self.assertEqual(self.verdict()["verdict"], "match")
+
+    def test_small_solid_block_is_a_mismatch(self):
+        self.actual[100:110, 50:70] = (255, 0, 0, 255)
+        report = self.verdict()
+        self.assertLess(report["mismatch_score"], ollama_mcp.GOLDEN_MATCH_RATIO * 4)
+        self.assertEqual(report["dense_region"], [50, 100, 70, 110])
+        self.assertEqual(report["verdict"], "mismatch")
+
+    def test_small_faint_block_is_ambiguous(self):
+        self.actual[100:110, 50:70] = (200, 200, 200, 255)
+        report = self.verdict()
+        self.assertLessEqual(report["max_delta"], ollama_mcp.GOLDEN_DELTA_CEILING)
+        self.assertEqual(report["verdict"], "ambiguous")
+
+    def test_one_strong_pixel_is_ambiguous(self):
+        self.actual[10, 10] = (0, 0, 0, 255)
+        self.assertEqual(self.verdict()["verdict"], "ambiguous")
+
+    def test_scattered_faint_noise_matches(self):
+        rng = numpy.random.default_rng(3)
+        ys = rng.integers(0, 300, 40)
+        xs = rng.integers(0, 400, 40)
+        self.actual[ys, xs] = (215, 215, 215, 255)
+        report = self.verdict()
+        self.assertGreater(report["changed_pixels"], 0)
+        self.assertIsNone(report["dense_region"])
+        self.assertEqual(report["verdict"], "match")
+
+
+if __name__ == "__main__":
+    unittest.main()